@@ -11,6 +11,7 @@ except ImportError:
 from config import Config
 from extensions import login_manager
 from models import load_user
+from services import assets, metrics
 
 def create_app(config_class=Config):
     app = Flask(__name__, instance_relative_config=True)
@@ -26,6 +27,10 @@ def create_app(config_class=Config):
     # Initialize Flask extensions
     login_manager.init_app(app)
     login_manager.user_loader(load_user)
+    # request/template/Sheets timings, /metrics and the opt-in profiler
+    metrics.init_app(app)
+    # the built stylesheet and fonts (python -m assets.build)
+    assets.init_app(app)
 
     # Register Blueprints
     from auth.routes import auth_bp
@@ -33,6 +38,15 @@ def create_app(config_class=Config):
     app.register_blueprint(auth_bp)
     app.register_blueprint(main_bp)
 
+    # hand back the per-user sheet clients a request used, once it is done
+    from services.sheets import release_partitions
+    app.teardown_request(release_partitions)
+
+    # start loading the books now rather than inside the first request
+    if app.config.get('STORAGE_WARM_UP'):
+        from services.storage import warm_up_storage
+        warm_up_storage(app)
+
     return app
 
 if __name__ == "__main__":
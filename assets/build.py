@@ -0,0 +1,209 @@
+"""Build the stylesheet (and copy the fonts) the pages load into ``static/dist``.
+
+    python -m assets.build                # after changing templates or static/css
+    python -m assets.build --fetch-fonts  # once, to vendor the web fonts
+
+Everything runs offline from the templates: the utility classes they use are
+compiled by ``assets.tailwind`` and combined with the preflight, the
+``@font-face`` rules for the fonts in ``static/fonts`` and ``static/css``
+into one minified stylesheet.  Every file gets a content hash in its name and
+``static/dist/manifest.json`` maps the plain names to the hashed ones;
+stylesheets are also written gzip- and (with the ``brotli`` package)
+brotli-compressed for ``services.assets`` to serve.
+"""
+import argparse
+import glob
+import gzip
+import hashlib
+import json
+import os
+import re
+import sys
+import urllib.request
+
+try:
+    import brotli
+except ImportError:  # optional; without it only .gz variants are written
+    brotli = None
+
+from assets.tailwind import PREFLIGHT, compile_css, scan
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TEMPLATES = os.path.join(ROOT, 'templates')
+STATIC = os.path.join(ROOT, 'static')
+FONTS_DIR = os.path.join(STATIC, 'fonts')
+DIST = os.path.join(STATIC, 'dist')
+
+# hand-written CSS, after the preflight and before the utilities
+STYLESHEETS = ('css/style.css',)
+# (family, weight, file in static/fonts)
+FONTS = (
+    ('Inter', 400, 'inter-400.woff2'),
+    ('Inter', 800, 'inter-800.woff2'),
+    ('JetBrains Mono', 400, 'jetbrains-mono-400.woff2'),
+    ('JetBrains Mono', 700, 'jetbrains-mono-700.woff2'),
+)
+FONTS_CSS_URL = ('https://fonts.googleapis.com/css2?family=Inter:wght@400;800'
+                 '&family=JetBrains+Mono:wght@400;700&display=swap')
+# classes that only mark elements for variants and have no CSS of their own
+MARKERS = {'group', 'peer'}
+
+_STRING = re.compile(r'"(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\'')
+_CLASS_SELECTOR = re.compile(r'\.(-?[A-Za-z_][\w-]*)')
+
+
+class BuildError(Exception):
+    """The templates use something the build can't produce."""
+
+
+def minify(css):
+    """Drop comments and the whitespace CSS doesn't need (strings are left
+    alone)."""
+    strings = []
+
+    def keep(match):
+        strings.append(match.group(0))
+        return f'\0{len(strings) - 1}\0'
+
+    css = _STRING.sub(keep, css)
+    css = re.sub(r'/\*.*?\*/', '', css, flags=re.S)
+    css = re.sub(r'\s+', ' ', css)
+    css = re.sub(r'\s*([{};,>~])\s*', r'\1', css)
+    css = re.sub(r':\s+', ':', css)
+    css = css.replace(';}', '}').strip()
+    # an empty custom property needs its space
+    css = re.sub(r'(--[\w-]+):(?=[;}])', r'\1: ', css)
+    return re.sub(r'\0(\d+)\0', lambda m: strings[int(m.group(1))], css)
+
+
+def fingerprint(name, data):
+    stem, ext = os.path.splitext(name)
+    return f'{stem}.{hashlib.sha256(data).hexdigest()[:12]}{ext}'
+
+
+def _compressed(path, data):
+    with open(path + '.gz', 'wb') as f:
+        # mtime=0 keeps the output byte-for-byte reproducible
+        with gzip.GzipFile(fileobj=f, mode='wb', compresslevel=9, mtime=0) as gz:
+            gz.write(data)
+    if brotli is not None:
+        with open(path + '.br', 'wb') as f:
+            f.write(brotli.compress(data, quality=11))
+
+
+def _remove_previous(dist):
+    # only what the last build wrote, in case --dist points somewhere shared
+    os.makedirs(dist, exist_ok=True)
+    try:
+        with open(os.path.join(dist, 'manifest.json')) as f:
+            previous = json.load(f)
+    except (OSError, ValueError):
+        return
+    for hashed in previous.values():
+        for ext in ('', '.gz', '.br'):
+            try:
+                os.remove(os.path.join(dist, os.path.basename(hashed) + ext))
+            except FileNotFoundError:
+                pass
+
+
+def build(dist=DIST, templates=TEMPLATES, static=STATIC):
+    """Write the hashed assets and manifest to ``dist`` and return the
+    manifest.  Raises ``BuildError``, before writing anything, when the
+    templates use classes nothing defines."""
+    classes = set()
+    for path in sorted(glob.glob(os.path.join(templates, '*.html'))):
+        with open(path, encoding='utf-8') as f:
+            classes |= scan(f.read())
+
+    hand_written = []
+    for name in STYLESHEETS:
+        with open(os.path.join(static, name), encoding='utf-8') as f:
+            hand_written.append(f.read())
+    custom = set(_CLASS_SELECTOR.findall(_STRING.sub('', '\n'.join(hand_written))))
+    utilities, unknown = compile_css(classes - custom - MARKERS)
+    if unknown:
+        raise BuildError(f'no CSS for classes (extend assets/tailwind.py): {" ".join(unknown)}')
+    # all or nothing: without them base.html loads every font from Google
+    missing = [name for _, _, name in FONTS if not os.path.exists(os.path.join(static, 'fonts', name))]
+    if missing and len(missing) < len(FONTS):
+        raise BuildError(f'fonts missing from static/fonts: {", ".join(missing)}')
+
+    _remove_previous(dist)
+    manifest = {}
+    font_faces = []
+    for family, weight, name in FONTS if not missing else ():
+        path = os.path.join(static, 'fonts', name)
+        with open(path, 'rb') as f:
+            data = f.read()
+        manifest[name] = fingerprint(name, data)
+        with open(os.path.join(dist, manifest[name]), 'wb') as f:
+            f.write(data)
+        font_faces.append(
+            f"@font-face{{font-family:'{family}';font-style:normal;font-weight:{weight};"
+            f"font-display:swap;src:url({manifest[name]}) format('woff2')}}"
+        )
+
+    css = minify('\n'.join(font_faces + [PREFLIGHT] + hand_written + [utilities]))
+    data = css.encode()
+    manifest['app.css'] = fingerprint('app.css', data)
+    path = os.path.join(dist, manifest['app.css'])
+    with open(path, 'wb') as f:
+        f.write(data)
+    _compressed(path, data)
+
+    with open(os.path.join(dist, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+def fetch_fonts(directory=FONTS_DIR):
+    """Download the latin subsets of the fonts in ``FONTS`` from Google Fonts
+    into ``directory`` (to be committed; the build itself stays offline)."""
+    # a browser user agent gets woff2 files back
+    headers = {'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 Chrome/120.0 Safari/537.36'}
+    with urllib.request.urlopen(urllib.request.Request(FONTS_CSS_URL, headers=headers), timeout=30) as r:
+        css = r.read().decode()
+    os.makedirs(directory, exist_ok=True)
+    wanted = {(family, weight): name for family, weight, name in FONTS}
+    for subset, rule in re.findall(r'/\* ([\w-]+) \*/\s*@font-face\s*{(.*?)}', css, re.S):
+        if subset != 'latin':
+            continue
+        family = re.search(r"font-family:\s*'([^']+)'", rule).group(1)
+        weight = int(re.search(r'font-weight:\s*(\d+)', rule).group(1))
+        url = re.search(r'url\((https://[^)]+\.woff2)\)', rule).group(1)
+        name = wanted.get((family, weight))
+        if name:
+            with urllib.request.urlopen(url, timeout=30) as r, open(os.path.join(directory, name), 'wb') as f:
+                f.write(r.read())
+            print(f'fetched {name}')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--fetch-fonts', action='store_true', help='download the fonts into static/fonts first')
+    parser.add_argument('--dist', default=DIST, help='output directory')
+    args = parser.parse_args(argv)
+
+    if args.fetch_fonts:
+        fetch_fonts()
+    try:
+        manifest = build(args.dist)
+    except BuildError as e:
+        print(f'build failed: {e}', file=sys.stderr)
+        return 1
+    for name, hashed in sorted(manifest.items()):
+        path = os.path.join(args.dist, hashed)
+        sizes = [f'{os.path.getsize(path):>8} B']
+        sizes += [f'{ext[1:]} {os.path.getsize(path + ext):>7} B'
+                  for ext in ('.gz', '.br') if os.path.exists(path + ext)]
+        print(f'{hashed:<40}' + '  '.join(sizes))
+    missing = [name for _, _, name in FONTS if name not in manifest]
+    if missing:
+        print(f'fonts not in static/fonts, pages load them from Google Fonts '
+              f'(run with --fetch-fonts): {", ".join(missing)}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,688 @@
+"""A small, offline compiler for the Tailwind utility classes the templates use.
+
+It understands the subset of Tailwind v3 found in ``templates/*.html``
+(spacing, sizing, flex/grid, typography, colours with opacity modifiers,
+gradients, borders, shadows, filters, transforms, transitions, arbitrary
+``[...]`` values) with the ``hover:``, ``focus:``, ``group-hover:`` and
+responsive variants, and emits minified CSS for just the classes it finds.
+Classes it doesn't know are reported rather than guessed at; extend the
+tables below when a template needs one.
+"""
+import re
+
+SCREENS = {'sm': '640px', 'md': '768px', 'lg': '1024px', 'xl': '1280px', '2xl': '1536px'}
+
+# pseudo-class variants, in the order Tailwind emits them
+PSEUDO = {
+    'first': ':first-child', 'last': ':last-child', 'group-hover': None,
+    'hover': ':hover', 'focus': ':focus', 'focus-visible': ':focus-visible',
+    'active': ':active', 'disabled': ':disabled',
+}
+
+_SHADES = (50, 100, 200, 300, 400, 500, 600, 700, 800, 900, 950)
+PALETTE = {'black': '#000000', 'white': '#ffffff'}
+for _family, _hexes in {
+    'gray': 'f9fafb f3f4f6 e5e7eb d1d5db 9ca3af 6b7280 4b5563 374151 1f2937 111827 030712',
+    'zinc': 'fafafa f4f4f5 e4e4e7 d4d4d8 a1a1aa 71717a 52525b 3f3f46 27272a 18181b 09090b',
+    'red': 'fef2f2 fee2e2 fecaca fca5a5 f87171 ef4444 dc2626 b91c1c 991b1b 7f1d1d 450a0a',
+    'yellow': 'fefce8 fef9c3 fef08a fde047 facc15 eab308 ca8a04 a16207 854d0e 713f12 422006',
+    'green': 'f0fdf4 dcfce7 bbf7d0 86efac 4ade80 22c55e 16a34a 15803d 166534 14532d 052e16',
+    'teal': 'f0fdfa ccfbf1 99f6e4 5eead4 2dd4bf 14b8a6 0d9488 0f766e 115e59 134e4a 042f2e',
+    'cyan': 'ecfeff cffafe a5f3fc 67e8f9 22d3ee 06b6d4 0891b2 0e7490 155e75 164e63 083344',
+    'pink': 'fdf2f8 fce7f3 fbcfe8 f9a8d4 f472b6 ec4899 db2777 be185d 9d174d 831843 500724',
+}.items():
+    for _shade, _hex in zip(_SHADES, _hexes.split()):
+        PALETTE[f'{_family}-{_shade}'] = '#' + _hex
+
+FONT_SIZES = {
+    'xs': ('0.75rem', '1rem'), 'sm': ('0.875rem', '1.25rem'), 'base': ('1rem', '1.5rem'),
+    'lg': ('1.125rem', '1.75rem'), 'xl': ('1.25rem', '1.75rem'), '2xl': ('1.5rem', '2rem'),
+    '3xl': ('1.875rem', '2.25rem'), '4xl': ('2.25rem', '2.5rem'), '5xl': ('3rem', '1'),
+    '6xl': ('3.75rem', '1'), '7xl': ('4.5rem', '1'),
+}
+MAX_WIDTHS = {
+    'xs': '20rem', 'sm': '24rem', 'md': '28rem', 'lg': '32rem', 'xl': '36rem', '2xl': '42rem',
+    '3xl': '48rem', '4xl': '56rem', '5xl': '64rem', '6xl': '72rem', '7xl': '80rem',
+    'full': '100%', 'none': 'none', 'prose': '65ch',
+}
+RADII = {
+    '': '0.25rem', 'none': '0px', 'sm': '0.125rem', 'md': '0.375rem', 'lg': '0.5rem',
+    'xl': '0.75rem', '2xl': '1rem', '3xl': '1.5rem', 'full': '9999px',
+}
+SHADOWS = {
+    'sm': '0 1px 2px 0 rgb(0 0 0 / 0.05)',
+    '': '0 1px 3px 0 rgb(0 0 0 / 0.1), 0 1px 2px -1px rgb(0 0 0 / 0.1)',
+    'md': '0 4px 6px -1px rgb(0 0 0 / 0.1), 0 2px 4px -2px rgb(0 0 0 / 0.1)',
+    'lg': '0 10px 15px -3px rgb(0 0 0 / 0.1), 0 4px 6px -4px rgb(0 0 0 / 0.1)',
+    'xl': '0 20px 25px -5px rgb(0 0 0 / 0.1), 0 8px 10px -6px rgb(0 0 0 / 0.1)',
+    '2xl': '0 25px 50px -12px rgb(0 0 0 / 0.25)',
+    'none': '0 0 #0000',
+}
+DROP_SHADOWS = {
+    'sm': 'drop-shadow(0 1px 1px rgb(0 0 0 / 0.05))',
+    '': 'drop-shadow(0 1px 2px rgb(0 0 0 / 0.1)) drop-shadow(0 1px 1px rgb(0 0 0 / 0.06))',
+    'md': 'drop-shadow(0 4px 3px rgb(0 0 0 / 0.07)) drop-shadow(0 2px 2px rgb(0 0 0 / 0.06))',
+    'lg': 'drop-shadow(0 10px 8px rgb(0 0 0 / 0.04)) drop-shadow(0 4px 3px rgb(0 0 0 / 0.1))',
+}
+BLURS = {'none': '0', 'sm': '4px', '': '8px', 'md': '12px', 'lg': '16px', 'xl': '24px', '2xl': '40px', '3xl': '64px'}
+TRACKING = {
+    'tighter': '-0.05em', 'tight': '-0.025em', 'normal': '0em',
+    'wide': '0.025em', 'wider': '0.05em', 'widest': '0.1em',
+}
+LEADING = {'none': '1', 'tight': '1.25', 'snug': '1.375', 'normal': '1.5', 'relaxed': '1.625', 'loose': '2'}
+FONT_WEIGHTS = {
+    'thin': '100', 'extralight': '200', 'light': '300', 'normal': '400', 'medium': '500',
+    'semibold': '600', 'bold': '700', 'extrabold': '800', 'black': '900',
+}
+FONT_FAMILIES = {
+    'sans': 'ui-sans-serif, system-ui, sans-serif',
+    'mono': 'ui-monospace, SFMono-Regular, Menlo, Monaco, Consolas, monospace',
+}
+GRADIENT_SIDES = {
+    't': 'top', 'tr': 'top right', 'r': 'right', 'br': 'bottom right',
+    'b': 'bottom', 'bl': 'bottom left', 'l': 'left', 'tl': 'top left',
+}
+
+_EASE = 'cubic-bezier(0.4, 0, 0.2, 1)'
+_TRANSITIONS = {
+    '': 'color, background-color, border-color, text-decoration-color, fill, stroke, opacity, '
+        'box-shadow, transform, filter, backdrop-filter',
+    'all': 'all',
+    'colors': 'color, background-color, border-color, text-decoration-color, fill, stroke',
+    'opacity': 'opacity',
+    'shadow': 'box-shadow',
+    'transform': 'transform',
+}
+_TRANSFORM = ('translate(var(--tw-translate-x), var(--tw-translate-y)) rotate(var(--tw-rotate)) '
+              'scale(var(--tw-scale-x), var(--tw-scale-y))')
+_FILTER = 'var(--tw-blur) var(--tw-grayscale) var(--tw-drop-shadow)'
+_BOX_SHADOW = 'var(--tw-ring-offset-shadow), var(--tw-ring-shadow), var(--tw-shadow)'
+_SPACE_CHILDREN = ' > :not([hidden]) ~ :not([hidden])'
+
+KEYFRAMES = {
+    'pulse': '@keyframes pulse{50%{opacity:.5}}',
+    'spin': '@keyframes spin{to{transform:rotate(360deg)}}',
+}
+ANIMATIONS = {
+    'pulse': ('pulse 2s cubic-bezier(0.4, 0, 0.6, 1) infinite', 'pulse'),
+    'spin': ('spin 1s linear infinite', 'spin'),
+    'none': ('none', None),
+}
+
+# Tailwind's preflight (trimmed to what matters for these pages) plus the
+# defaults of the variables the composed utilities read
+PREFLIGHT = """
+*,::before,::after{box-sizing:border-box;border-width:0;border-style:solid;border-color:#e5e7eb;
+--tw-translate-x:0;--tw-translate-y:0;--tw-rotate:0;--tw-scale-x:1;--tw-scale-y:1;
+--tw-blur: ;--tw-grayscale: ;--tw-drop-shadow: ;
+--tw-ring-offset-shadow:0 0 #0000;--tw-ring-shadow:0 0 #0000;--tw-shadow:0 0 #0000}
+html{line-height:1.5;-webkit-text-size-adjust:100%;tab-size:4;
+font-family:ui-sans-serif,system-ui,sans-serif,"Apple Color Emoji","Segoe UI Emoji"}
+body{margin:0;line-height:inherit}
+hr{height:0;color:inherit;border-top-width:1px}
+h1,h2,h3,h4,h5,h6{font-size:inherit;font-weight:inherit}
+a{color:inherit;text-decoration:inherit}
+b,strong{font-weight:bolder}
+code,kbd,samp,pre{font-family:ui-monospace,SFMono-Regular,Menlo,Monaco,Consolas,monospace;font-size:1em}
+small{font-size:80%}
+table{text-indent:0;border-color:inherit;border-collapse:collapse}
+button,input,optgroup,select,textarea{font-family:inherit;font-size:100%;font-weight:inherit;
+line-height:inherit;color:inherit;margin:0;padding:0}
+button,select{text-transform:none}
+button,[type=button],[type=reset],[type=submit]{-webkit-appearance:button;background-color:transparent;
+background-image:none}
+blockquote,dl,dd,h1,h2,h3,h4,h5,h6,hr,figure,p,pre{margin:0}
+fieldset{margin:0;padding:0}
+legend{padding:0}
+ol,ul,menu{list-style:none;margin:0;padding:0}
+textarea{resize:vertical}
+input::placeholder,textarea::placeholder{opacity:1;color:#9ca3af}
+button,[role=button]{cursor:pointer}
+:disabled{cursor:default}
+img,svg,video,canvas,audio,iframe,embed,object{display:block;vertical-align:middle}
+img,video{max-width:100%;height:auto}
+[hidden]{display:none}
+"""
+
+STATIC = {
+    # layout
+    'block': [('display', 'block')], 'inline-block': [('display', 'inline-block')],
+    'inline': [('display', 'inline')], 'flex': [('display', 'flex')],
+    'inline-flex': [('display', 'inline-flex')], 'grid': [('display', 'grid')],
+    'table': [('display', 'table')], 'hidden': [('display', 'none')],
+    'static': [('position', 'static')], 'fixed': [('position', 'fixed')],
+    'absolute': [('position', 'absolute')], 'relative': [('position', 'relative')],
+    'sticky': [('position', 'sticky')],
+    'overflow-hidden': [('overflow', 'hidden')], 'overflow-auto': [('overflow', 'auto')],
+    'overflow-x-auto': [('overflow-x', 'auto')], 'overflow-y-auto': [('overflow-y', 'auto')],
+    'object-cover': [('object-fit', 'cover')], 'object-contain': [('object-fit', 'contain')],
+    # flex and grid
+    'flex-1': [('flex', '1 1 0%')], 'flex-auto': [('flex', '1 1 auto')], 'flex-none': [('flex', 'none')],
+    'flex-row': [('flex-direction', 'row')], 'flex-col': [('flex-direction', 'column')],
+    'flex-wrap': [('flex-wrap', 'wrap')], 'shrink-0': [('flex-shrink', '0')], 'grow': [('flex-grow', '1')],
+    'items-start': [('align-items', 'flex-start')], 'items-end': [('align-items', 'flex-end')],
+    'items-center': [('align-items', 'center')], 'items-baseline': [('align-items', 'baseline')],
+    'items-stretch': [('align-items', 'stretch')],
+    'justify-start': [('justify-content', 'flex-start')], 'justify-end': [('justify-content', 'flex-end')],
+    'justify-center': [('justify-content', 'center')],
+    'justify-between': [('justify-content', 'space-between')],
+    'justify-around': [('justify-content', 'space-around')],
+    'self-center': [('align-self', 'center')], 'self-start': [('align-self', 'flex-start')],
+    # borders
+    'border-solid': [('border-style', 'solid')], 'border-dashed': [('border-style', 'dashed')],
+    'border-dotted': [('border-style', 'dotted')], 'border-none': [('border-style', 'none')],
+    # effects
+    'mix-blend-overlay': [('mix-blend-mode', 'overlay')], 'mix-blend-screen': [('mix-blend-mode', 'screen')],
+    'mix-blend-multiply': [('mix-blend-mode', 'multiply')],
+    'outline-none': [('outline', '2px solid transparent'), ('outline-offset', '2px')],
+    # interactivity
+    'cursor-pointer': [('cursor', 'pointer')], 'cursor-default': [('cursor', 'default')],
+    'cursor-not-allowed': [('cursor', 'not-allowed')],
+    'pointer-events-none': [('pointer-events', 'none')], 'pointer-events-auto': [('pointer-events', 'auto')],
+    'select-none': [('-webkit-user-select', 'none'), ('user-select', 'none')],
+    'appearance-none': [('-webkit-appearance', 'none'), ('appearance', 'none')],
+    'resize-none': [('resize', 'none')],
+    # typography
+    'italic': [('font-style', 'italic')], 'not-italic': [('font-style', 'normal')],
+    'uppercase': [('text-transform', 'uppercase')], 'lowercase': [('text-transform', 'lowercase')],
+    'capitalize': [('text-transform', 'capitalize')], 'normal-case': [('text-transform', 'none')],
+    'underline': [('text-decoration-line', 'underline')], 'line-through': [('text-decoration-line', 'line-through')],
+    'no-underline': [('text-decoration-line', 'none')],
+    'text-left': [('text-align', 'left')], 'text-center': [('text-align', 'center')],
+    'text-right': [('text-align', 'right')],
+    'truncate': [('overflow', 'hidden'), ('text-overflow', 'ellipsis'), ('white-space', 'nowrap')],
+    'whitespace-nowrap': [('white-space', 'nowrap')], 'break-words': [('overflow-wrap', 'break-word')],
+    'antialiased': [('-webkit-font-smoothing', 'antialiased'), ('-moz-osx-font-smoothing', 'grayscale')],
+    # transforms and filters
+    'transform': [('transform', _TRANSFORM)], 'transform-none': [('transform', 'none')],
+    'grayscale': [('--tw-grayscale', 'grayscale(100%)'), ('filter', _FILTER)],
+    'grayscale-0': [('--tw-grayscale', 'grayscale(0)'), ('filter', _FILTER)],
+    'filter': [('filter', _FILTER)], 'filter-none': [('filter', 'none')],
+    'sr-only': [('position', 'absolute'), ('width', '1px'), ('height', '1px'), ('padding', '0'),
+                ('margin', '-1px'), ('overflow', 'hidden'), ('clip', 'rect(0, 0, 0, 0)'),
+                ('white-space', 'nowrap'), ('border-width', '0')],
+}
+
+_NUMBER = re.compile(r'^\d+(\.\d+)?$')
+_FRACTION = re.compile(r'^(\d+)/(\d+)$')
+_LENGTH = re.compile(r'^-?[\d.]+(px|rem|em|%|vh|vw|ch|ex|vmin|vmax|pt)?$')
+
+
+def escape(class_name):
+    """The class name as a CSS selector (without the dot)."""
+    out = re.sub(r'([^a-zA-Z0-9_-])', r'\\\1', class_name)
+    return '\\3' + out[0] + ' ' + out[1:] if out[0].isdigit() else out
+
+
+def _arbitrary(value):
+    if value.startswith('[') and value.endswith(']'):
+        return value[1:-1].replace('_', ' ')
+    return None
+
+
+def _number(value):
+    text = f'{value:.4f}'.rstrip('0').rstrip('.')
+    return text or '0'
+
+
+def _spacing(value, negative=False, extra=None):
+    """A spacing-scale length (``4`` -> ``1rem``), or None."""
+    css = _arbitrary(value)
+    if css is None:
+        if extra and value in extra:
+            css = extra[value]
+        elif value == 'px':
+            css = '1px'
+        elif value == '0':
+            css = '0px'
+        elif _NUMBER.match(value):
+            css = _number(float(value) / 4) + 'rem'
+        else:
+            match = _FRACTION.match(value)
+            if not match or not extra or 'full' not in extra:
+                return None
+            css = _number(int(match.group(1)) / int(match.group(2)) * 100) + '%'
+    if negative and css not in ('0px', 'auto'):
+        css = f'calc({css} * -1)'
+    return css
+
+
+def _color(value):
+    """(css colour, hex or None) for a colour name with an optional
+    ``/opacity`` modifier, or None."""
+    alpha = None
+    if '/' in value and not value.endswith(']'):
+        value, alpha = value.rsplit('/', 1)
+        alpha = _arbitrary(alpha) or (_number(int(alpha) / 100) if alpha.isdigit() else None)
+        if alpha is None:
+            return None
+    css = _arbitrary(value)
+    if css is None:
+        if value in ('transparent', 'current', 'inherit'):
+            return {'current': 'currentColor'}.get(value, value), None
+        css = PALETTE.get(value)
+        if css is None:
+            return None
+    if alpha is None:
+        return css, css if css.startswith('#') else None
+    if css.startswith('#') and len(css) == 7:
+        r, g, b = (int(css[i:i + 2], 16) for i in (1, 3, 5))
+        return f'rgb({r} {g} {b} / {alpha})', css
+    return f'color-mix(in srgb, {css} {_number(float(alpha) * 100)}%, transparent)', None
+
+
+def _transparent(hex_color):
+    if hex_color and len(hex_color) == 7:
+        r, g, b = (int(hex_color[i:i + 2], 16) for i in (1, 3, 5))
+        return f'rgb({r} {g} {b} / 0)'
+    return 'transparent'
+
+
+# --- the utility plugins, in cascade order ------------------------------------
+
+def _static(name, negative):
+    return None if negative else STATIC.get(name)
+
+
+def _inset(name, negative):
+    sides = {
+        'inset': ('top', 'right', 'bottom', 'left'), 'inset-x': ('left', 'right'),
+        'inset-y': ('top', 'bottom'), 'top': ('top',), 'right': ('right',),
+        'bottom': ('bottom',), 'left': ('left',),
+    }
+    for prefix in ('inset-x', 'inset-y', 'inset', 'top', 'right', 'bottom', 'left'):
+        if name.startswith(prefix + '-'):
+            css = _spacing(name[len(prefix) + 1:], negative, {'full': '100%', 'auto': 'auto'})
+            return css and [(side, css) for side in sides[prefix]]
+    return None
+
+
+def _z_index(name, negative):
+    if name.startswith('z-'):
+        value = name[2:]
+        css = _arbitrary(value) or (value if value.isdigit() or value == 'auto' else None)
+        return css and [('z-index', f'-{css}' if negative else css)]
+    return None
+
+
+def _grid(name, negative):
+    match = re.match(r'^grid-cols-(\d+|none)$', name)
+    if match:
+        n = match.group(1)
+        return [('grid-template-columns', 'none' if n == 'none' else f'repeat({n}, minmax(0, 1fr))')]
+    match = re.match(r'^col-span-(\d+|full)$', name)
+    if match:
+        n = match.group(1)
+        return [('grid-column', '1 / -1' if n == 'full' else f'span {n} / span {n}')]
+    return None
+
+
+def _margin(name, negative):
+    sides = {'m': ('margin',), 'mx': ('margin-left', 'margin-right'), 'my': ('margin-top', 'margin-bottom'),
+             'mt': ('margin-top',), 'mr': ('margin-right',), 'mb': ('margin-bottom',), 'ml': ('margin-left',)}
+    match = re.match(r'^(m[xytrbl]?)-(.+)$', name)
+    if match:
+        css = _spacing(match.group(2), negative, {'auto': 'auto'})
+        return css and [(prop, css) for prop in sides[match.group(1)]]
+    return None
+
+
+def _space(name, negative):
+    match = re.match(r'^space-([xy])-(.+)$', name)
+    if match:
+        css = _spacing(match.group(2), negative)
+        prop = 'margin-top' if match.group(1) == 'y' else 'margin-left'
+        return css and (_SPACE_CHILDREN, [(prop, css)])
+    return None
+
+
+def _aspect(name, negative):
+    if name.startswith('aspect-'):
+        value = name[7:]
+        css = _arbitrary(value) or {'square': '1 / 1', 'video': '16 / 9', 'auto': 'auto'}.get(value)
+        return css and [('aspect-ratio', css)]
+    return None
+
+
+def _sizing(name, negative):
+    match = re.match(r'^(min-w|min-h|max-h|w|h)-(.+)$', name)
+    if not match or negative:
+        return None
+    kind, value = match.groups()
+    prop = {'w': 'width', 'h': 'height', 'min-w': 'min-width', 'min-h': 'min-height', 'max-h': 'max-height'}[kind]
+    extra = {'full': '100%', 'auto': 'auto', 'min': 'min-content', 'max': 'max-content', 'fit': 'fit-content',
+             'screen': '100vh' if 'h' in kind else '100vw'}
+    css = _spacing(value, False, extra)
+    return css and [(prop, css)]
+
+
+def _max_width(name, negative):
+    if name.startswith('max-w-'):
+        value = name[6:]
+        css = _arbitrary(value) or MAX_WIDTHS.get(value)
+        return css and [('max-width', css)]
+    return None
+
+
+def _flex_size(name, negative):
+    match = re.match(r'^(shrink|grow|basis)-(.+)$', name)
+    if match and match.group(1) == 'basis':
+        css = _spacing(match.group(2), False, {'full': '100%', 'auto': 'auto'})
+        return css and [('flex-basis', css)]
+    return None
+
+
+def _transforms(name, negative):
+    match = re.match(r'^scale(-[xy])?-(\d+|\[.+\])$', name)
+    if match:
+        css = _arbitrary(match.group(2)) or _number(int(match.group(2)) / 100)
+        axes = (match.group(1) or '-x-y').replace('-', '')
+        return [(f'--tw-scale-{axis}', f'-{css}' if negative else css) for axis in axes] + [('transform', _TRANSFORM)]
+    match = re.match(r'^rotate-(\d+|\[.+\])$', name)
+    if match:
+        css = _arbitrary(match.group(1)) or match.group(1) + 'deg'
+        return [('--tw-rotate', f'-{css}' if negative else css), ('transform', _TRANSFORM)]
+    match = re.match(r'^translate-([xy])-(.+)$', name)
+    if match:
+        css = _spacing(match.group(2), negative, {'full': '100%'})
+        return css and [(f'--tw-translate-{match.group(1)}', css), ('transform', _TRANSFORM)]
+    return None
+
+
+def _animation(name, negative):
+    if name.startswith('animate-') and name[8:] in ANIMATIONS:
+        return [('animation', ANIMATIONS[name[8:]][0])]
+    return None
+
+
+def _gap(name, negative):
+    match = re.match(r'^gap(-[xy])?-(.+)$', name)
+    if match:
+        css = _spacing(match.group(2))
+        prop = {'': 'gap', '-x': 'column-gap', '-y': 'row-gap'}[match.group(1) or '']
+        return css and [(prop, css)]
+    return None
+
+
+def _rounded(name, negative):
+    match = re.match(r'^rounded(?:-([trbl]))?(?:-(.+))?$', name)
+    if not match:
+        return None
+    side, size = match.group(1), match.group(2) or ''
+    css = _arbitrary(size) or RADII.get(size)
+    if css is None:
+        return None
+    corners = {
+        None: ('border-radius',),
+        't': ('border-top-left-radius', 'border-top-right-radius'),
+        'r': ('border-top-right-radius', 'border-bottom-right-radius'),
+        'b': ('border-bottom-right-radius', 'border-bottom-left-radius'),
+        'l': ('border-top-left-radius', 'border-bottom-left-radius'),
+    }[side]
+    return [(prop, css) for prop in corners]
+
+
+def _border_width(name, negative):
+    match = re.match(r'^border(?:-([xytrbl]))?(?:-(\d+|\[.+\]))?$', name)
+    if not match:
+        return None
+    side, width = match.groups()
+    css = _arbitrary(width) if width and width.startswith('[') else f'{width or 1}px'
+    if not _LENGTH.match(css):
+        # border-[var(--x)] and the like are colours
+        return None
+    props = {
+        None: ('border-width',), 'x': ('border-left-width', 'border-right-width'),
+        'y': ('border-top-width', 'border-bottom-width'), 't': ('border-top-width',),
+        'r': ('border-right-width',), 'b': ('border-bottom-width',), 'l': ('border-left-width',),
+    }[side]
+    return [(prop, css) for prop in props]
+
+
+def _border_color(name, negative):
+    if name.startswith('border-'):
+        color = _color(name[7:])
+        return color and [('border-color', color[0])]
+    return None
+
+
+def _background(name, negative):
+    if name.startswith('bg-gradient-to-'):
+        side = GRADIENT_SIDES.get(name[15:])
+        return side and [('background-image', f'linear-gradient(to {side}, var(--tw-gradient-stops))')]
+    if name.startswith('bg-'):
+        color = _color(name[3:])
+        return color and [('background-color', color[0])]
+    return None
+
+
+def _gradient_from(name, negative):
+    if name.startswith('from-'):
+        color = _color(name[5:])
+        return color and [
+            ('--tw-gradient-from', color[0]),
+            ('--tw-gradient-to', _transparent(color[1])),
+            ('--tw-gradient-stops', 'var(--tw-gradient-from), var(--tw-gradient-to)'),
+        ]
+    return None
+
+
+def _gradient_to(name, negative):
+    if name.startswith('to-'):
+        color = _color(name[3:])
+        return color and [('--tw-gradient-to', color[0])]
+    return None
+
+
+def _padding(name, negative):
+    sides = {'p': ('padding',), 'px': ('padding-left', 'padding-right'), 'py': ('padding-top', 'padding-bottom'),
+             'pt': ('padding-top',), 'pr': ('padding-right',), 'pb': ('padding-bottom',), 'pl': ('padding-left',)}
+    match = re.match(r'^(p[xytrbl]?)-(.+)$', name)
+    if match and not negative:
+        css = _spacing(match.group(2))
+        return css and [(prop, css) for prop in sides[match.group(1)]]
+    return None
+
+
+def _font_family(name, negative):
+    if name.startswith('font-') and name[5:] in FONT_FAMILIES:
+        return [('font-family', FONT_FAMILIES[name[5:]])]
+    return None
+
+
+def _text(name, negative):
+    if not name.startswith('text-'):
+        return None
+    value = name[5:]
+    if value in FONT_SIZES:
+        size, line_height = FONT_SIZES[value]
+        return [('font-size', size), ('line-height', line_height)]
+    css = _arbitrary(value)
+    if css is not None and _LENGTH.match(css):
+        return [('font-size', css)]
+    color = _color(value)
+    return color and [('color', color[0])]
+
+
+def _font_weight(name, negative):
+    if name.startswith('font-') and name[5:] in FONT_WEIGHTS:
+        return [('font-weight', FONT_WEIGHTS[name[5:]])]
+    return None
+
+
+def _leading(name, negative):
+    if name.startswith('leading-'):
+        value = name[8:]
+        css = _arbitrary(value) or LEADING.get(value) or _spacing(value)
+        return css and [('line-height', css)]
+    return None
+
+
+def _tracking(name, negative):
+    if name.startswith('tracking-'):
+        value = name[9:]
+        css = _arbitrary(value) or TRACKING.get(value)
+        return css and [('letter-spacing', f'-{css}' if negative else css)]
+    return None
+
+
+def _opacity(name, negative):
+    match = re.match(r'^opacity-(\d+|\[.+\])$', name)
+    if match:
+        css = _arbitrary(match.group(1)) or _number(int(match.group(1)) / 100)
+        return [('opacity', css)]
+    return None
+
+
+def _shadow(name, negative):
+    if name == 'shadow' or name.startswith('shadow-'):
+        value = name[7:]
+        css = _arbitrary(value) or SHADOWS.get(value)
+        if css is None:
+            color = _color(value)
+            return color and [('--tw-shadow-color', color[0])]
+        return [('--tw-shadow', css), ('box-shadow', _BOX_SHADOW)]
+    return None
+
+
+def _ring(name, negative):
+    match = re.match(r'^ring(?:-(\d+))?$', name)
+    if match:
+        width = match.group(1) or '3'
+        return [
+            ('--tw-ring-offset-shadow', '0 0 #0000'),
+            ('--tw-ring-shadow', f'0 0 0 {width}px var(--tw-ring-color, rgb(59 130 246 / 0.5))'),
+            ('box-shadow', _BOX_SHADOW),
+        ]
+    return None
+
+
+def _filters(name, negative):
+    if name == 'blur' or name.startswith('blur-'):
+        value = name[5:]
+        css = _arbitrary(value) or BLURS.get(value)
+        return css and [('--tw-blur', f'blur({css})'), ('filter', _FILTER)]
+    if name.startswith('grayscale-['):
+        return [('--tw-grayscale', f'grayscale({_arbitrary(name[10:])})'), ('filter', _FILTER)]
+    if name == 'drop-shadow' or name.startswith('drop-shadow-'):
+        css = DROP_SHADOWS.get(name[12:])
+        return css and [('--tw-drop-shadow', css), ('filter', _FILTER)]
+    return None
+
+
+def _transition(name, negative):
+    if name == 'transition' or name.startswith('transition-'):
+        props = _TRANSITIONS.get(name[11:])
+        if name == 'transition-none':
+            return [('transition-property', 'none')]
+        return props and [
+            ('transition-property', props),
+            ('transition-timing-function', _EASE),
+            ('transition-duration', '150ms'),
+        ]
+    match = re.match(r'^duration-(\d+)$', name)
+    if match:
+        return [('transition-duration', match.group(1) + 'ms')]
+    match = re.match(r'^delay-(\d+)$', name)
+    if match:
+        return [('transition-delay', match.group(1) + 'ms')]
+    return None
+
+
+PLUGINS = (
+    _static, _inset, _z_index, _grid, _margin, _aspect, _sizing, _max_width, _flex_size,
+    _transforms, _animation, _gap, _space, _rounded, _border_width, _border_color,
+    _background, _gradient_from, _gradient_to, _padding, _font_family, _text, _font_weight,
+    _leading, _tracking, _opacity, _shadow, _ring, _filters, _transition,
+)
+
+
+def _split_variants(class_name):
+    # "md:hover:bg-[url(a:b)]" -> ['md', 'hover'], 'bg-[url(a:b)]'
+    parts, depth, start = [], 0, 0
+    for i, char in enumerate(class_name):
+        if char == '[':
+            depth += 1
+        elif char == ']':
+            depth -= 1
+        elif char == ':' and depth == 0:
+            parts.append(class_name[start:i])
+            start = i + 1
+    return parts, class_name[start:]
+
+
+def compile_class(class_name):
+    """``(sort key, media query or None, css rule)`` for a utility class, or
+    None when it isn't one this compiler knows."""
+    variants, utility = _split_variants(class_name)
+    negative = utility.startswith('-')
+    name = utility[1:] if negative else utility
+    for order, plugin in enumerate(PLUGINS):
+        result = plugin(name, negative)
+        if result:
+            break
+    else:
+        return None
+    suffix, declarations = result if isinstance(result, tuple) else ('', result)
+
+    screen, pseudo, prefix = None, '', ''
+    pseudo_rank = 0
+    names = list(PSEUDO)
+    for variant in variants:
+        if variant in SCREENS and screen is None:
+            screen = variant
+        elif variant == 'group-hover':
+            prefix = '.group:hover '
+            pseudo_rank = max(pseudo_rank, names.index(variant) + 1)
+        elif variant in PSEUDO:
+            pseudo += PSEUDO[variant]
+            pseudo_rank = max(pseudo_rank, names.index(variant) + 1)
+        else:
+            return None
+    selector = f'{prefix}.{escape(class_name)}{pseudo}{suffix}'
+    body = ';'.join(f'{prop}:{value}' for prop, value in declarations)
+    screen_rank = list(SCREENS).index(screen) + 1 if screen else 0
+    keyframes = None
+    if name.startswith('animate-'):
+        keyframes = ANIMATIONS[name[8:]][1]
+    # fixed classes keep their table order (block before flex before hidden)
+    position = list(STATIC).index(name) if plugin is _static else 0
+    return (screen_rank, pseudo_rank, order, position, class_name), screen, f'{selector}{{{body}}}', keyframes
+
+
+_CLASS_ATTR = re.compile(r'\bclass\s*=\s*"([^"]*)"|\bclass\s*=\s*\'([^\']*)\'', re.S)
+_JINJA = re.compile(r'{%.*?%}|{{.*?}}|{#.*?#}', re.S)
+
+
+def scan(text):
+    """Class names used in a template's ``class`` attributes (Jinja tags
+    inside them are dropped; the text between them is kept)."""
+    names = set()
+    for match in _CLASS_ATTR.finditer(text):
+        names.update(_JINJA.sub(' ', match.group(1) or match.group(2) or '').split())
+    return names
+
+
+def compile_css(class_names):
+    """Minified CSS for ``class_names``, and the names it didn't know."""
+    compiled, unknown = [], []
+    for class_name in class_names:
+        rule = compile_class(class_name)
+        if rule is None:
+            unknown.append(class_name)
+        else:
+            compiled.append(rule)
+    compiled.sort(key=lambda rule: rule[0])
+    out, media, keyframes = [], {}, set()
+    for key, screen, css, frames in compiled:
+        if frames:
+            keyframes.add(frames)
+        if screen is None:
+            out.append(css)
+        else:
+            media.setdefault(screen, []).append(css)
+    out.extend(KEYFRAMES[name] for name in sorted(keyframes))
+    for screen in SCREENS:
+        if screen in media:
+            out.append(f'@media (min-width:{SCREENS[screen]}){{{"".join(media[screen])}}}')
+    return ''.join(out), sorted(unknown)
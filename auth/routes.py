@@ -1,7 +1,7 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request
+import click
+from flask import Blueprint, current_app, render_template, redirect, url_for, flash, request
 from flask_login import login_user, logout_user, current_user
-from config import Config
-from models import User
+from services.users import UserDirectory
 
 auth_bp = Blueprint('auth', __name__)
 
@@ -14,9 +14,8 @@ def login():
         username = request.form.get('username')
         password = request.form.get('password')
 
-        # Check against environment variables
-        if username == Config.AUTH_USERNAME and password == Config.AUTH_PASSWORD:
-            user = User(Config.AUTH_USERNAME)
+        user = UserDirectory.get_instance().authenticate(username, password)
+        if user is not None:
             login_user(user)
             return redirect(url_for('main.index'))
         else:
@@ -26,11 +25,37 @@ def login():
 
 @auth_bp.route('/register', methods=['GET', 'POST'])
 def register():
-    # Registration disabled - user is configured via environment variables
-    flash('Registration is disabled. Please use the configured credentials.')
-    return redirect(url_for('auth.login'))
+    if not current_app.config.get('REGISTRATION_OPEN'):
+        flash('Registration is disabled. Ask the administrator for an account.')
+        return redirect(url_for('auth.login'))
+    if current_user.is_authenticated:
+        return redirect(url_for('main.index'))
+
+    if request.method == 'POST':
+        try:
+            user = UserDirectory.get_instance().create(
+                request.form.get('username'), request.form.get('password'))
+        except ValueError as e:
+            flash(str(e))
+        else:
+            login_user(user)
+            return redirect(url_for('main.index'))
+
+    return render_template('register.html')
 
 @auth_bp.route('/logout')
 def logout():
     logout_user()
     return redirect(url_for('auth.login'))
+
+
+@auth_bp.cli.command('add-user')
+@click.argument('username')
+@click.password_option()
+def add_user(username, password):
+    """Create an account (works while registration is closed)."""
+    try:
+        user = UserDirectory.get_instance().create(username, password)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    click.echo(f'Created user {user.id} ({user.username})')
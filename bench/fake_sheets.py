@@ -0,0 +1,386 @@
+"""Local stand-in for the parts of the Sheets v4 (and Drive v3) REST API the
+app uses, for benchmarks that must not touch Google.
+
+Run it on its own with ``python -m bench.fake_sheets --rows 10000`` or start
+it in-process with ``FakeSheetsServer(...).start()`` and get a
+``GoogleSheetClient`` for it from ``connect``.
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import httplib2
+from google.auth.credentials import AnonymousCredentials
+from googleapiclient.discovery import build
+
+from models import Book
+from services.sheets import GoogleSheetClient
+
+_A1_RE = re.compile(r'!([A-Z]*)(\d*)(?::([A-Z]*)(\d*))?$')
+_PATH_RE = re.compile(r'^/v4/spreadsheets/([^/:]+)(.*)$')
+
+_WORDS = (
+    'silent night river glass house storm garden winter empire shadow light '
+    'city ocean paper stone machine memory fire island forest road star'
+).split()
+_NAMES = (
+    'Ada Bell Cole Diaz Ito Khan Lund Moreau Novak Okafor Park Quinn Rossi '
+    'Silva Tan Ueda Varga Weber Young Zhou'
+).split()
+_STATUSES = ('Planned', 'Reading', 'Completed')
+
+
+def generate_rows(count, users=1, seed=0):
+    """``count`` plausible book rows (as the API returns them: strings) for
+    ``users`` users, the same every time for a given ``seed``."""
+    rng = random.Random(seed)
+    rows = []
+    for book_id in range(1, count + 1):
+        total = rng.randint(80, 900)
+        status = rng.choice(_STATUSES)
+        current = {'Planned': 0, 'Reading': rng.randint(1, total), 'Completed': total}[status]
+        rows.append([
+            str(book_id),
+            ' '.join(rng.sample(_WORDS, rng.randint(1, 3))).title(),
+            f'{rng.choice(_NAMES)} {rng.choice(_NAMES)}',
+            status,
+            str(current),
+            str(total),
+            'TRUE' if rng.random() < 0.1 else 'FALSE',
+            str(book_id % users + 1),
+            '',
+            '',
+        ])
+    return rows
+
+
+def _typed(value):
+    # what UNFORMATTED_VALUE gives for cells the API wrote USER_ENTERED
+    if value.upper() in ('TRUE', 'FALSE'):
+        return value.upper() == 'TRUE'
+    return int(value) if value.lstrip('-').isdigit() else value
+
+
+def _rows_of(a1_range):
+    # first and last row of an A1 range; None for an open end
+    match = _A1_RE.search(unquote(a1_range))
+    if not match:
+        return 1, None
+    start = int(match.group(2)) if match.group(2) else 1
+    if match.group(3) is None and match.group(4) is None:
+        end = start
+    else:
+        end = int(match.group(4)) if match.group(4) else None
+    return start, end
+
+
+class Spreadsheet:
+    """The sheet's contents: a header row plus data rows, as lists of strings."""
+
+    def __init__(self, rows=(), header=Book.FIELDS):
+        self.rows = [list(header)] + [list(r) for r in rows]
+        self.metadata = {}
+        self.modified = 0
+        self.lock = threading.Lock()
+
+    def _touch(self):
+        self.modified += 1
+
+    def _last_row(self):
+        last = len(self.rows)
+        while last > 1 and not any(self.rows[last - 1]):
+            last -= 1
+        return last
+
+    def get(self, a1_range):
+        start, end = _rows_of(a1_range)
+        rows = self.rows[start - 1:end]
+        while rows and not any(rows[-1]):
+            rows = rows[:-1]
+        return {'range': a1_range, 'values': [list(r) for r in rows]}
+
+    def batch_get(self, ranges, render):
+        value_ranges = [self.get(r) for r in ranges]
+        if render == 'UNFORMATTED_VALUE':
+            for value_range in value_ranges:
+                value_range['values'] = [[_typed(v) for v in row] for row in value_range['values']]
+        return {'valueRanges': value_ranges}
+
+    def append(self, a1_range, values):
+        last = self._last_row()
+        del self.rows[last:]
+        self.rows.extend([str(v) for v in row] for row in values)
+        self._touch()
+        return {'updates': {'updatedRange': f'Sheet1!A{last + 1}:J{len(self.rows)}',
+                            'updatedRows': len(values)}}
+
+    def update(self, a1_range, values):
+        start, _ = _rows_of(a1_range)
+        for offset, row in enumerate(values):
+            while len(self.rows) < start + offset:
+                self.rows.append([])
+            self.rows[start + offset - 1] = [str(v) for v in row]
+        self._touch()
+        return {'updatedRange': f'Sheet1!A{start}:J{start + len(values) - 1}'}
+
+    def clear(self, a1_range):
+        start, end = _rows_of(a1_range)
+        for row in range(start, min(end or len(self.rows), len(self.rows)) + 1):
+            self.rows[row - 1] = []
+        self._touch()
+        return {'clearedRange': a1_range}
+
+    def batch_update(self, body):
+        return {'responses': [self.update(d['range'], d['values']) for d in body['data']]}
+
+    def batch_clear(self, body):
+        return {'clearedRanges': [self.clear(r)['clearedRange'] for r in body['ranges']]}
+
+    def search_metadata(self, body):
+        key = body['dataFilters'][0]['developerMetadataLookup']['metadataKey']
+        return {'matchedDeveloperMetadata': [
+            {'developerMetadata': dict(m)} for m in self.metadata.values() if m['metadataKey'] == key
+        ]}
+
+    def spreadsheet_batch_update(self, body):
+        replies = []
+        for request in body['requests']:
+            if 'deleteDimension' in request:
+                span = request['deleteDimension']['range']
+                del self.rows[span['startIndex']:span['endIndex']]
+                replies.append({})
+            elif 'createDeveloperMetadata' in request:
+                meta = dict(request['createDeveloperMetadata']['developerMetadata'],
+                            metadataId=len(self.metadata) + 1)
+                self.metadata[meta['metadataId']] = meta
+                replies.append({'createDeveloperMetadata': {'developerMetadata': meta}})
+            elif 'updateDeveloperMetadata' in request:
+                update = request['updateDeveloperMetadata']
+                meta_id = update['dataFilters'][0]['developerMetadataLookup']['metadataId']
+                self.metadata[meta_id]['metadataValue'] = update['developerMetadata']['metadataValue']
+                replies.append({})
+            else:
+                raise ValueError(f'Unsupported request {sorted(request)}')
+        self._touch()
+        return {'replies': replies}
+
+    def properties(self):
+        return {'sheets': [{'properties': {
+            'sheetId': 0, 'title': 'Sheet1', 'gridProperties': {'rowCount': len(self.rows)},
+        }}]}
+
+
+class _Quota:
+    # requests allowed in any 60 second window
+    def __init__(self, per_minute):
+        self.per_minute = per_minute
+        self._times = deque()
+        self._lock = threading.Lock()
+
+    def take(self):
+        if not self.per_minute:
+            return True
+        with self._lock:
+            now = time.monotonic()
+            while self._times and now - self._times[0] >= 60:
+                self._times.popleft()
+            if len(self._times) >= self.per_minute:
+                return False
+            self._times.append(now)
+            return True
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # headers and body go out in separate writes; without this every call
+    # waits for a delayed ACK
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, payload, headers=()):
+        body = json.dumps(payload).encode()
+        if self.server.bandwidth:
+            # per response, like a single HTTP stream from Google
+            time.sleep(len(body) / self.server.bandwidth)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=UTF-8')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _error(self, status, message, headers=()):
+        self._send(status, {'error': {'code': status, 'message': message}}, headers)
+
+    def _route(self, method):
+        # (operation name, is a write, handler taking the JSON body)
+        server = self.server
+        sheet = server.sheet
+        parts = urlsplit(self.path)
+        path = parts.path
+        if path.startswith('/drive/v3/files/'):
+            return 'drive.get', False, lambda body: {
+                'modifiedTime': time.strftime(
+                    '%Y-%m-%dT%H:%M:%S.000Z', time.gmtime(server.started + sheet.modified)),
+            }
+        match = _PATH_RE.match(path)
+        if not match:
+            return None
+        rest = match.group(2)
+        if rest == '' and method == 'GET':
+            return 'get', False, lambda body: sheet.properties()
+        if rest == ':batchUpdate':
+            return 'batchUpdate', True, sheet.spreadsheet_batch_update
+        if rest == '/developerMetadata:search':
+            return 'developerMetadata.search', False, sheet.search_metadata
+        if rest == '/values:batchGet':
+            query = parse_qs(parts.query)
+            return 'values.batchGet', False, lambda body: sheet.batch_get(
+                query.get('ranges', []), query.get('valueRenderOption', ['FORMATTED_VALUE'])[0])
+        if rest == '/values:batchUpdate':
+            return 'values.batchUpdate', True, sheet.batch_update
+        if rest == '/values:batchClear':
+            return 'values.batchClear', True, sheet.batch_clear
+        if not rest.startswith('/values/'):
+            return None
+        a1_range = rest[len('/values/'):]
+        if a1_range.endswith(':append'):
+            return 'values.append', True, lambda body: sheet.append(a1_range[:-7], body['values'])
+        if a1_range.endswith(':clear'):
+            return 'values.clear', True, lambda body: sheet.clear(a1_range[:-6])
+        if method == 'PUT':
+            return 'values.update', True, lambda body: sheet.update(a1_range, body['values'])
+        if method == 'GET':
+            return 'values.get', False, lambda body: sheet.get(a1_range)
+        return None
+
+    def _handle(self, method):
+        length = int(self.headers.get('Content-Length') or 0)
+        raw = self.rfile.read(length) if length else b''
+        route = self._route(method)
+        if route is None:
+            self._error(404, f'No fake for {method} {self.path}')
+            return
+        name, write, handler = route
+        server = self.server
+        server.count(name)
+        if server.latency or server.jitter:
+            time.sleep(server.latency + random.uniform(0, server.jitter))
+        if not (server.write_quota if write else server.read_quota).take():
+            server.count('429')
+            self._error(429, 'Quota exceeded', [('Retry-After', '1')])
+            return
+        try:
+            body = json.loads(raw) if raw else {}
+            with server.sheet.lock:
+                payload = handler(body)
+        except (KeyError, ValueError, IndexError) as e:
+            self._error(400, str(e))
+            return
+        self._send(200, payload)
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_PUT(self):
+        self._handle('PUT')
+
+
+class FakeSheetsServer(ThreadingHTTPServer):
+    """Threaded HTTP server answering Sheets v4 / Drive v3 calls from an
+    in-memory ``Spreadsheet``.
+
+    Every call sleeps ``latency`` seconds plus up to ``jitter`` more (and,
+    with ``bandwidth`` set, as long as sending its body at that many bytes a
+    second takes), and ``read_quota`` / ``write_quota`` (calls per minute, None for unlimited)
+    are enforced with 429 responses like the real API.  ``calls`` counts the
+    requests per operation.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, rows=(), host='127.0.0.1', port=0, latency=0.0, jitter=0.0,
+                 read_quota=None, write_quota=None, bandwidth=None):
+        super().__init__((host, port), _Handler)
+        self.sheet = Spreadsheet(rows)
+        self.latency = latency
+        self.jitter = jitter
+        self.bandwidth = bandwidth
+        self.read_quota = _Quota(read_quota)
+        self.write_quota = _Quota(write_quota)
+        self.calls = Counter()
+        self._calls_lock = threading.Lock()
+        self.started = time.time()
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def count(self, name):
+        with self._calls_lock:
+            self.calls[name] += 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name='fake-sheets', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def connect(server):
+    """A ``GoogleSheetClient`` talking to ``server`` through the real
+    googleapiclient stack; needs an app context."""
+    options = {'static_discovery': True, 'cache_discovery': False, 'http': httplib2.Http()}
+    service = build('sheets', 'v4', client_options={'api_endpoint': server.url + '/'}, **options)
+    drive = build('drive', 'v3', client_options={'api_endpoint': server.url + '/drive/v3/'}, **options)
+    return GoogleSheetClient(service=service, drive=drive, credentials=AnonymousCredentials())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--rows', type=int, default=1000)
+    parser.add_argument('--users', type=int, default=1)
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every call')
+    parser.add_argument('--jitter', type=float, default=0.0, help='up to this many more seconds')
+    parser.add_argument('--read-quota', type=int, help='read calls per minute')
+    parser.add_argument('--write-quota', type=int, help='write calls per minute')
+    parser.add_argument('--bandwidth', type=float, help='bytes per second per response')
+    args = parser.parse_args()
+    server = FakeSheetsServer(
+        generate_rows(args.rows, args.users), port=args.port, latency=args.latency,
+        jitter=args.jitter, read_quota=args.read_quota, write_quota=args.write_quota,
+        bandwidth=args.bandwidth,
+    )
+    print(f'Fake Sheets API with {args.rows} rows on {server.url}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
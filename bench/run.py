@@ -0,0 +1,293 @@
+"""Benchmarks for the sheet client and the routes, run against the local fake
+Sheets API in bench/fake_sheets.py so nothing talks to Google.
+
+    python -m bench.run --rows 10000 --latency 0.05
+    python -m bench.run --json results.json
+    python -m bench.run --baseline results.json   # exits 1 on a regression
+
+Every scenario reports throughput, p50/p99 latency and the API calls it made.
+"""
+import os
+
+# the app won't start without these; make sure nothing reaches a real sheet
+os.environ.setdefault('SECRET_KEY', 'bench')
+os.environ.setdefault('AUTH_USERNAME', 'bench')
+os.environ.setdefault('AUTH_PASSWORD', 'bench')
+os.environ.setdefault('GOOGLE_CREDS_JSON', '{}')
+os.environ.update({
+    'GOOGLE_SHEET_ID': 'bench',
+    'STORAGE_BACKEND': 'sheets',
+    'STORAGE_WARM_UP': '0',
+    'SHEETS_SNAPSHOT_PATH': '',
+    'SHEETS_SHARED_DIR': '',
+})
+
+import argparse
+import json
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import count
+from queue import Queue
+
+from app import create_app
+from bench.fake_sheets import FakeSheetsServer, connect, generate_rows
+from services.search import tokenize
+from services.sheets import GoogleSheetClient
+
+SCENARIOS = {}
+
+
+def scenario(name):
+    def register(fn):
+        SCENARIOS[name] = fn
+        return fn
+    return register
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of the sorted list ``values``."""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, round(p / 100 * (len(values) - 1)))]
+
+
+class Bench:
+    def __init__(self, args):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.server = FakeSheetsServer(
+            generate_rows(args.rows, args.users, args.seed), latency=args.latency,
+            jitter=args.jitter, read_quota=args.read_quota, write_quota=args.write_quota,
+            bandwidth=args.bandwidth,
+        )
+        self.app = create_app()
+        self.app.config.update(
+            SHEETS_READ_QUOTA=args.read_quota or 10 ** 6,
+            SHEETS_WRITE_QUOTA=args.write_quota or 10 ** 6,
+        )
+        self.client = None
+        self.words = sorted({w for row in self.server.sheet.rows[1:] for w in tokenize(row[1])})
+
+    def random_id(self):
+        # ids of books still in the store
+        while True:
+            book_id = self.rng.randint(1, self.args.rows)
+            if book_id in self.client.store:
+                return book_id
+
+    def measure(self, name, op, ops, threads=1):
+        before = self.server.calls.copy()
+        latencies = []
+
+        def timed(i):
+            start = time.perf_counter()
+            op(i)
+            latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        if threads > 1:
+            with ThreadPoolExecutor(threads) as pool:
+                list(pool.map(timed, range(ops)))
+        else:
+            for i in range(ops):
+                timed(i)
+        wall = time.perf_counter() - start
+        latencies.sort()
+        return {
+            'scenario': name,
+            'ops': ops,
+            'seconds': wall,
+            'ops_per_second': ops / wall if wall else 0.0,
+            'p50_ms': percentile(latencies, 50) * 1000,
+            'p99_ms': percentile(latencies, 99) * 1000,
+            'api_calls': sum((self.server.calls - before).values()),
+        }
+
+    def logged_in_client(self):
+        client = self.app.test_client()
+        client.post('/login', data={
+            'username': self.app.config['AUTH_USERNAME'],
+            'password': self.app.config['AUTH_PASSWORD'],
+        })
+        return client
+
+
+@scenario('cold_load')
+def cold_load(bench):
+    # header check plus a full download and index build
+    def op(i):
+        client = connect(bench.server)
+        client.warm_up()
+        bench.client = GoogleSheetClient._instance = client
+    return bench.measure('cold_load', op, bench.args.loads)
+
+
+@scenario('revalidate')
+def revalidate(bench):
+    # a background check of an unchanged sheet: one Drive call, no download
+    return bench.measure('revalidate', lambda i: bench.client._refresh(), bench.args.ops)
+
+
+@scenario('store_reads')
+def store_reads(bench):
+    client, rng = bench.client, bench.rng
+    users = bench.args.users
+    queries = [
+        lambda: client.books_for_user(rng.randint(1, users), 'Reading'),
+        lambda: client.favourites_for_user(rng.randint(1, users)),
+        lambda: client.dashboard_for_user(rng.randint(1, users)),
+        lambda: client.books_page(rng.randint(1, users), limit=60),
+        lambda: client.search_books(rng.randint(1, users), rng.choice(bench.words)[:4]),
+        lambda: client.get_book(bench.random_id()),
+    ]
+    return bench.measure(
+        'store_reads', lambda i: queries[i % len(queries)](), bench.args.ops * 10, bench.args.threads,
+    )
+
+
+@scenario('updates')
+def updates(bench):
+    def op(i):
+        bench.client.update_book(bench.random_id(), {'current_page': i})
+    return bench.measure('updates', op, bench.args.ops, bench.args.threads)
+
+
+@scenario('appends')
+def appends(bench):
+    def op(i):
+        bench.client.append_book({'title': f'Bench {i}', 'author': 'Bench', 'status': 'Planned',
+                                  'user_id': 1, 'total_pages': 100})
+    return bench.measure('appends', op, bench.args.ops, bench.args.threads)
+
+
+@scenario('deletes')
+def deletes(bench):
+    ids = iter(range(bench.args.rows, 0, -2))
+    return bench.measure(
+        'deletes', lambda i: bench.client.delete_book(next(ids)), bench.args.ops, bench.args.threads,
+    )
+
+
+@scenario('import')
+def import_(bench):
+    # a whole CSV library through /import, chunked into batch appends
+    client = bench.logged_in_client()
+    lines = ['title,author,status,current_page,total_pages']
+    lines += [f'Imported {i},Author {i % 97},Planned,0,{100 + i % 400}' for i in range(bench.args.ops * 10)]
+    body = '\n'.join(lines) + '\n'
+
+    def op(i):
+        client.post('/import', data=body, content_type='text/csv').get_data()
+    return bench.measure('import', op, 1)
+
+
+@scenario('route_reads')
+def route_reads(bench):
+    rng = bench.rng
+    paths = [
+        lambda: '/',
+        lambda: '/all_books',
+        lambda: '/favourites',
+        lambda: f'/search?q={rng.choice(bench.words)[:4]}&partial=1',
+        lambda: f'/book/{bench.random_id()}',
+    ]
+
+    # one logged-in test client (cookie jar) per concurrent request
+    idle = Queue()
+    for _ in range(bench.args.threads):
+        idle.put(bench.logged_in_client())
+
+    def op(i):
+        client = idle.get()
+        try:
+            client.get(paths[i % len(paths)]()).close()
+        finally:
+            idle.put(client)
+    return bench.measure('route_reads', op, bench.args.ops * 5, bench.args.threads)
+
+
+@scenario('route_writes')
+def route_writes(bench):
+    client = bench.logged_in_client()
+    pages = count()
+
+    def op(i):
+        client.post(f'/book/{bench.random_id()}/update',
+                    data={'action': 'update_progress', 'current_page': next(pages)}).close()
+    result = bench.measure('route_writes', op, bench.args.ops)
+    # let the queued writes reach the sheet before the next scenario
+    with bench.client._write_lock:
+        pass
+    return result
+
+
+def report(results):
+    print(f'{"scenario":<14}{"ops":>8}{"ops/s":>12}{"p50 ms":>10}{"p99 ms":>10}{"API calls":>11}')
+    for r in results:
+        print(f'{r["scenario"]:<14}{r["ops"]:>8}{r["ops_per_second"]:>12.1f}'
+              f'{r["p50_ms"]:>10.2f}{r["p99_ms"]:>10.2f}{r["api_calls"]:>11}')
+
+
+def regressions(results, baseline, tolerance):
+    """Scenarios whose p50 or p99 got more than ``tolerance`` (a fraction)
+    slower than in ``baseline``."""
+    before = {r['scenario']: r for r in baseline['results']}
+    found = []
+    for r in results:
+        old = before.get(r['scenario'])
+        if old is None:
+            continue
+        for key in ('p50_ms', 'p99_ms'):
+            if r[key] > old[key] * (1 + tolerance):
+                found.append(f'{r["scenario"]} {key}: {old[key]:.2f} -> {r[key]:.2f}')
+    return found
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--rows', type=int, default=10000, help='books in the fake sheet')
+    parser.add_argument('--users', type=int, default=1)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every API call')
+    parser.add_argument('--jitter', type=float, default=0.0, help='up to this many more seconds')
+    parser.add_argument('--bandwidth', type=float, help='bytes per second per API response')
+    parser.add_argument('--read-quota', type=int, help='read calls per minute (fake and client)')
+    parser.add_argument('--write-quota', type=int, help='write calls per minute (fake and client)')
+    parser.add_argument('--ops', type=int, default=200, help='operations per scenario (reads do more)')
+    parser.add_argument('--loads', type=int, default=3, help='cold loads to time')
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--only', nargs='+', choices=list(SCENARIOS), help='scenarios to run')
+    parser.add_argument('--json', help='also write the results to this file')
+    parser.add_argument('--baseline', help='results file to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed slowdown against the baseline (fraction)')
+    args = parser.parse_args(argv)
+
+    bench = Bench(args)
+    names = args.only or list(SCENARIOS)
+    if 'cold_load' not in names:
+        # everything else needs a loaded client
+        names = ['cold_load'] + names
+    results = []
+    with bench.server, bench.app.app_context():
+        for name in names:
+            results.append(SCENARIOS[name](bench))
+    report(results)
+
+    params = {k: v for k, v in vars(args).items() if k not in ('json', 'baseline', 'only')}
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'params': params, 'results': results}, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = regressions(results, json.load(f), args.tolerance)
+        for line in found:
+            print(f'REGRESSION {line}')
+        return 1 if found else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
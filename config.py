@@ -7,7 +7,8 @@ class Config:
     if not SECRET_KEY:
         raise RuntimeError('SECRET_KEY environment variable must be set')
 
-    # Authentication via environment variables (no database)
+    # Authentication: this account (user 1) always exists; further ones are
+    # kept in the sheet's Users tab (see REGISTRATION_OPEN)
     AUTH_USERNAME = os.environ.get('AUTH_USERNAME')
     AUTH_PASSWORD = os.environ.get('AUTH_PASSWORD')
     if not AUTH_USERNAME or not AUTH_PASSWORD:
@@ -27,3 +28,97 @@ class Config:
     GOOGLE_SHEET_ID = os.environ.get('GOOGLE_SHEET_ID')
     if not GOOGLE_SHEET_ID:
         raise RuntimeError('GOOGLE_SHEET_ID environment variable must be set')
+
+    # seconds a cached copy of the sheet is served before it is revalidated in
+    # the background (a cheap Drive modifiedTime check, re-downloading only
+    # when the spreadsheet changed)
+    SHEETS_CACHE_TTL = int(os.environ.get('SHEETS_CACHE_TTL', 30))
+    # seconds after which the sheet is re-read even if modifiedTime looks
+    # unchanged; writes made through the app patch the in-memory cache
+    # directly.  0 disables the forced reload.
+    SHEETS_RECONCILE_INTERVAL = int(os.environ.get('SHEETS_RECONCILE_INTERVAL', 300))
+
+    # seconds the sheet client waits after a write to collect others into the
+    # same batchUpdate/append call
+    SHEETS_WRITE_WINDOW = float(os.environ.get('SHEETS_WRITE_WINDOW', 0.05))
+
+    # JSON-lines copy of the book cache used for instant warm restarts;
+    # defaults to instance/sheet_snapshot.jsonl, an empty value disables it
+    SHEETS_SNAPSHOT_PATH = os.environ.get('SHEETS_SNAPSHOT_PATH')
+    # directory (ideally on a tmpfs like /dev/shm) shared by all gunicorn
+    # workers; when set they publish every change there as a snapshot and keep
+    # each other's caches current.  Needed with more than one worker.
+    SHEETS_SHARED_DIR = os.environ.get('SHEETS_SHARED_DIR')
+
+    # deleted books leave blank rows; once this many have built up they are
+    # removed from the sheet (0 disables; never runs in shared-cache mode)
+    SHEETS_COMPACT_THRESHOLD = int(os.environ.get('SHEETS_COMPACT_THRESHOLD', 50))
+    # each user's books are on a tab of their own and cached separately;
+    # this many users' caches are kept, the least recently used go first
+    SHEETS_ACTIVE_USERS = int(os.environ.get('SHEETS_ACTIVE_USERS', 100))
+
+    # Sheets API calls per minute this process may make, per kind.  The
+    # default quota is 60 reads and 60 writes a minute per user (the service
+    # account), shared by every worker, so divide by the number of workers.
+    SHEETS_READ_QUOTA = int(os.environ.get('SHEETS_READ_QUOTA', 60))
+    SHEETS_WRITE_QUOTA = int(os.environ.get('SHEETS_WRITE_QUOTA', 60))
+    # seconds an API call may take in total, including waiting for quota and
+    # retrying after 429/5xx responses
+    SHEETS_DEADLINE = float(os.environ.get('SHEETS_DEADLINE', 30))
+    # keep-alive connections to the API (one per concurrent call; match the
+    # gunicorn thread count) and the socket timeout of each attempt
+    SHEETS_HTTP_POOL = int(os.environ.get('SHEETS_HTTP_POOL', 4))
+    SHEETS_HTTP_TIMEOUT = float(os.environ.get('SHEETS_HTTP_TIMEOUT', 20))
+    # full loads download this many rows per request (0: all in one), up to
+    # SHEETS_LOAD_THREADS requests at a time (also capped by the HTTP pool);
+    # every chunk costs one read call
+    SHEETS_LOAD_CHUNK_ROWS = int(os.environ.get('SHEETS_LOAD_CHUNK_ROWS', 5000))
+    SHEETS_LOAD_THREADS = int(os.environ.get('SHEETS_LOAD_THREADS', 4))
+
+    # where books are read from and written to: 'sheets' talks to the Google
+    # Sheet directly, 'sqlite' serves everything from a local SQLite file and
+    # mirrors changes to the sheet in the background
+    STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'sheets')
+    # let visitors create accounts on /register; otherwise accounts are
+    # added with `flask auth add-user <name>`
+    REGISTRATION_OPEN = os.environ.get('REGISTRATION_OPEN', '0').lower() in ('1', 'true', 'yes')
+    # load the storage backend in the background as soon as the app is created
+    STORAGE_WARM_UP = os.environ.get('STORAGE_WARM_UP', '1').lower() in ('1', 'true', 'yes')
+    # defaults to instance/books.db
+    SQLITE_PATH = os.environ.get('SQLITE_PATH')
+    # seconds between pulls of sheet edits into the SQLite copy
+    SQLITE_PULL_INTERVAL = int(os.environ.get('SQLITE_PULL_INTERVAL', 60))
+
+    # number of rendered pages kept in memory per process; entries are keyed
+    # on the data version, so they go stale by themselves.  0 disables it.
+    PAGE_CACHE_SIZE = int(os.environ.get('PAGE_CACHE_SIZE', 256))
+    # books per page on the "all books" listing; 0 puts everything on one
+    # page, which is then streamed to the browser while it renders
+    ALL_BOOKS_PAGE_SIZE = int(os.environ.get('ALL_BOOKS_PAGE_SIZE', 60))
+    # progress, status and favourite changes are logged to this SQLite file
+    # (default instance/activity.db) every ACTIVITY_FLUSH_INTERVAL seconds
+    # and summed up per day and week for /stats
+    ACTIVITY_DB_PATH = os.environ.get('ACTIVITY_DB_PATH')
+    ACTIVITY_FLUSH_INTERVAL = float(os.environ.get('ACTIVITY_FLUSH_INTERVAL', 2))
+    # /import writes this many books per append call (one Sheets request)
+    IMPORT_CHUNK_SIZE = int(os.environ.get('IMPORT_CHUNK_SIZE', 500))
+
+    # covers are fetched once in the background, shrunk to COVER_WIDTH pixels
+    # (with Pillow; without it they aren't cached) and kept in COVER_CACHE_DIR
+    # (default instance/covers) up to this size
+    COVER_CACHE_DIR = os.environ.get('COVER_CACHE_DIR')
+    COVER_CACHE_MAX_MB = int(os.environ.get('COVER_CACHE_MAX_MB', 100))
+    COVER_WIDTH = int(os.environ.get('COVER_WIDTH', 512))
+
+    # where `python -m assets.build` wrote the stylesheet and fonts (default
+    # static/dist); without a build pages fall back to the Tailwind CDN
+    ASSETS_DIR = os.environ.get('ASSETS_DIR')
+
+    # bearer token /metrics and /metrics/profile require; without it they 404
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+    # add a Server-Timing header (app, render and Sheets API time) to every
+    # response; shows up in the browser's dev tools
+    SERVER_TIMING = os.environ.get('SERVER_TIMING', '0').lower() in ('1', 'true', 'yes')
+    # allow /metrics/profile?seconds=N, which samples every thread's stack for
+    # that long and returns them collapsed for a flame graph
+    PROFILER_ENABLED = os.environ.get('PROFILER_ENABLED', '0').lower() in ('1', 'true', 'yes')
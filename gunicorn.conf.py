@@ -0,0 +1,8 @@
+# gunicorn picks this file up automatically from the working directory
+
+
+def post_worker_init(worker):
+    # with --preload the warm-up thread started by create_app() lives in the
+    # master and doesn't survive the fork, so start one in every worker
+    from services.storage import warm_up_storage
+    warm_up_storage(worker.wsgi)
@@ -0,0 +1,88 @@
+from collections import OrderedDict
+from functools import wraps
+from threading import Lock
+
+from flask import current_app, make_response, request, session
+from flask_login import current_user
+
+from services.assets import asset_version
+from services.storage import get_storage
+
+
+class PageCache:
+    """Small LRU of rendered pages.
+
+    Keys include the storage backend's data version, so entries never need
+    invalidating: once the books change nothing asks for the old key any
+    more and it simply ages out.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self._pages = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key):
+        with self._lock:
+            body = self._pages.get(key)
+            if body is not None:
+                self._pages.move_to_end(key)
+            return body
+
+    def put(self, key, body):
+        if self.size <= 0:
+            return
+        with self._lock:
+            self._pages[key] = body
+            self._pages.move_to_end(key)
+            while len(self._pages) > self.size:
+                self._pages.popitem(last=False)
+
+
+def _page_cache():
+    cache = current_app.extensions.get('page_cache')
+    if cache is None:
+        cache = current_app.extensions['page_cache'] = PageCache(
+            current_app.config.get('PAGE_CACHE_SIZE', 256)
+        )
+    return cache
+
+
+def cached_page(view):
+    """Serve a read-only page from the page cache and answer conditional
+    requests with 304 until a book changes.
+
+    The ETag is derived from the storage backend's data version, the asset
+    build the page links to and the user; cached bodies are additionally keyed on the request URL.  Requests with
+    flashed messages waiting are rendered normally and not cached, since the
+    page will show those messages.
+    """
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if session.get('_flashes'):
+            return view(*args, **kwargs)
+        storage = get_storage()
+        version = storage.data_version()
+        etag = f'{storage.epoch}-{version}-{asset_version()}-{current_user.id}'
+        key = (request.full_path, etag)
+        if request.if_none_match.contains_weak(etag):
+            response = make_response('', 304)
+        else:
+            body = _page_cache().get(key)
+            if body is None:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200 or session.get('_flashes'):
+                    # redirects (access denied) or a view that flashed
+                    return response
+                if not response.is_streamed:
+                    _page_cache().put(key, response.get_data())
+            else:
+                response = make_response(body)
+        response.set_etag(etag, weak=True)
+        # the browser may keep the page but has to check back every time
+        response.headers['Cache-Control'] = 'private, no-cache'
+        response.vary.add('Cookie')
+        return response
+
+    return wrapper
@@ -0,0 +1,46 @@
+from collections import defaultdict, deque
+from threading import Lock
+
+from flask import current_app
+
+# messages kept per user until their next page; older ones are dropped
+MAX_NOTICES = 5
+
+
+def failed(future):
+    """True if a finished write raised or reported that nothing was written
+    (``update_book``/``delete_book`` return False for a book that's gone)."""
+    return future.exception() is not None or future.result() is False
+
+
+class WriteNotices:
+    """Failures of writes that finished after their request had returned.
+
+    Write routes don't wait for the sheet to acknowledge a change; they
+    ``watch`` its future and the user sees the message on their next page
+    (served by this process: each gunicorn worker keeps its own).
+    """
+
+    def __init__(self):
+        self._notices = defaultdict(lambda: deque(maxlen=MAX_NOTICES))
+        self._lock = Lock()
+
+    def watch(self, future, user_id, message):
+        """Keep ``message`` for ``user_id`` should ``future`` fail."""
+        def done(future):
+            if failed(future):
+                with self._lock:
+                    self._notices[user_id].append(message)
+        future.add_done_callback(done)
+
+    def pop(self, user_id):
+        with self._lock:
+            notices = self._notices.pop(user_id, None)
+        return list(notices) if notices else []
+
+
+def get_write_notices():
+    notices = current_app.extensions.get('write_notices')
+    if notices is None:
+        notices = current_app.extensions['write_notices'] = WriteNotices()
+    return notices
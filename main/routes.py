@@ -1,50 +1,77 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash
+import base64
+import binascii
+import io
+import json
+
+from flask import (Blueprint, Response, abort, current_app, render_template, request, redirect,
+                   url_for, flash, make_response, send_file, stream_template, stream_with_context)
 from flask_login import login_required, current_user
-from services.sheets import GoogleSheetClient
-from types import SimpleNamespace
+from main.caching import cached_page
+from main.notices import failed, get_write_notices
+from services.activity import get_activity_log, timestamp
+from services.covers import get_cover_cache, source_hash
+from services.storage import get_storage
+from services.transfer import FORMATS, export_lines, import_books, read_records
 
 main_bp = Blueprint('main', __name__)
 
 
-def _to_obj(book_dict):
-    """Convert a book dictionary into an object for template consumption."""
-    return SimpleNamespace(**book_dict)
+@main_bp.before_request
+def wait_for_storage():
+    # right after a cold start the books may still be loading; answer with a
+    # self-refreshing placeholder instead of holding the worker thread
+    if not get_storage().is_ready():
+        response = make_response(render_template('loading.html'), 503)
+        response.headers['Retry-After'] = '2'
+        return response
+
+
+@main_bp.before_request
+def show_write_failures():
+    # writes that failed after the request that made them had returned
+    if current_user.is_authenticated:
+        for message in get_write_notices().pop(current_user.id):
+            flash(message)
+
+
+def _report(future, title, done=None, pending=None):
+    """Flash how a ``wait=False`` write went: ``done`` once it has been
+    stored, ``pending`` while it's still on its way to the sheet.  A failure
+    is flashed now, or on a later page if it comes after this request."""
+    failure = f'Saving "{title}" to the sheet failed; please check it and try again'
+    if not future.done():
+        get_write_notices().watch(future, current_user.id, failure)
+        if pending:
+            flash(pending)
+    elif failed(future):
+        flash(failure)
+    elif done:
+        flash(done)
+
+
+@main_bp.app_template_global()
+def cover_url(book):
+    """Address of the book's cover through the caching proxy ('' if none)."""
+    if not book.cover_image:
+        return ''
+    return url_for('main.cover', id=book.id, v=source_hash(book.cover_image))
 
 
 @main_bp.route('/')
 @login_required
+@cached_page
 def index():
-    client = GoogleSheetClient.get_instance()
-    books = [ _to_obj(b) for b in client.books_for_user(current_user.id) ]
-
-    # categorise the list in memory (previously done via ORM queries)
-    reading = [b for b in books if b.status == 'Reading']
-    planned = [b for b in books if b.status == 'Planned']
-    completed = [b for b in books if b.status == 'Completed']
-    favourites = [b for b in books if b.is_favourite]
-
-    hero_book = reading[0] if reading else None
-    # Queue shows only Reading and Planned books (exclude Completed from this view)
-    queue_books = [b for b in books if b != hero_book and b.status != 'Completed']
-    status_order = {'Reading': 1, 'Planned': 2, 'Completed': 3}
-    queue_books.sort(key=lambda x: status_order.get(x.status, 4))
-
-    return render_template(
-        'index.html',
-        hero_book=hero_book,
-        queue_books=queue_books,
-        reading_count=len(reading),
-        planned_count=len(planned),
-        completed_count=len(completed),
-        favourites=favourites,
-    )
+    # counts, hero book, queue and favourites are precomputed per user and
+    # only rebuilt after that user's books change
+    dashboard = get_storage().dashboard_for_user(current_user.id)
+    return render_template('index.html', **dashboard.context())
 
 
 @main_bp.route('/add_book', methods=['GET', 'POST'])
 @login_required
 def add_book():
     if request.method == 'POST':
-        client = GoogleSheetClient.get_instance()
+        client = get_storage()
         # coerce numeric fields to ints so templates can perform arithmetic
         current_page = request.form.get('current_page', 0)
         total_pages = request.form.get('total_pages', 0)
@@ -66,10 +93,13 @@ def add_book():
             'is_favourite': False,
             'user_id': current_user.id,
             'cover_image': request.form.get('cover_image', ''),
-            'created_at': '',
+            'created_at': timestamp(),
         }
-        client.append_book(book_data)
-        flash('Book added to tracking system')
+        future = client.append_book(book_data, wait=False)
+        # the id is filled in straight away, before the write has been stored
+        get_activity_log().record(current_user.id, book_data['id'], 'added', book_data['status'])
+        _report(future, book_data['title'], 'Book added to tracking system',
+                'Book added; saving it to the sheet')
         return redirect(url_for('main.index'))
 
     return render_template('add_book.html')
@@ -78,10 +108,9 @@ def add_book():
 @main_bp.route('/book/<int:id>/update', methods=['POST'])
 @login_required
 def update_book(id):
-    client = GoogleSheetClient.get_instance()
-    # find the book dict and convert to object for easier attribute access
-    book_dict = next((b for b in client.fetch_all_books() if b.get('id') == id), None)
-    if not book_dict or book_dict.get('user_id') != current_user.id:
+    client = get_storage()
+    book = client.get_book(id)
+    if not book or book.user_id != current_user.id:
         flash('Access Denied')
         return redirect(url_for('main.index'))
 
@@ -89,21 +118,25 @@ def update_book(id):
     updates = {}
 
     if action == 'delete':
-        client.delete_book(id)
-        flash(f'Book "{book_dict.get("title")}" deleted')
+        future = client.delete_book(id, wait=False)
+        _report(future, book.title, f'Book "{book.title}" deleted',
+                f'Book "{book.title}" deleted; removing it from the sheet')
         return redirect(url_for('main.index'))
     elif action == 'update_progress':
-        new_page = int(request.form.get('current_page', book_dict.get('current_page', 0)))
+        new_page = int(request.form.get('current_page', book.current_page))
         updates['current_page'] = new_page
-        if new_page >= int(book_dict.get('total_pages', 0)) and int(book_dict.get('total_pages', 0)) > 0:
+        if new_page >= book.total_pages and book.total_pages > 0:
             updates['status'] = 'Completed'
-        client.update_book(id, updates)
+        _report(client.update_book(id, updates, wait=False), book.title)
+        get_activity_log().record_changes(book, updates)
     elif action == 'change_status':
         updates['status'] = request.form.get('status')
-        client.update_book(id, updates)
+        _report(client.update_book(id, updates, wait=False), book.title)
+        get_activity_log().record_changes(book, updates)
     elif action == 'toggle_favourite':
-        updates['is_favourite'] = not book_dict.get('is_favourite', False)
-        client.update_book(id, updates)
+        updates['is_favourite'] = not book.is_favourite
+        _report(client.update_book(id, updates, wait=False), book.title)
+        get_activity_log().record_changes(book, updates)
         return redirect(request.referrer or url_for('main.index'))
 
     return redirect(url_for('main.index'))
@@ -111,22 +144,22 @@ def update_book(id):
 
 @main_bp.route('/book/<int:id>')
 @login_required
+@cached_page
 def book_details(id):
-    client = GoogleSheetClient.get_instance()
-    book_dict = next((b for b in client.fetch_all_books() if b.get('id') == id), None)
-    if not book_dict or book_dict.get('user_id') != current_user.id:
+    client = get_storage()
+    book = client.get_book(id)
+    if not book or book.user_id != current_user.id:
         flash('Access Denied')
         return redirect(url_for('main.index'))
-    book = _to_obj(book_dict)
     return render_template('book_details.html', book=book)
 
 
 @main_bp.route('/book/<int:id>/edit', methods=['GET', 'POST'])
 @login_required
 def edit_book(id):
-    client = GoogleSheetClient.get_instance()
-    book_dict = next((b for b in client.fetch_all_books() if b.get('id') == id), None)
-    if not book_dict or book_dict.get('user_id') != current_user.id:
+    client = get_storage()
+    book = client.get_book(id)
+    if not book or book.user_id != current_user.id:
         flash('Access Denied')
         return redirect(url_for('main.index'))
 
@@ -141,32 +174,149 @@ def edit_book(id):
             'is_favourite': True if request.form.get('is_favourite') else False,
         }
         if updates['current_page'] >= updates['total_pages'] and updates['total_pages'] > 0:
-            if book_dict.get('status') != 'Completed':
+            if book.status != 'Completed':
                 updates['status'] = 'Completed'
                 flash('Book marked as Completed due to progress')
 
-        client.update_book(id, updates)
-        flash('Book details updated')
+        future = client.update_book(id, updates, wait=False)
+        get_activity_log().record_changes(book, updates)
+        _report(future, book.title, 'Book details updated',
+                'Book details updated; saving them to the sheet')
         return redirect(url_for('main.book_details', id=id))
 
-    book = _to_obj(book_dict)
     return render_template('edit_book.html', book=book)
 
 
 @main_bp.route('/favourites')
 @login_required
+@cached_page
 def favourites():
-    client = GoogleSheetClient.get_instance()
-    books = [ _to_obj(b) for b in client.books_for_user(current_user.id) if b.get('is_favourite') ]
+    client = get_storage()
+    books = client.favourites_for_user(current_user.id)
     return render_template('favourites.html', favourites=books)
 
 
+@main_bp.route('/stats')
+@login_required
+def stats():
+    # served from the per-day and per-week rollups, not the raw events
+    return render_template('stats.html', stats=get_activity_log().stats(current_user.id))
+
+
+@main_bp.route('/cover/<int:id>')
+@login_required
+def cover(id):
+    book = get_storage().get_book(id)
+    if not book or book.user_id != current_user.id or not book.cover_image:
+        abort(404)
+    path = get_cover_cache().get(book.cover_image)
+    if path is None:
+        # not cached (yet, it's being fetched) or can't be: let the browser
+        # load the original meanwhile
+        return redirect(book.cover_image)
+    response = send_file(path, conditional=True)
+    response.cache_control.public = False
+    response.cache_control.private = True
+    if request.args.get('v') == source_hash(book.cover_image):
+        # the address changes along with the cover, so it never goes stale
+        response.cache_control.max_age = 365 * 24 * 3600
+        response.cache_control.immutable = True
+    return response
+
+
+@main_bp.route('/search')
+@login_required
+@cached_page
+def search():
+    query = request.args.get('q', '').strip()
+    books = get_storage().search_books(current_user.id, query) if query else []
+    # the page fetches just the results while the user types
+    template = 'search_results.html' if request.args.get('partial') else 'search.html'
+    return render_template(template, query=query, books=books)
+
+
 @main_bp.route('/all_books')
 @login_required
+@cached_page
 def all_books():
-    client = GoogleSheetClient.get_instance()
-    books = [ _to_obj(b) for b in client.books_for_user(current_user.id) ]
-    # sort by status then title
-    books.sort(key=lambda x: (x.status or '', x.title or ''))
-    return render_template('all_books.html', books=books)
+    client = get_storage()
+    page_size = current_app.config.get('ALL_BOOKS_PAGE_SIZE', 60)
+    after = _decode_cursor(request.args.get('after'))
+    # sorted by status then title, served from the storage backend's
+    # pre-sorted index one page at a time
+    books, next_key, total = client.books_page(current_user.id, after, page_size or None)
+    context = dict(
+        books=books,
+        total=total,
+        next_cursor=_encode_cursor(next_key) if next_key else None,
+        first_page=after is None,
+    )
+    if page_size:
+        return render_template('all_books.html', **context)
+    # everything on one page: stream it so the first cards reach the browser
+    # before the rest is rendered
+    return stream_template('all_books.html', **context)
+
+
+@main_bp.route('/export')
+@login_required
+def export():
+    fmt = request.args.get('format', 'csv')
+    if fmt not in FORMATS:
+        abort(400)
+    books = get_storage().books_for_user(current_user.id)
+    response = Response(export_lines(books, fmt), mimetype=FORMATS[fmt])
+    response.headers['Content-Disposition'] = f'attachment; filename=books.{fmt}'
+    return response
+
+
+@main_bp.route('/import', methods=['POST'])
+@login_required
+def import_():
+    # either a form upload ("file") or the CSV / JSON Lines as the body
+    upload = request.files.get('file')
+    fmt = request.args.get('format')
+    if fmt is None:
+        name = upload.filename if upload else ''
+        fmt = 'jsonl' if name.endswith(('.jsonl', '.ndjson')) or request.mimetype in (
+            'application/x-ndjson', 'application/jsonl') else 'csv'
+    if fmt not in FORMATS:
+        abort(400)
+    if upload:
+        # the request closes its uploads as soon as the view returns, which
+        # is before the response below has been streamed
+        stream, upload.stream = upload.stream, io.BytesIO()
+    else:
+        stream = request.stream
+    progress = import_books(
+        get_storage(), current_user.id, read_records(stream, fmt),
+        current_app.config.get('IMPORT_CHUNK_SIZE', 500),
+    )
+
+    def lines():
+        # one JSON line per chunk written, so large imports show their progress
+        try:
+            for p in progress:
+                yield json.dumps(p) + '\n'
+        finally:
+            stream.close()
+    return Response(stream_with_context(lines()), mimetype='application/x-ndjson')
+
+
+def _encode_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode().rstrip('=')
+
+
+def _decode_cursor(cursor):
+    # a malformed or tampered cursor just starts from the beginning
+    if not cursor:
+        return None
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (binascii.Error, ValueError):
+        return None
+    if (isinstance(key, list) and len(key) == 3 and isinstance(key[0], str)
+            and isinstance(key[1], str) and isinstance(key[2], int)):
+        return tuple(key)
+    return None
 
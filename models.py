@@ -1,14 +1,110 @@
 from flask_login import UserMixin
 
-# Simple user class for session management.
-# The username and password are stored in environment variables.
+# Simple user class for session management.  Accounts live in
+# services.users.UserDirectory: id 1 is the one from the environment
+# variables, the others are registered in the sheet's Users tab.
 class User(UserMixin):
-    def __init__(self, username):
-        self.id = 1  # static ID since there's only one user
+    def __init__(self, id, username):
+        self.id = id
         self.username = username
 
-# Load the user from config (used by Flask-Login)
+# Load the user from the session's id (used by Flask-Login)
 def load_user(user_id):
-    from config import Config
-    return User(Config.AUTH_USERNAME)
+    from services.users import UserDirectory
+    try:
+        user_id = int(user_id)
+    except ValueError:
+        return None
+    return UserDirectory.get_instance().get(user_id)
 
+
+def _to_int(value, default=0):
+    if type(value) is int:
+        # typed sheet cells and already parsed values
+        return value
+    try:
+        return int(value) if value not in (None, '') else default
+    except (TypeError, ValueError):
+        return default
+
+
+class Book:
+    """Immutable book record shared by the storage backends and the templates.
+
+    Values are parsed once (see ``parse``) when a row is loaded or written,
+    and ``progress`` (percent read, 0-100) is worked out at the same time so
+    templates don't have to.  ``row`` is the sheet row the book lives in, or
+    ``None`` when unknown.  Use ``replace`` to get a changed copy.
+    """
+
+    FIELDS = (
+        'id', 'title', 'author', 'status', 'current_page', 'total_pages',
+        'is_favourite', 'user_id', 'cover_image', 'created_at',
+    )
+    __slots__ = FIELDS + ('row', 'progress')
+
+    def __init__(self, id=None, title='', author='', status='', current_page=0,
+                 total_pages=0, is_favourite=False, user_id=0, cover_image='',
+                 created_at='', row=None):
+        set_ = object.__setattr__
+        set_(self, 'id', id)
+        set_(self, 'title', title)
+        set_(self, 'author', author)
+        set_(self, 'status', status)
+        set_(self, 'current_page', current_page)
+        set_(self, 'total_pages', total_pages)
+        set_(self, 'is_favourite', is_favourite)
+        set_(self, 'user_id', user_id)
+        set_(self, 'cover_image', cover_image)
+        set_(self, 'created_at', created_at)
+        set_(self, 'row', row)
+        progress = 0
+        if total_pages > 0:
+            progress = round(current_page / total_pages * 100)
+        set_(self, 'progress', progress)
+
+    @classmethod
+    def parse(cls, data, row=None):
+        """Build a book from loosely typed values (sheet cells, form posts,
+        imported rows): ints for ids and pages, a bool for ``is_favourite``
+        and strings for everything else."""
+        book_id = _to_int(data.get('id'), None)
+        favourite = data.get('is_favourite')
+        if type(favourite) is not bool:
+            favourite = str(favourite).lower() in ('true', '1', 'yes')
+        return cls(
+            id=book_id,
+            title=str(data.get('title') or ''),
+            author=str(data.get('author') or ''),
+            status=str(data.get('status') or ''),
+            current_page=_to_int(data.get('current_page')),
+            total_pages=_to_int(data.get('total_pages')),
+            is_favourite=favourite,
+            user_id=_to_int(data.get('user_id')),
+            cover_image=str(data.get('cover_image') or ''),
+            created_at=str(data.get('created_at') or ''),
+            row=row,
+        )
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Book is immutable; use replace()')
+
+    def __delattr__(self, name):
+        raise AttributeError('Book is immutable')
+
+    def __repr__(self):
+        return f'Book(id={self.id!r}, title={self.title!r}, row={self.row!r})'
+
+    def replace(self, **changes):
+        """Return a copy with ``changes`` applied (and parsed like ``parse``)."""
+        row = changes.pop('row', self.row)
+        data = self.as_dict()
+        data.update(changes)
+        return Book.parse(data, row)
+
+    def as_dict(self):
+        return {f: getattr(self, f) for f in self.FIELDS}
+
+    def values(self, fields=FIELDS):
+        """Field values in sheet column order."""
+        return [getattr(self, f) for f in fields]
@@ -6,16 +6,20 @@ except ImportError:
     pass
 
 from app import create_app
-from services.sheets import GoogleSheetClient
+from services.activity import timestamp
+from services.storage import get_storage
 import random
 
 def seed_data():
     app = create_app()
     with app.app_context():
-        print("Seeding books into Google Sheet...")
-        client = GoogleSheetClient.get_instance()
+        print("Seeding books into the configured storage backend...")
+        client = get_storage()
+        # create_app() only started loading the sheet; without waiting the
+        # duplicate check below would see no books
+        client.wait_ready()
         existing = client.books_for_user(1)  # user_id is always 1
-        existing_titles = {b.get('title') for b in existing}
+        existing_titles = {b.title for b in existing}
 
         # 2. Define Books
         books_data = [
@@ -31,8 +35,8 @@ def seed_data():
             {"title": "Moby Dick", "author": "Herman Melville", "status": "Planned", "total": 635},
         ]
 
-        # 3. Add Books to sheet
-        added_count = 0
+        # 3. Add Books to sheet (in one batched call)
+        new_books = []
         for data in books_data:
             if data["title"] in existing_titles:
                 continue
@@ -51,12 +55,13 @@ def seed_data():
                 'is_favourite': random.choice([True, False]),
                 'user_id': 1,  # single user app
                 'cover_image': '',
-                'created_at': '',
+                'created_at': timestamp(),
             }
-            client.append_book(book)
-            added_count += 1
+            new_books.append(book)
 
-        print(f"Successfully added {added_count} books for 'testuser'.")
+        if new_books:
+            client.append_books(new_books)
+        print(f"Successfully added {len(new_books)} books for 'testuser'.")
 
 if __name__ == "__main__":
     seed_data()
@@ -0,0 +1,239 @@
+"""Reading activity: an append-only log of what changed on each book, and the
+per-user statistics built from it.
+
+Routes ``record`` events as they happen; a background thread writes them to
+a local SQLite file in batches.  The same transaction adds each batch to the
+day, ISO week and all-time ``rollups`` of its users, so the stats page reads
+a few dozen pre-summed rows however long the history gets.  Days and weeks
+are in UTC.
+"""
+import atexit
+import logging
+import os
+import sqlite3
+import time
+from datetime import date, timedelta
+from threading import Event, Lock, Thread, local
+
+from flask import current_app
+
+log = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    at TEXT NOT NULL,
+    user_id INTEGER NOT NULL,
+    book_id INTEGER,
+    kind TEXT NOT NULL,
+    value TEXT NOT NULL DEFAULT '',
+    delta INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS events_user_at ON events (user_id, at);
+
+-- span is 'day' (period '2026-10-17'), 'week' ('2026-W42') or 'all' ('')
+CREATE TABLE IF NOT EXISTS rollups (
+    user_id INTEGER NOT NULL,
+    span TEXT NOT NULL,
+    period TEXT NOT NULL,
+    pages INTEGER NOT NULL DEFAULT 0,
+    sessions INTEGER NOT NULL DEFAULT 0,
+    added INTEGER NOT NULL DEFAULT 0,
+    started INTEGER NOT NULL DEFAULT 0,
+    completed INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, span, period)
+);
+"""
+
+# rollup columns, in the order _contribution returns them
+_TOTALS = ('pages', 'sessions', 'added', 'started', 'completed')
+
+# events buffered before the writer is woken early
+BATCH_SIZE = 100
+
+
+def timestamp():
+    """The current UTC time the way ``created_at`` and events store it."""
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+
+
+def _periods(at):
+    day = date.fromisoformat(at[:10])
+    year, week, _ = day.isocalendar()
+    return [('day', day.isoformat()), ('week', f'{year}-W{week:02d}'), ('all', '')]
+
+
+def _contribution(kind, value, delta):
+    if kind == 'progress':
+        # pages read; going back a few pages doesn't un-read anything
+        return max(delta, 0), 1, 0, 0, 0
+    if kind == 'added':
+        return 0, 0, 1, int(value == 'Reading'), int(value == 'Completed')
+    if kind == 'status':
+        return 0, 0, 0, int(value == 'Reading'), int(value == 'Completed')
+    return 0, 0, 0, 0, 0
+
+
+def get_activity_log():
+    """The app's ``ActivityLog``, created on first use."""
+    activity = current_app.extensions.get('activity_log')
+    if activity is None:
+        path = current_app.config.get('ACTIVITY_DB_PATH') or os.path.join(
+            current_app.instance_path, 'activity.db'
+        )
+        activity = current_app.extensions['activity_log'] = ActivityLog(
+            path, current_app.config.get('ACTIVITY_FLUSH_INTERVAL', 2),
+        )
+    return activity
+
+
+class ActivityLog:
+    """Append-only event log with incrementally maintained rollups.
+
+    Events are kept in memory until the writer thread flushes them, every
+    ``flush_interval`` seconds or once ``BATCH_SIZE`` have piled up (and at
+    exit).  ``stats`` flushes first, so a user always sees their own latest
+    changes.
+    """
+
+    def __init__(self, path, flush_interval=2):
+        self.path = path
+        self.flush_interval = flush_interval
+        self._local = local()
+        self._lock = Lock()
+        self._flush_lock = Lock()
+        self._pending = []
+        self._wake = Event()
+        self._thread = None
+        self._conn().executescript(_SCHEMA)
+        atexit.register(self.flush)
+
+    # one connection per thread, as in services.sqlite_store
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def record(self, user_id, book_id, kind, value='', delta=0):
+        """Queue one event: ``added`` (value: status), ``progress`` (value:
+        page, delta: pages since last time), ``status`` or ``favourite``."""
+        with self._lock:
+            self._pending.append((timestamp(), user_id, book_id, kind, str(value), int(delta)))
+            if self._thread is None:
+                self._thread = Thread(target=self._run, name='activity-log', daemon=True)
+                self._thread.start()
+            if len(self._pending) >= BATCH_SIZE:
+                self._wake.set()
+
+    def record_changes(self, before, updates):
+        """Queue events for what ``updates`` changes on the book ``before``."""
+        after = before.replace(**updates)
+        if after.current_page != before.current_page:
+            self.record(after.user_id, after.id, 'progress', after.current_page,
+                        after.current_page - before.current_page)
+        if after.status != before.status:
+            self.record(after.user_id, after.id, 'status', after.status)
+        if after.is_favourite != before.is_favourite:
+            self.record(after.user_id, after.id, 'favourite', int(after.is_favourite))
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                log.exception('Writing reading activity failed')
+
+    def flush(self):
+        """Write the queued events and fold them into the rollups."""
+        with self._flush_lock:
+            with self._lock:
+                events, self._pending = self._pending, []
+            if not events:
+                return
+            sums = {}
+            for at, user_id, book_id, kind, value, delta in events:
+                amounts = _contribution(kind, value, delta)
+                if not any(amounts):
+                    continue
+                for span, period in _periods(at):
+                    key = user_id, span, period
+                    sums[key] = [a + b for a, b in zip(sums.get(key, (0,) * len(_TOTALS)), amounts)]
+            conn = self._conn()
+            try:
+                conn.execute('BEGIN IMMEDIATE')
+            except sqlite3.Error:
+                with self._lock:
+                    self._pending[:0] = events
+                raise
+            try:
+                conn.executemany(
+                    'INSERT INTO events (at, user_id, book_id, kind, value, delta) VALUES (?, ?, ?, ?, ?, ?)',
+                    events,
+                )
+                conn.executemany(
+                    f'INSERT INTO rollups (user_id, span, period, {", ".join(_TOTALS)}) '
+                    f'VALUES (?, ?, ?, {", ".join("?" * len(_TOTALS))}) '
+                    'ON CONFLICT (user_id, span, period) DO UPDATE SET '
+                    + ', '.join(f'{c} = {c} + excluded.{c}' for c in _TOTALS),
+                    [key + tuple(amounts) for key, amounts in sums.items()],
+                )
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                # keep them for the next attempt
+                with self._lock:
+                    self._pending[:0] = events
+                raise
+
+    def stats(self, user_id, days=30, weeks=12, today=None):
+        """Reading statistics for ``user_id`` from the rollups: pages per day
+        for the last ``days`` days, pages and completions for the last
+        ``weeks`` ISO weeks, streaks of days with progress and all-time
+        totals."""
+        self.flush()
+        today = today or date.fromisoformat(timestamp()[:10])
+        conn = self._conn()
+        rows = conn.execute(
+            f'SELECT span, period, {", ".join(_TOTALS)} FROM rollups WHERE user_id = ?', (user_id,)
+        ).fetchall()
+        by_span = {'day': {}, 'week': {}, 'all': {}}
+        for span, period, *amounts in rows:
+            by_span[span][period] = dict(zip(_TOTALS, amounts))
+        empty = dict.fromkeys(_TOTALS, 0)
+
+        recent_days = [today - timedelta(days=n) for n in range(days - 1, -1, -1)]
+        daily = [(d, by_span['day'].get(d.isoformat(), empty)['pages']) for d in recent_days]
+        weekly = []
+        for n in range(weeks - 1, -1, -1):
+            year, week, _ = (today - timedelta(weeks=n)).isocalendar()
+            weekly.append((f'{year}-W{week:02d}', by_span['week'].get(f'{year}-W{week:02d}', empty)))
+
+        # streaks: runs of consecutive days with a progress update
+        active = sorted(date.fromisoformat(p) for p, r in by_span['day'].items() if r['sessions'])
+        longest = run = 0
+        previous = None
+        for day in active:
+            run = run + 1 if previous is not None and day - previous == timedelta(days=1) else 1
+            longest = max(longest, run)
+            previous = day
+        current = run if previous is not None and today - previous <= timedelta(days=1) else 0
+
+        totals = by_span['all'].get('', empty)
+        return {
+            'daily': daily,
+            'weekly': weekly,
+            'pages_per_day': sum(pages for _, pages in daily) / days,
+            'current_streak': current,
+            'longest_streak': longest,
+            'totals': totals,
+            # books finished per book added (capped: books added before the log
+            # existed can be finished too)
+            'completion_rate': min(100, round(totals['completed'] / totals['added'] * 100)) if totals['added'] else 0,
+            'max_daily': max([pages for _, pages in daily] + [1]),
+        }
@@ -0,0 +1,80 @@
+"""Serve the stylesheet and fonts ``python -m assets.build`` writes.
+
+Their file names carry a content hash (``static/dist/manifest.json`` maps
+``app.css`` to ``app.<hash>.css``), so they are cached for a year without
+revalidation; a new build changes the names.  Pre-compressed ``.br`` and
+``.gz`` copies are sent to browsers that accept them.
+"""
+import hashlib
+import json
+import mimetypes
+import os
+
+from flask import abort, current_app, request, send_file, url_for
+
+# tried in order; the first the browser accepts and the build wrote wins
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+def _dist():
+    return current_app.config.get('ASSETS_DIR') or os.path.join(current_app.static_folder, 'dist')
+
+
+def _load():
+    """``(manifest, hash of it)`` for the current build, re-read when a new
+    build replaces it; ``({}, '')`` when there is none."""
+    path = os.path.join(_dist(), 'manifest.json')
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return {}, ''
+    cached = current_app.extensions.get('asset_manifest')
+    if cached is None or cached[0] != (path, mtime):
+        with open(path, 'rb') as f:
+            data = f.read()
+        cached = current_app.extensions['asset_manifest'] = (
+            (path, mtime), json.loads(data), hashlib.sha256(data).hexdigest()[:12])
+    return cached[1], cached[2]
+
+
+def _manifest():
+    return _load()[0]
+
+
+def asset_version():
+    """Identifies the current build, for caches of pages that link to it."""
+    return _load()[1]
+
+
+def asset_url(name):
+    """URL of the built ``name`` (e.g. ``app.css``), or None without a build."""
+    hashed = _manifest().get(name)
+    return url_for('asset', filename=hashed) if hashed else None
+
+
+def asset_view(filename):
+    if filename not in _manifest().values():
+        abort(404)
+    path = os.path.join(_dist(), filename)
+    if not os.path.isfile(path):
+        abort(404)
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    encoding = None
+    for name, ext in ENCODINGS:
+        if request.accept_encodings[name] and os.path.isfile(path + ext):
+            path, encoding = path + ext, name
+            break
+    response = send_file(path, mimetype=mimetype, conditional=True)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    response.cache_control.public = True
+    response.cache_control.max_age = 365 * 24 * 3600
+    response.cache_control.immutable = True
+    return response
+
+
+def init_app(app):
+    """Serve ``/assets/<hashed name>`` and give templates ``asset_url``."""
+    app.add_url_rule('/assets/<path:filename>', 'asset', asset_view)
+    app.add_template_global(asset_url)
@@ -0,0 +1,213 @@
+import hashlib
+import io
+import ipaddress
+import logging
+import os
+import socket
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from urllib.parse import urljoin, urlsplit
+
+from flask import current_app
+
+try:
+    from PIL import Image
+except ImportError:  # in requirements.txt; without it covers aren't cached
+    Image = None
+
+log = logging.getLogger(__name__)
+
+# refuse to download anything bigger than this
+MAX_DOWNLOAD = 10 * 1024 * 1024
+FETCH_TIMEOUT = 10
+# downloads run in the background, at most this many at a time
+FETCH_THREADS = 2
+# how long a cover that couldn't be fetched isn't tried again
+FAILURE_TTL = 600
+
+
+def source_hash(url):
+    """Short hash of a cover URL; part of the proxy URL so a changed cover
+    gets a new address and old ones can be cached forever."""
+    return hashlib.sha256(url.encode()).hexdigest()[:16]
+
+
+def _check_public(url):
+    # the URLs come from a spreadsheet; don't let them point us at the
+    # machine itself or the private network it sits in
+    parts = urlsplit(url)
+    if parts.scheme not in ('http', 'https') or not parts.hostname:
+        raise ValueError(f'Unsupported cover URL {url!r}')
+    for info in socket.getaddrinfo(parts.hostname, parts.port or 443, proto=socket.IPPROTO_TCP):
+        address = ipaddress.ip_address(info[4][0])
+        if not address.is_global:
+            raise ValueError(f'Cover URL {url!r} points at a non-public address')
+
+
+class _PublicRedirects(urllib.request.HTTPRedirectHandler):
+    # re-check every hop, a public URL may redirect somewhere private
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        _check_public(urljoin(req.full_url, newurl))
+        return super().redirect_request(req, fp, code, msg, headers, newurl)
+
+
+_opener = urllib.request.build_opener(_PublicRedirects)
+
+
+def get_cover_cache():
+    """The app's ``CoverCache``, created on first use."""
+    cache = current_app.extensions.get('cover_cache')
+    if cache is None:
+        directory = current_app.config.get('COVER_CACHE_DIR') or os.path.join(
+            current_app.instance_path, 'covers'
+        )
+        cache = current_app.extensions['cover_cache'] = CoverCache(
+            directory,
+            current_app.config.get('COVER_CACHE_MAX_MB', 100) * 1024 * 1024,
+            current_app.config.get('COVER_WIDTH', 512),
+        )
+    return cache
+
+
+class CoverCache:
+    """Size-bounded LRU cache of cover thumbnails on disk.
+
+    Each cover is downloaded once, in the background, shrunk to ``width``
+    pixels wide and stored under ``<source hash>.jpg``.  Least recently used
+    files are deleted once the directory grows past ``max_bytes``.  Failed
+    downloads are remembered for a while so a dead host doesn't get asked on
+    every page view.  Without Pillow nothing is cached (``enabled`` is
+    False): full-size originals are what the cache is there to avoid.
+    """
+
+    def __init__(self, directory, max_bytes, width):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.width = width
+        os.makedirs(directory, exist_ok=True)
+        self.enabled = Image is not None
+        if not self.enabled:
+            log.warning('Pillow is not installed; covers are loaded from their original hosts')
+        self._lock = Lock()
+        self._fetching = {}   # key -> Lock, so each cover is fetched once
+        self._queued = set()  # keys handed to the background fetchers
+        self._pool = ThreadPoolExecutor(FETCH_THREADS, thread_name_prefix='cover-fetch')
+        self._failed = {}     # key -> monotonic time of the failure
+        # key -> [file name, size, last use]; seeded from what's on disk
+        self._entries = {}
+        for entry in os.scandir(directory):
+            if entry.is_file() and not entry.name.startswith('.'):
+                stat = entry.stat()
+                key = entry.name.split('.')[0]
+                self._entries[key] = [entry.name, stat.st_size, stat.st_mtime]
+        self._total = sum(e[1] for e in self._entries.values())
+
+    def get(self, url):
+        """Return the path of the cached thumbnail for ``url``, or None when
+        it isn't cached (yet).  A missing cover is fetched in the background,
+        so a slow host never holds up the request asking for it."""
+        key = source_hash(url)
+        path = self._hit(key)
+        if path is None and self.enabled and not self._failed_recently(key):
+            with self._lock:
+                if key not in self._queued:
+                    self._queued.add(key)
+                    self._pool.submit(self._fetch_queued, key, url)
+        return path
+
+    def _failed_recently(self, key):
+        failed = self._failed.get(key)
+        return failed is not None and time.monotonic() - failed < FAILURE_TTL
+
+    def _fetch_queued(self, key, url):
+        try:
+            self.fetch(url)
+        finally:
+            with self._lock:
+                self._queued.discard(key)
+
+    def fetch(self, url):
+        """Download and store the thumbnail for ``url`` unless it is cached
+        already; returns its path, or None when it can't be had."""
+        key = source_hash(url)
+        path = self._hit(key)
+        if path is not None or not self.enabled or self._failed_recently(key):
+            return path
+        with self._lock:
+            fetch_lock = self._fetching.setdefault(key, Lock())
+        with fetch_lock:
+            path = self._hit(key)
+            if path is None:
+                try:
+                    path = self._store(key, *self._fetch(url))
+                    self._failed.pop(key, None)
+                except (OSError, ValueError):
+                    log.warning('Could not fetch cover %s', url, exc_info=True)
+                    self._failed[key] = time.monotonic()
+        with self._lock:
+            self._fetching.pop(key, None)
+        return path
+
+    def _hit(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            entry[2] = time.time()
+            return os.path.join(self.directory, entry[0])
+
+    def _fetch(self, url):
+        _check_public(url)
+        request = urllib.request.Request(url, headers={'User-Agent': 'books-tracker cover cache'})
+        with _opener.open(request, timeout=FETCH_TIMEOUT) as response:
+            content_type = response.headers.get_content_type()
+            if not content_type.startswith('image/'):
+                raise ValueError(f'{url!r} is not an image ({content_type})')
+            data = response.read(MAX_DOWNLOAD + 1)
+        if len(data) > MAX_DOWNLOAD:
+            raise ValueError(f'{url!r} is larger than {MAX_DOWNLOAD} bytes')
+        return self._thumbnail(data, content_type)
+
+    def _thumbnail(self, data, content_type):
+        try:
+            with Image.open(io.BytesIO(data)) as image:
+                image.thumbnail((self.width, self.width * 2))
+                out = io.BytesIO()
+                image.convert('RGB').save(out, 'JPEG', quality=82, optimize=True, progressive=True)
+        except (OSError, Image.DecompressionBombError) as e:
+            raise ValueError('Unreadable cover image') from e
+        return out.getvalue(), '.jpg'
+
+    def _store(self, key, data, ext):
+        name = key + ext
+        path = os.path.join(self.directory, name)
+        tmp_path = os.path.join(self.directory, f'.{name}.{os.getpid()}')
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        with self._lock:
+            old = self._entries.get(key)
+            if old is not None:
+                self._total -= old[1]
+            self._entries[key] = [name, len(data), time.time()]
+            self._total += len(data)
+            self._evict(keep=key)
+        return path
+
+    def _evict(self, keep):
+        # called with the lock held
+        if self._total <= self.max_bytes:
+            return
+        for key, (name, size, _) in sorted(self._entries.items(), key=lambda item: item[1][2]):
+            if self._total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            try:
+                os.unlink(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+            del self._entries[key]
+            self._total -= size
@@ -0,0 +1,31 @@
+# statuses the dashboard counts; books with any other (or no) status still
+# go in the queue, after the Planned ones
+STATUSES = ('Reading', 'Planned', 'Completed')
+
+
+class Dashboard:
+    """Everything the home page shows for one user, worked out in one go.
+
+    Built from the user's row-ordered Reading and Planned books, the number
+    of Completed books, their favourites and their books with any status
+    outside ``STATUSES``.  The storage backends cache
+    these until that user's books change, so treat them as read-only.
+    """
+
+    __slots__ = ('hero_book', 'queue_books', 'reading_count', 'planned_count',
+                 'completed_count', 'favourites')
+
+    def __init__(self, reading, planned, completed_count, favourites, others=()):
+        reading = tuple(reading)
+        planned = tuple(planned)
+        self.hero_book = reading[0] if reading else None
+        # the queue leaves out Completed books and lists the rest by status
+        self.queue_books = reading[1:] + planned + tuple(others)
+        self.reading_count = len(reading)
+        self.planned_count = len(planned)
+        self.completed_count = completed_count
+        self.favourites = tuple(favourites)
+
+    def context(self):
+        """Template variables for ``index.html``."""
+        return {name: getattr(self, name) for name in self.__slots__}
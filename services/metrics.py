@@ -0,0 +1,276 @@
+"""Process-wide metrics in the Prometheus text format, ``Server-Timing``
+headers and an on-demand sampling profiler.
+
+Metrics are plain counters, gauges and histograms kept in memory (no
+client library needed) and served by ``/metrics``.  Every gunicorn worker
+keeps its own, so scrape each worker or run one.
+"""
+import hmac
+import logging
+import os
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter as _Tally
+from contextlib import contextmanager
+
+from flask import Response, abort, current_app, g, has_request_context, request
+from flask.signals import before_render_template, template_rendered
+
+log = logging.getLogger(__name__)
+
+# seconds; fine enough for in-memory work, wide enough for API calls
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# longest profile /metrics/profile takes, in seconds
+MAX_PROFILE = 60
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join(
+        '{}="{}"'.format(n, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for n, v in zip(names, values)
+    )
+    return '{' + pairs + '}'
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+
+    def header(self):
+        return [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        super().__init__(name, help, labels)
+        self._values = {}
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels):
+        return self._values.get(labels, 0)
+
+    def render(self):
+        lines = self.header()
+        for labels, value in sorted(dict(self._values).items()):
+            lines.append(f'{self.name}{_format_labels(self.labels, labels)} {value}')
+        return lines
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def set(self, value, *labels):
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+        self._values = {}   # labels -> [bucket counts..., +Inf count, sum]
+
+    def observe(self, seconds, *labels):
+        index = bisect_left(self.buckets, seconds)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [0] * (len(self.buckets) + 2)
+            entry[index] += 1
+            entry[-1] += seconds
+
+    def count(self, *labels):
+        entry = self._values.get(labels)
+        return sum(entry[:-1]) if entry else 0
+
+    @contextmanager
+    def time(self, *labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def render(self):
+        lines = self.header()
+        with self._lock:
+            values = {labels: list(entry) for labels, entry in self._values.items()}
+        for labels, entry in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), entry[:-1]):
+                cumulative += count
+                le = _format_labels(self.labels + ('le',), labels + (bound,))
+                lines.append(f'{self.name}_bucket{le} {cumulative}')
+            label_text = _format_labels(self.labels, labels)
+            lines.append(f'{self.name}_sum{label_text} {entry[-1]}')
+            lines.append(f'{self.name}_count{label_text} {cumulative}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+HTTP_REQUESTS = REGISTRY.add(Counter(
+    'books_http_requests_total', 'HTTP requests handled', ('endpoint', 'method', 'status')))
+HTTP_DURATION = REGISTRY.add(Histogram(
+    'books_http_request_duration_seconds', 'Time to produce a response', ('endpoint',)))
+RENDER_DURATION = REGISTRY.add(Histogram(
+    'books_template_render_seconds', 'Jinja rendering time', ('template',)))
+SHEETS_CALLS = REGISTRY.add(Counter(
+    'books_sheets_api_calls_total', 'Google API calls', ('method', 'outcome')))
+SHEETS_RETRIES = REGISTRY.add(Counter(
+    'books_sheets_api_retries_total', 'Google API call attempts that were retried', ('method',)))
+SHEETS_DURATION = REGISTRY.add(Histogram(
+    'books_sheets_api_duration_seconds', 'Google API call time including retries', ('method',)))
+SHEETS_CACHE = REGISTRY.add(Counter(
+    'books_sheets_cache_events_total',
+    'Sheet cache reads (hit, stale, miss) and refreshes (unchanged, reload)', ('event',)))
+SHEETS_ROWS_LOADED = REGISTRY.add(Counter(
+    'books_sheets_rows_loaded_total', 'Rows downloaded by full sheet loads'))
+SHEETS_PARSE_DURATION = REGISTRY.add(Histogram(
+    'books_sheets_parse_seconds', 'Time to normalise and index a downloaded sheet'))
+BOOKS = REGISTRY.add(Gauge('books_cached_books', 'Books in the sheet caches (as of their last load)'))
+SHEET_PARTITIONS = REGISTRY.add(Gauge(
+    'books_sheet_partitions', 'Per-user sheet tabs currently cached, besides the default one'))
+
+
+def add_timing(name, seconds):
+    """Add ``seconds`` to the ``name`` entry of the current request's
+    ``Server-Timing`` header (a no-op outside requests)."""
+    if has_request_context():
+        timings = g.setdefault('_server_timing', {})
+        timings[name] = timings.get(name, 0.0) + seconds
+
+
+def sample_stacks(seconds, interval=0.005):
+    """Sample the stacks of all other threads every ``interval`` seconds for
+    ``seconds`` and return them in the collapsed format (``frame;frame n``)
+    that flamegraph.pl and speedscope read.  Wall-clock: waiting threads
+    show up too."""
+    me = threading.get_ident()
+    tally = _Tally()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                frame = frame.f_back
+            tally[';'.join(reversed(stack))] += 1
+        time.sleep(interval)
+    return ''.join(f'{stack} {n}\n' for stack, n in tally.most_common())
+
+
+_profiling = threading.Lock()
+
+
+def _require_token():
+    """Let only requests bearing ``METRICS_TOKEN`` through; without one
+    configured the endpoints don't exist."""
+    token = current_app.config.get('METRICS_TOKEN')
+    if not token:
+        abort(404)
+    supplied = request.headers.get('Authorization', '')
+    if not hmac.compare_digest(supplied.encode(), f'Bearer {token}'.encode()):
+        abort(401)
+
+
+def metrics_view():
+    _require_token()
+    return Response(REGISTRY.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def profile_view():
+    if not current_app.config.get('PROFILER_ENABLED'):
+        abort(404)
+    _require_token()
+    seconds = min(request.args.get('seconds', 10, type=float), MAX_PROFILE)
+    if not _profiling.acquire(blocking=False):
+        abort(409)
+    try:
+        log.info('Profiling for %.1fs', seconds)
+        stacks = sample_stacks(seconds, request.args.get('interval', 0.005, type=float))
+    finally:
+        _profiling.release()
+    return Response(stacks, mimetype='text/plain')
+
+
+def _start_request():
+    g._started = time.perf_counter()
+
+
+def _finish_request(response):
+    started = g.pop('_started', None)
+    if started is None:
+        return response
+    elapsed = time.perf_counter() - started
+    endpoint = request.endpoint or 'unmatched'
+    HTTP_REQUESTS.inc(endpoint, request.method, response.status_code)
+    HTTP_DURATION.observe(elapsed, endpoint)
+    if current_app.config.get('SERVER_TIMING'):
+        timings = g.pop('_server_timing', {})
+        timings['app'] = elapsed
+        response.headers['Server-Timing'] = ', '.join(
+            f'{name};dur={seconds * 1000:.1f}' for name, seconds in timings.items()
+        )
+    return response
+
+
+def _render_started(app, template, context, **extra):
+    if has_request_context():
+        g._render_started = time.perf_counter()
+
+
+def _render_finished(app, template, context, **extra):
+    if not has_request_context():
+        return
+    started = g.pop('_render_started', None)
+    if started is not None:
+        elapsed = time.perf_counter() - started
+        RENDER_DURATION.observe(elapsed, template.name or 'string')
+        add_timing('render', elapsed)
+
+
+def init_app(app):
+    """Time every request, serve ``/metrics`` and, when ``PROFILER_ENABLED``
+    is set, ``/metrics/profile?seconds=N``."""
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    before_render_template.connect(_render_started, app)
+    template_rendered.connect(_render_finished, app)
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
+    app.add_url_rule('/metrics/profile', 'profile', profile_view)
@@ -0,0 +1,148 @@
+import re
+import unicodedata
+from bisect import bisect_left, insort
+
+_WORD_RE = re.compile(r'\w+')
+
+# query words shorter than this only match whole words, longer ones also
+# match as a prefix ("dun" -> "dune") and, failing that, with one typo
+MIN_PREFIX = 2
+MIN_FUZZY = 4
+
+_LETTERS = 'abcdefghijklmnopqrstuvwxyz0123456789'
+
+
+def tokenize(text):
+    """Lower-cased, accent-free words of ``text``."""
+    text = unicodedata.normalize('NFKD', text or '').casefold()
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return _WORD_RE.findall(text)
+
+
+def book_tokens(book):
+    return set(tokenize(book.title)) | set(tokenize(book.author))
+
+
+def one_edit_away(word):
+    # every string one deletion, transposition, substitution or insertion
+    # away from ``word``; a few hundred dict lookups, independent of the
+    # size of the index
+    letters = set(_LETTERS) | set(word)
+    splits = [(word[:i], word[i:]) for i in range(len(word) + 1)]
+    edits = {a + b[1:] for a, b in splits if b}
+    edits |= {a + b[1] + b[0] + b[2:] for a, b in splits if len(b) > 1}
+    edits |= {a + c + b[1:] for a, b in splits if b for c in letters}
+    edits |= {a + c + b for a, b in splits for c in letters}
+    return edits
+
+
+class SearchIndex:
+    """Inverted index over book titles and authors.
+
+    Maps every word to the ids of the books containing it and keeps the
+    words in sorted order for prefix lookups, so a query never scans the
+    books or the vocabulary.
+
+    Like ``BookStore`` it is copy-on-write: ``copy`` is cheap and only the
+    posting sets a copy changes are duplicated, so older versions can keep
+    being read while a new one is built.
+    """
+
+    def __init__(self):
+        self._postings = {}   # word -> set of book ids
+        self._words = []      # sorted words (unsorted while first built)
+        self._owned = set()
+        self._words_owned = True
+        self._bulk = True
+
+    def freeze(self):
+        """Stop tracking what this version owns once it's built; a frozen
+        index must only be read (or copied)."""
+        if self._bulk:
+            # sorting once beats inserting every word in order
+            self._words.sort()
+            self._bulk = False
+        self._owned = None
+        self._words_owned = False
+
+    def copy(self):
+        new = SearchIndex.__new__(SearchIndex)
+        new._postings = dict(self._postings)
+        new._words = self._words
+        new._owned = set()
+        new._words_owned = False
+        new._bulk = False
+        return new
+
+    def _writable(self, word):
+        bucket = self._postings.get(word)
+        if word not in self._owned:
+            bucket = self._postings[word] = set(bucket) if bucket else set()
+            self._owned.add(word)
+        return bucket
+
+    def _words_writable(self):
+        if not self._words_owned:
+            self._words = list(self._words)
+            self._words_owned = True
+        return self._words
+
+    def add(self, book_id, tokens):
+        for word in tokens:
+            if word not in self._postings:
+                if self._bulk:
+                    self._words.append(word)
+                else:
+                    insort(self._words_writable(), word)
+            self._writable(word).add(book_id)
+
+    def remove(self, book_id, tokens):
+        for word in tokens:
+            if word not in self._postings:
+                continue
+            bucket = self._writable(word)
+            bucket.discard(book_id)
+            if bucket:
+                continue
+            del self._postings[word]
+            self._owned.discard(word)
+            words = self._words_writable()
+            if self._bulk:
+                words.remove(word)
+            else:
+                del words[bisect_left(words, word)]
+
+    def _matching_words(self, term):
+        """Words ``term`` matches, and whether any of them matched exactly."""
+        exact = term in self._postings
+        words = {term} if exact else set()
+        if len(term) < MIN_PREFIX:
+            return words, exact
+        all_words = self._words
+        i = bisect_left(all_words, term)
+        while i < len(all_words) and all_words[i].startswith(term):
+            words.add(all_words[i])
+            i += 1
+        if not words and len(term) >= MIN_FUZZY:
+            words = {w for w in one_edit_away(term) if w in self._postings}
+        return words, exact
+
+    def search(self, query):
+        """Return ``{book id: score}`` for books matching every word of
+        ``query``; the score counts the words that matched exactly."""
+        scores = None
+        for term in set(tokenize(query)):
+            words, exact = self._matching_words(term)
+            ids = set()
+            for word in words:
+                ids |= self._postings[word]
+            if scores is None:
+                scores = dict.fromkeys(ids, 0)
+            else:
+                scores = {i: scores[i] for i in ids if i in scores}
+            if exact:
+                for i in self._postings[term] & scores.keys():
+                    scores[i] += 1
+            if not scores:
+                return {}
+        return scores or {}
@@ -0,0 +1,88 @@
+import fcntl
+import mmap
+import os
+import struct
+import uuid
+from contextlib import contextmanager
+from threading import Lock
+
+# data version, next free book id, epoch (8 hex chars)
+_LAYOUT = struct.Struct('<qq8s')
+
+
+@contextmanager
+def file_lock(path, blocking=True):
+    """Hold an exclusive ``flock`` on ``path`` (created if needed) and yield
+    True, or yield False straight away when ``blocking`` is off and another
+    process has it."""
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        yield True
+    finally:
+        os.close(fd)
+
+
+class SharedState:
+    """Counters shared by every worker process through a memory-mapped file
+    (put it on a tmpfs such as ``/dev/shm``).
+
+    ``version`` goes up each time a worker publishes a new snapshot of the
+    books, so the others can tell with a single memory read whether theirs is
+    current.  ``allocate_id`` hands out book ids no other worker will use.
+    Changes happen under ``locked()``, which serialises both the threads of
+    this process and the other processes.
+    """
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.path = path
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        # flock is per open file, so threads need their own lock on top
+        self._thread_lock = Lock()
+        with self.locked():
+            if os.fstat(self._fd).st_size < _LAYOUT.size:
+                os.ftruncate(self._fd, _LAYOUT.size)
+                os.pwrite(self._fd, _LAYOUT.pack(0, 1, uuid.uuid4().hex[:8].encode()), 0)
+            self._map = mmap.mmap(self._fd, _LAYOUT.size)
+
+    @contextmanager
+    def locked(self):
+        with self._thread_lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _read(self):
+        return _LAYOUT.unpack_from(self._map)
+
+    @property
+    def epoch(self):
+        return self._read()[2].decode()
+
+    @property
+    def version(self):
+        return self._read()[0]
+
+    @property
+    def next_id(self):
+        return self._read()[1]
+
+    def set_version(self, version):
+        """Record ``version``; call with ``locked()`` held."""
+        _, next_id, epoch = self._read()
+        _LAYOUT.pack_into(self._map, 0, version, next_id, epoch)
+
+    def allocate_id(self, floor=1):
+        """Return a book id at least ``floor`` that hasn't been handed out."""
+        with self.locked():
+            version, next_id, epoch = self._read()
+            book_id = max(next_id, floor)
+            _LAYOUT.pack_into(self._map, 0, version, book_id + 1, epoch)
+        return book_id
@@ -1,40 +1,373 @@
-from flask import current_app
+from flask import current_app, g, has_request_context
 import json
+import logging
+import os
+import re
+import time
+import uuid
+from bisect import bisect_left
+from collections import OrderedDict
 from google.oauth2.service_account import Credentials
 from googleapiclient.discovery import build
-from threading import Lock
-from types import SimpleNamespace
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import Condition, Event, Lock, RLock, Thread, Timer
 
-SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
+from models import Book
+from services.metrics import (BOOKS, SHEET_PARTITIONS, SHEETS_CACHE, SHEETS_PARSE_DURATION,
+                              SHEETS_ROWS_LOADED)
+from services.shared import SharedState
+from services.snapshot import read_snapshot, write_snapshot
+from services.storage import resolved
+from services.store import BookStore
+from services.transport import SheetsTransport
 
-# The header row we expect on the spreadsheet.  This must match the sheet's first
-# row exactly.  Adjust if you add/remove fields in the Google Sheet.
-FIELDS = [
-    'id',
-    'title',
-    'author',
-    'status',
-    'current_page',
-    'total_pages',
-    'is_favourite',
-    'user_id',
-    'cover_image',
-    'created_at',
+SCOPES = [
+    'https://www.googleapis.com/auth/spreadsheets',
+    # only used to read the spreadsheet's modifiedTime for change detection
+    'https://www.googleapis.com/auth/drive.metadata.readonly',
 ]
 
+log = logging.getLogger(__name__)
+
+# The header row we expect on the spreadsheet.  This must match the sheet's first
+# row exactly.  Adjust ``Book.FIELDS`` if you add/remove fields in the Google Sheet.
+FIELDS = list(Book.FIELDS)
+
+# how long a write waits for the initial load before giving up
+WARM_UP_WAIT = 30
+
+# seconds the write queue's thread lingers without work before exiting
+WRITE_QUEUE_IDLE = 60
+
+# the original tab; it holds the books of user 1 (the AUTH_USERNAME account)
+DEFAULT_TAB = 'Sheet1'
+
+# seconds between a change and writing the on-disk snapshot, so bursts of
+# writes produce one file write
+SNAPSHOT_DELAY = 5
+
+# developer metadata entry (invisible in the Sheets UI) holding the next
+# book id, so ids of deleted books are never handed out again
+NEXT_ID_KEY = 'books_tracker.next_id'
+
+# pulls the first row number out of an A1 range such as ``Sheet1!A12:J12``
+_RANGE_ROW_RE = re.compile(r'![A-Z]+(\d+)')
+
+
+def _row_from_range(a1_range):
+    match = _RANGE_ROW_RE.search(a1_range or '')
+    return int(match.group(1)) if match else None
+
+
+def _cell_id(cells):
+    # the id cell of a row read from column A (typed or text); None if blank
+    try:
+        return int(cells[0])
+    except (IndexError, TypeError, ValueError):
+        return None
+
+
+def tab_for_user(user_id):
+    """Name of the tab holding ``user_id``'s books."""
+    return DEFAULT_TAB if user_id in (None, 1) else f'books_{user_id}'
+
+
+def _runs(rows):
+    # consecutive row numbers as (first, last) pairs: [2, 3, 7] -> (2, 3), (7, 7)
+    runs = []
+    for row in rows:
+        if runs and runs[-1][1] == row - 1:
+            runs[-1][1] = row
+        else:
+            runs.append([row, row])
+    return runs
+
+
+class WriteQueue:
+    """Coalesces sheet mutations so bursts of writes cost one API call each.
+
+    Writers hand over full row values and get a ``Future`` back.  A flusher
+    thread waits ``window`` seconds after the first queued write, then sends
+    everything collected so far: all appends as one multi-row ``append``, all
+    row rewrites as one ``values.batchUpdate`` and all deletions as one
+    ``values.batchClear``.  Several updates to the same row collapse into the
+    last one, and updates to a book whose append is still queued are folded
+    into that append.
+
+    The flusher only holds the client's write lock to take the batch and to
+    record what the API sent back, so writers never wait for a Sheets call;
+    their writes go in the next batch.  An update or delete of a book whose
+    append is being sent follows it once the row it landed on is known.
+    """
+
+    def __init__(self, client, window):
+        self.client = client
+        self.window = window
+        self._cond = Condition()
+        self._appends = {}   # book id -> [values, futures]
+        self._updates = {}   # sheet row -> [values, futures]
+        self._clears = {}    # sheet row -> [book id, futures]
+        self._sending = {}   # book id -> future of the row its append landed on
+        self._flushing = False
+        self._thread = None
+
+    @property
+    def pending(self):
+        return bool(self._flushing or self.queued)
+
+    @property
+    def queued(self):
+        # writes waiting for the next batch
+        return bool(self._appends or self._updates or self._clears)
+
+    def _queued(self, futures):
+        future = Future()
+        futures.append(future)
+        with self._cond:
+            if self._thread is None:
+                self._thread = Thread(target=self._run, name='sheet-write-queue', daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        return future
+
+    # the entry points below are called with the client's write lock held
+    def append(self, book_id, values):
+        entry = self._appends.setdefault(book_id, [None, []])
+        entry[0] = values
+        return self._queued(entry[1])
+
+    def update(self, book_id, row, values):
+        if row is None:
+            sending = self._sending.get(book_id)
+            if sending is not None:
+                return self._after_append(sending, lambda row: self._rewrite(book_id, row))
+            # the book's own append hasn't been sent yet; ride along with it
+            future = Future()
+            _chain(self.append(book_id, values), future, True)
+            return future
+        entry = self._updates.setdefault(row, [None, []])
+        entry[0] = values
+        return self._queued(entry[1])
+
+    def clear(self, book_id, row):
+        if row is None:
+            sending = self._sending.get(book_id)
+            if sending is not None:
+                return self._after_append(sending, lambda row: self.clear(book_id, row))
+            # never reached the sheet; just drop the queued append
+            for future in self._appends.pop(book_id, (None, []))[1]:
+                future.set_result(book_id)
+            return resolved(True)
+        for future in self._updates.pop(row, (None, []))[1]:
+            future.set_result(True)
+        return self._queued(self._clears.setdefault(row, [book_id, []])[1])
+
+    def _after_append(self, sending, write):
+        # queue ``write(row)`` once the append being sent has come back (the
+        # flush resolves ``sending`` with the write lock held)
+        future = Future()
+
+        def landed(sending):
+            if sending.exception() is not None:
+                future.set_exception(sending.exception())
+            elif sending.result() is None:
+                # the API didn't say where; the reload that follows sorts it out
+                future.set_result(False)
+            else:
+                _chain(write(sending.result()), future)
+        sending.add_done_callback(landed)
+        return future
+
+    def _rewrite(self, book_id, row):
+        book = self.client.store.get(book_id)
+        if book is None:
+            # deleted meanwhile; its clear follows the append as well
+            return resolved(True)
+        return self.update(book_id, row, book.values(self.client.header))
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self.queued:
+                    if not self._cond.wait(WRITE_QUEUE_IDLE):
+                        # the next write starts a new thread (see _queued);
+                        # idle partitions don't keep one around
+                        if not self.queued:
+                            self._thread = None
+                            return
+            # give concurrent writers a moment to add to this batch
+            time.sleep(self.window)
+            with self.client._write_lock:
+                self._flushing = True
+                batch = self._appends, self._updates, self._clears
+                self._appends, self._updates, self._clears = {}, {}, {}
+                self._sending = {book_id: Future() for book_id in batch[0]}
+            try:
+                self.client._flush(*batch)
+            except Exception:
+                log.exception('Flushing queued sheet writes failed')
+            finally:
+                with self.client._write_lock:
+                    for future in self._sending.values():
+                        if not future.done():
+                            future.set_exception(RuntimeError('Appending to the sheet failed'))
+                    self._sending = {}
+                    self._flushing = False
+
+
+def _chain(source, target, result=None):
+    # settle ``target`` like ``source`` (with ``result`` instead of its value
+    # when given)
+    def done(source):
+        if source.exception() is not None:
+            target.set_exception(source.exception())
+        else:
+            target.set_result(source.result() if result is None else result)
+    source.add_done_callback(done)
+
 
 class GoogleSheetClient:
     """Singleton wrapper around the Google Sheets API that also keeps a simple
     in-memory cache of the books.
 
-    The cache is populated the first time ``fetch_all_books`` is called and
-    refreshed any time we make a mutating request (append/update/delete).
+    Creating the client is cheap (the discovery documents bundled with
+    googleapiclient are used, nothing goes over the network).  The header check
+    and the first full load happen in a background warm-up thread; until it
+    finishes ``is_ready()`` is False, reads return nothing and writes wait for
+    it.
+
+    Writes are applied to the cache locally using the row reported back by the
+    API; a full reload only happens when that row doesn't match what we
+    expected (the sheet was changed behind our back).
+
+    The normalised cache is also written to a JSON-lines snapshot in the
+    instance folder.  On boot the warm-up serves that snapshot straight away
+    and then reconciles with the live sheet in the background, skipping the
+    download entirely when the sheet's ``modifiedTime`` hasn't moved.
+
+    The cache is a copy-on-write ``BookStore``: writers (holding
+    ``_write_lock``) build the next version and publish it by replacing
+    ``self.store``, so readers never lock and never see a half-applied write.
+
+    Once the cache is older than ``SHEETS_CACHE_TTL`` seconds, reads keep being
+    served from it while a background thread revalidates: it asks Drive for the
+    spreadsheet's ``modifiedTime`` and only re-downloads the rows when that has
+    changed, or when ``SHEETS_RECONCILE_INTERVAL`` seconds have passed since the
+    last full load.
+
+    Deleting a book only clears its row.  Once ``SHEETS_COMPACT_THRESHOLD``
+    blank rows have built up, ``compact`` removes them with one
+    ``deleteDimension`` batch and renumbers the cached rows.  Ids come from a
+    counter (``_next_id``) that is worked out when the sheet is loaded and
+    kept in the spreadsheet's developer metadata whenever deleting a book
+    would otherwise let its id be handed out again.
+
+    Each user's books live in a tab of their own (``tab_for_user``) with a
+    client of its own, so loading and caching cost grows with the books of
+    the users actually active.  ``get_instance(user_id)`` hands out those
+    partition clients; the default instance keeps the most recently used
+    ``SHEETS_ACTIVE_USERS`` of them and drops the least recently used idle
+    ones beyond that.  A request holds a lease on the partitions it was
+    handed until it tears down (``release_partitions``), so one is never
+    closed under a request still using it.  All of them share one transport
+    (and so one quota).
     """
 
     _instance = None
     _lock = Lock()
 
-    def __init__(self):
+    def __init__(self, service=None, drive=None, credentials=None, tab=DEFAULT_TAB, transport=None):
+        self.spreadsheet_id = current_app.config.get('GOOGLE_SHEET_ID')
+        if not self.spreadsheet_id:
+            raise RuntimeError('GOOGLE_SHEET_ID not set in configuration')
+        self.cache_ttl = current_app.config.get('SHEETS_CACHE_TTL', 30)
+        self.load_chunk_rows = current_app.config.get('SHEETS_LOAD_CHUNK_ROWS', 5000)
+        self.load_threads = current_app.config.get('SHEETS_LOAD_THREADS', 4)
+        self.reconcile_interval = current_app.config.get('SHEETS_RECONCILE_INTERVAL', 300)
+        # ``credentials`` alongside a ready-made ``service`` (e.g. one pointed
+        # at bench/fake_sheets.py) gives it pooled connections like in production
+        creds = credentials
+        if service is None:
+            creds = self._build_credentials()
+            service = build('sheets', 'v4', credentials=creds,
+                            static_discovery=True, cache_discovery=False)
+            drive = build('drive', 'v3', credentials=creds,
+                          static_discovery=True, cache_discovery=False)
+        self.service = service
+        self.drive = drive
+        self.tab = tab
+        # every API call goes through here: quotas, retries, pooled connections
+        self.transport = transport or SheetsTransport(
+            creds,
+            read_per_minute=current_app.config.get('SHEETS_READ_QUOTA', 60),
+            write_per_minute=current_app.config.get('SHEETS_WRITE_QUOTA', 60),
+            deadline=current_app.config.get('SHEETS_DEADLINE', 30),
+            pool_size=current_app.config.get('SHEETS_HTTP_POOL', 4),
+            timeout=current_app.config.get('SHEETS_HTTP_TIMEOUT', 20),
+        )
+        # serialises writes against each other and against a background
+        # refresh publishing a freshly loaded store
+        self._write_lock = RLock()
+        self._writes = 0
+        # a reload the write queue has to do after its next flush
+        self._reload_due = False
+        self._refresh_lock = Lock()
+        self._refreshing = False
+        self._queue = WriteQueue(self, current_app.config.get('SHEETS_WRITE_WINDOW', 0.05))
+        self.compact_threshold = current_app.config.get('SHEETS_COMPACT_THRESHOLD', 50)
+        self._blank_rows = 0
+        self._compacting = False
+        self._sheet_id = None
+        self._grid_rows = None
+        # next book id, and what the spreadsheet's metadata says it is
+        self._next_id = 1
+        self._persisted_next_id = 0
+        self._next_id_meta = None
+
+        self.header = None
+        self.store = BookStore()
+        # store versions only count up within this process; the epoch tells
+        # them apart from another worker's (or a previous run's)
+        self.epoch = uuid.uuid4().hex[:8]
+        self._loaded_at = 0.0
+        self._checked_at = 0.0
+        self._revision = None
+        self._ready = Event()
+        self._warm_up_lock = Lock()
+        self._warming = False
+        self._warm_up_error = None
+        self.snapshot_path = current_app.config.get('SHEETS_SNAPSHOT_PATH')
+        if self.snapshot_path is None:
+            self.snapshot_path = os.path.join(current_app.instance_path, 'sheet_snapshot.jsonl')
+        if self.snapshot_path and tab != DEFAULT_TAB:
+            self.snapshot_path = self._tab_path(self.snapshot_path)
+        self._snapshot_timer = None
+        self._counted = 0
+        # partition clients of other users' tabs, most recently used last
+        self._partitions = OrderedDict()
+        # requests currently using this client as a partition; see _lease
+        self._leases = 0
+        self.max_partitions = current_app.config.get('SHEETS_ACTIVE_USERS', 100)
+        # shared-cache mode: workers publish every change as a snapshot in a
+        # shared directory and follow each other through a version counter
+        self.shared = None
+        self._shared_seen = 0
+        self._shared_lock = Lock()
+        shared_dir = current_app.config.get('SHEETS_SHARED_DIR')
+        if shared_dir:
+            self.shared = SharedState(self._tab_path(os.path.join(shared_dir, 'state')))
+            self.snapshot_path = self._tab_path(os.path.join(shared_dir, 'sheet_snapshot.jsonl'))
+            self.epoch = self.shared.epoch
+
+    def _tab_path(self, path):
+        # per-tab files next to the default tab's: sheet_snapshot-books_2.jsonl
+        if self.tab == DEFAULT_TAB:
+            return path
+        root, ext = os.path.splitext(path)
+        return f'{root}-{self.tab}{ext}'
+
+    @staticmethod
+    def _build_credentials():
         scopes = SCOPES
         creds = None
 
@@ -52,130 +385,786 @@ class GoogleSheetClient:
             if not creds_path:
                 raise RuntimeError('GOOGLE_CREDS_PATH not set in configuration')
             creds = Credentials.from_service_account_file(creds_path, scopes=scopes)
-        self.service = build('sheets', 'v4', credentials=creds)
-        self.spreadsheet_id = current_app.config.get('GOOGLE_SHEET_ID')
-        if not self.spreadsheet_id:
-            raise RuntimeError('GOOGLE_SHEET_ID not set in configuration')
+        return creds
+
+    @classmethod
+    def get_instance(cls, user_id=None):
+        """The client for ``user_id``'s tab (the default tab's for None)."""
+        with cls._lock:
+            if cls._instance is None:
+                cls._instance = GoogleSheetClient()
+                cls._instance.start_warm_up()
+            instance = cls._instance
+        if tab_for_user(user_id) == DEFAULT_TAB:
+            return instance
+        return instance.partition(user_id)
+
+    def partition(self, user_id):
+        """Client for ``user_id``'s tab, created (and loaded in the
+        background) on first use."""
+        with self._lock:
+            client = self._partitions.get(user_id)
+            if client is not None:
+                self._partitions.move_to_end(user_id)
+                self._lease(client)
+                return client
+            client = self._partitions[user_id] = GoogleSheetClient(
+                service=self.service, drive=self.drive, tab=tab_for_user(user_id),
+                transport=self.transport,
+            )
+            self._lease(client)
+            self._evict_partitions()
+            SHEET_PARTITIONS.set(len(self._partitions))
+        client.start_warm_up()
+        return client
 
-        # load header and cache on first use
-        self.header = self._get_header()
-        if self.header != FIELDS:
+    @staticmethod
+    def _lease(client):
+        # called with the class lock held; once per request and client, given
+        # back by release_partitions when the request tears down
+        if not has_request_context():
+            return
+        leased = g.setdefault('sheet_partitions', set())
+        if client not in leased:
+            leased.add(client)
+            client._leases += 1
+
+    def _evict_partitions(self):
+        # called with the class lock held; clients with writes in flight or
+        # leased to a request stay
+        excess = len(self._partitions) - self.max_partitions
+        for user_id, client in list(self._partitions.items()):
+            if excess <= 0:
+                break
+            if client.is_idle() and not client._leases:
+                del self._partitions[user_id]
+                client.close()
+                excess -= 1
+
+    def is_idle(self):
+        return not (self._queue.pending or self._refreshing or self._compacting or self._warming)
+
+    def close(self):
+        """Write out a pending snapshot and forget the cache."""
+        timer = self._snapshot_timer
+        if timer is not None:
+            timer.cancel()
+            self._save_snapshot()
+        BOOKS.inc(amount=-self._counted)
+        self._counted = 0
+        self.store = BookStore()
+
+    def warm_up(self):
+        """Check the header row and load every book; blocks until done.
+
+        With a usable snapshot on disk the client becomes ready right after
+        reading it, and the rest of the warm-up reconciles with the sheet.
+        """
+        if self._restore_snapshot():
+            self._ready.set()
+        header = self._get_header()
+        if header != FIELDS:
             # if you change the FIELDS constant make sure the sheet headers
             # match or the code below will behave unpredictably.
             raise RuntimeError(
-                f"Sheet header mismatch: expected {FIELDS}, got {self.header}"
+                f"Sheet header mismatch: expected {FIELDS}, got {header}"
             )
-        self.cache = []
-        self._load_cache()
+        self.header = header
+        if self._ready.is_set():
+            self._refresh()
+        else:
+            self._load_cache(self._sheet_revision(), force=True)
+            self._ready.set()
 
-    @classmethod
-    def get_instance(cls):
-        with cls._lock:
-            if cls._instance is None:
-                cls._instance = GoogleSheetClient()
-            return cls._instance
+    def _restore_snapshot(self, published=False):
+        # ``published``: the snapshot was just written by another worker that
+        # had checked the sheet, so there's no need to check it again
+        if not self.snapshot_path or (published and self._queue.pending):
+            return False
+        meta, records = read_snapshot(self.snapshot_path, FIELDS)
+        if meta is None or meta.get('spreadsheet_id') != self.spreadsheet_id:
+            return False
+        books = [Book(*values, row=row) for row, values in records]
+        with self._write_lock:
+            if published and self._queue.pending:
+                # our own writes are in flight; they'll publish (and pick
+                # this snapshot up through a conflict reload if needed)
+                return False
+            self.header = list(FIELDS)
+            self.store = BookStore(books, version=self.store.version + 1)
+            self._next_id = max(
+                self._next_id, meta.get('next_id', 1),
+                max((b.id for b in books), default=0) + 1,
+            )
+            self._revision = meta.get('revision')
+            self._shared_seen = meta.get('version', 0)
+            # counts as loaded (so writes don't get discarded) but is due for
+            # a check against the sheet straight away
+            self._loaded_at = time.monotonic()
+            self._checked_at = self._loaded_at if published else 0.0
+        log.info('Restored %d books from %s', len(books), self.snapshot_path)
+        return True
+
+    def _schedule_snapshot(self):
+        # called after the cache changed; coalesces bursts into one write
+        if not self.snapshot_path or self._snapshot_timer is not None:
+            return
+        if self.shared is not None:
+            # the other workers are waiting for it
+            self._save_snapshot()
+            return
+        self._snapshot_timer = Timer(SNAPSHOT_DELAY, self._save_snapshot)
+        self._snapshot_timer.daemon = True
+        self._snapshot_timer.start()
+
+    def _save_snapshot(self):
+        self._snapshot_timer = None
+        with self._write_lock:
+            store, revision, next_id = self.store, self._revision, self._next_id
+            records = [(b.row, b.values()) for b in store.all() if b.row is not None]
+        try:
+            if self.shared is None:
+                write_snapshot(
+                    self.snapshot_path, self.header, records,
+                    spreadsheet_id=self.spreadsheet_id, revision=revision, saved_at=time.time(),
+                    next_id=next_id,
+                )
+                return
+            with self.shared.locked():
+                version = self.shared.version + 1
+                write_snapshot(
+                    self.snapshot_path, self.header, records,
+                    spreadsheet_id=self.spreadsheet_id, revision=revision, saved_at=time.time(),
+                    next_id=next_id, version=version,
+                )
+                self.shared.set_version(version)
+            self._shared_seen = version
+        except OSError:
+            log.warning('Could not write sheet snapshot to %s', self.snapshot_path, exc_info=True)
+
+    def _follow_shared(self):
+        # another worker published a newer snapshot: load it before serving,
+        # so a user whose write went to that worker sees it here too
+        if self.shared.version == self._shared_seen:
+            return
+        with self._shared_lock:
+            if self.shared.version != self._shared_seen:
+                self._restore_snapshot(published=True)
+
+    def start_warm_up(self):
+        """Run ``warm_up`` in a background thread unless already done/running."""
+        with self._warm_up_lock:
+            if self._warming or self._ready.is_set():
+                return
+            self._warming = True
+        Thread(target=self._warm_up_in_background, name='sheet-warm-up', daemon=True).start()
+
+    def _warm_up_in_background(self):
+        try:
+            self.warm_up()
+            self._warm_up_error = None
+        except Exception as e:
+            log.exception('Loading the sheet failed')
+            self._warm_up_error = e
+        finally:
+            with self._warm_up_lock:
+                self._warming = False
+
+    def is_ready(self):
+        """True once the sheet has been loaded.  While it isn't, make sure a
+        warm-up is running and re-raise the error of a failed one."""
+        if self._ready.is_set():
+            return True
+        error, self._warm_up_error = self._warm_up_error, None
+        self.start_warm_up()
+        if error is not None:
+            raise error
+        return False
+
+    def wait_ready(self, timeout=WARM_UP_WAIT):
+        """Block until the sheet has been loaded.  Raises the error of a
+        failed warm-up, or ``RuntimeError`` after ``timeout`` seconds."""
+        deadline = time.monotonic() + timeout
+        # is_ready() restarts a failed warm-up and re-raises its error
+        while not self.is_ready():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise RuntimeError('Timed out waiting for the sheet to load')
+            self._ready.wait(min(remaining, 0.5))
 
     def _get_header(self):
         # read the first row of the sheet, which should contain field names
-        result = (
+        result = self.transport.execute(
             self.service.spreadsheets()
             .values()
-            .get(spreadsheetId=self.spreadsheet_id, range='Sheet1!1:1')
-            .execute()
+            .get(spreadsheetId=self.spreadsheet_id, range=f'{self.tab}!1:1')
         )
         values = result.get('values', [])
         return values[0] if values else []
 
-    def _load_cache(self):
-        # grab all data rows starting at row 2
-        result = (
+    def _sheet_revision(self):
+        # cheap change probe: Drive bumps modifiedTime on every edit, whether
+        # it came through the API or the Sheets UI.  None means "unknown".
+        if self.drive is None:
+            return None
+        try:
+            # Drive has its own, much larger quota
+            result = self.transport.execute(
+                self.drive.files().get(fileId=self.spreadsheet_id, fields='modifiedTime'),
+                bucket=False,
+            )
+        except Exception:
+            log.warning('Could not read spreadsheet modifiedTime', exc_info=True)
+            return None
+        return result.get('modifiedTime')
+
+    def _read_ranges(self):
+        # row chunks to download, planned from the last row the cache knows
+        # of (on the first load, the tab's grid size).  The last range is
+        # open-ended, so rows added since are read all the same.
+        size = self.load_chunk_rows
+        last = self._last_data_row()
+        if size and not self._loaded_at and last <= 1:
+            self._get_sheet_id()
+            last = self._grid_rows or 1
+        ranges = []
+        start = 2
+        while size and start + size <= last:
+            ranges.append(f'{self.tab}!A{start}:J{start + size - 1}')
+            start += size
+        ranges.append(f'{self.tab}!A{start}:J')
+        return ranges
+
+    def _read_chunk(self, a1_range):
+        # numbers and booleans come back typed, so parsing them is cheap;
+        # dates stay the text the sheet shows
+        result = self.transport.execute(
             self.service.spreadsheets()
             .values()
-            .get(spreadsheetId=self.spreadsheet_id, range='Sheet1!A2:J')
-            .execute()
+            .batchGet(spreadsheetId=self.spreadsheet_id, ranges=[a1_range],
+                      valueRenderOption='UNFORMATTED_VALUE',
+                      dateTimeRenderOption='FORMATTED_STRING')
         )
-        rows = result.get('values', [])
-        self.cache = []
-        for idx, row in enumerate(rows, start=2):
-            # zip row to header, fill missing cols with empty string
-            data = {k: row[i] if i < len(row) else '' for i, k in enumerate(self.header)}
-            data['_row'] = idx
-            self.cache.append(self._normalize_book(data))
-
-    def _normalize_book(self, book):
-        # convert types and provide defaults
+        rows = (result.get('valueRanges') or [{}])[0].get('values', [])
+        start = _row_from_range(a1_range)
+        began = time.perf_counter()
+        books = self._books_from_rows(rows, start)
+        return books, start + len(rows) - 1, time.perf_counter() - began
+
+    def _read_books(self):
+        """Download and parse every data row.  Returns the books in row
+        order, the last row read and the seconds spent parsing.
+
+        Large tabs are fetched ``load_chunk_rows`` rows at a time on up to
+        ``load_threads`` threads, each chunk parsed as soon as it arrives.
+        """
+        ranges = self._read_ranges()
+        # without a connection pool every call shares one httplib2.Http,
+        # which isn't thread-safe
+        threads = min(self.load_threads, len(ranges)) if self.transport.pool else 1
+        if threads <= 1:
+            chunks = [self._read_chunk(a1_range) for a1_range in ranges]
+        else:
+            with ThreadPoolExecutor(threads, thread_name_prefix='sheet-load') as pool:
+                chunks = list(pool.map(self._read_chunk, ranges))
+        books = [book for chunk, _, _ in chunks for book in chunk]
+        last_row = max(last for _, last, _ in chunks)
+        SHEETS_ROWS_LOADED.inc(amount=last_row - 1)
+        return books, last_row, sum(seconds for _, _, seconds in chunks)
+
+    def _books_from_rows(self, rows, start=2):
+        # blank rows (left behind by deletions) are skipped, not parsed
+        books = []
+        header = self.header
+        for idx, row in enumerate(rows, start=start):
+            if not any(row):
+                continue
+            # missing trailing cells parse as their defaults
+            books.append(self._normalize_book(dict(zip(header, row)), idx))
+        return books
+
+    def _read_next_id(self):
+        # the persisted id counter; the highest value wins should several
+        # writers have created an entry
         try:
-            book['id'] = int(book.get('id')) if book.get('id') not in (None, '') else None
-        except ValueError:
-            book['id'] = None
-        book['current_page'] = int(book.get('current_page') or 0)
-        book['total_pages'] = int(book.get('total_pages') or 0)
-        book['is_favourite'] = str(book.get('is_favourite')).lower() in ('true', '1', 'yes')
+            result = self.transport.execute(
+                self.service.spreadsheets().developerMetadata().search(
+                    spreadsheetId=self.spreadsheet_id,
+                    body={'dataFilters': [{'developerMetadataLookup': {'metadataKey': NEXT_ID_KEY}}]},
+                )
+            )
+        except Exception:
+            log.warning('Could not read the id counter', exc_info=True)
+            return
+        for match in result.get('matchedDeveloperMetadata', []):
+            meta = match['developerMetadata']
+            value = int(meta.get('metadataValue') or 0)
+            if value >= self._persisted_next_id:
+                self._persisted_next_id = value
+                self._next_id_meta = meta['metadataId']
+
+    def _persist_next_id(self):
+        # only needed when the highest id handed out is no longer in the
+        # sheet; otherwise the next load works the counter out by itself
+        next_id = self._next_id
+        if self.shared is not None:
+            next_id = max(next_id, self.shared.next_id)
+        if next_id <= self._persisted_next_id or next_id - 1 in self.store:
+            return
+        meta = {'metadataKey': NEXT_ID_KEY, 'metadataValue': str(next_id)}
+        if self._next_id_meta is None:
+            request = {'createDeveloperMetadata': {'developerMetadata': dict(
+                meta, location={'spreadsheet': True}, visibility='DOCUMENT')}}
+        else:
+            request = {'updateDeveloperMetadata': {
+                'dataFilters': [{'developerMetadataLookup': {'metadataId': self._next_id_meta}}],
+                'developerMetadata': meta,
+                'fields': 'metadataValue',
+            }}
+        try:
+            result = self.transport.execute(self.service.spreadsheets().batchUpdate(
+                spreadsheetId=self.spreadsheet_id, body={'requests': [request]},
+            ), write=True)
+        except Exception:
+            # not fatal; the next deletion tries again
+            log.warning('Could not save the id counter', exc_info=True)
+            return
+        if self._next_id_meta is None:
+            reply = result.get('replies', [{}])[0].get('createDeveloperMetadata', {})
+            self._next_id_meta = reply.get('developerMetadata', {}).get('metadataId')
+        self._persisted_next_id = next_id
+
+    def _load_cache(self, revision=None, force=False):
+        writes = self._writes
+        busy = self._queue.pending
+        self._read_next_id()
+        books, last_row, parse_seconds = self._read_books()
+        began = time.perf_counter()
+        store = BookStore(books)
+        SHEETS_PARSE_DURATION.observe(parse_seconds + time.perf_counter() - began)
+        top_id = max((b.id for b in books if b.id is not None), default=0)
+        with self._write_lock:
+            if self._loaded_at and (writes != self._writes or self._queue.queued
+                                    or (not force and (busy or self._queue.pending))):
+                # a write was in flight while we were downloading, so these
+                # rows may predate it; keep the patched store and try again
+                # next time (for a reload that can't wait, after the flush of
+                # those writes)
+                if force:
+                    self._reload_due = True
+                return
+            self._reload_due = False
+            store.version = self.store.version + 1
+            self.store = store
+            SHEETS_CACHE.inc('reload')
+            BOOKS.inc(amount=len(store) - self._counted)
+            self._counted = len(store)
+            self._next_id = max(self._next_id, self._persisted_next_id, top_id + 1)
+            self._blank_rows = last_row - 1 - len(books)
+            self._loaded_at = self._checked_at = time.monotonic()
+            self._revision = revision
+        self._schedule_snapshot()
+        self._maybe_compact()
+
+    def _maybe_compact(self):
+        # in shared-cache mode other workers may hold queued writes addressed
+        # by row number, which compaction would shift under them
+        if (not self.compact_threshold or self.shared is not None
+                or self._blank_rows < self.compact_threshold):
+            return
+        with self._refresh_lock:
+            if self._compacting:
+                return
+            self._compacting = True
+        Thread(target=self._compact_in_background, name='sheet-compaction', daemon=True).start()
+
+    def _compact_in_background(self):
+        try:
+            self.compact()
+        except Exception:
+            log.exception('Compacting the sheet failed')
+        finally:
+            with self._refresh_lock:
+                self._compacting = False
+
+    def _get_sheet_id(self):
+        # deleteDimension addresses the tab by its numeric id, not its name;
+        # the row count comes along for planning the first load
+        if self._sheet_id is None:
+            result = self.transport.execute(self.service.spreadsheets().get(
+                spreadsheetId=self.spreadsheet_id,
+                fields='sheets.properties(sheetId,title,gridProperties.rowCount)',
+            ))
+            for sheet in result.get('sheets', []):
+                if sheet['properties']['title'] == self.tab:
+                    self._sheet_id = sheet['properties']['sheetId']
+                    self._grid_rows = sheet['properties'].get('gridProperties', {}).get('rowCount')
+        return self._sheet_id
+
+    def compact(self):
+        """Delete the blank rows between books and renumber the cached rows;
+        returns how many rows were removed.  Skipped (returning 0) while
+        writes are queued, since those address rows by number."""
+        self.wait_ready()
+        with self._write_lock:
+            if self._queue.pending:
+                return 0
+            books, last_row, _ = self._read_books()
+            filled = {b.row for b in books}
+            blank = [row for row in range(2, last_row + 1) if row not in filled]
+            if not blank:
+                self._blank_rows = 0
+                return 0
+            sheet_id = self._get_sheet_id()
+            if sheet_id is None:
+                raise RuntimeError(f'{self.tab} not found in the spreadsheet')
+            # bottom-up, so earlier deletions don't shift the later ranges
+            requests = [
+                {'deleteDimension': {'range': {
+                    'sheetId': sheet_id, 'dimension': 'ROWS',
+                    'startIndex': first - 1, 'endIndex': last,
+                }}}
+                for first, last in reversed(_runs(blank))
+            ]
+            self.transport.execute(self.service.spreadsheets().batchUpdate(
+                spreadsheetId=self.spreadsheet_id, body={'requests': requests},
+            ), write=True)
+            # every book moves up by the number of blank rows above it
+            books = [
+                b.replace(row=b.row - bisect_left(blank, b.row))
+                for b in books
+            ]
+            self.store = BookStore(books, version=self.store.version + 1)
+            self._writes += 1
+            self._blank_rows = 0
+            self._loaded_at = self._checked_at = time.monotonic()
+            self._revision = self._sheet_revision()
+        log.info('Removed %d blank rows from the sheet', len(blank))
+        self._schedule_snapshot()
+        return len(blank)
+
+    def _refresh(self):
         try:
-            book['user_id'] = int(book.get('user_id') or 0)
-        except ValueError:
-            book['user_id'] = 0
-        # other fields stay as strings
-        return book
+            revision = self._sheet_revision()
+            overdue = (
+                self.reconcile_interval
+                and time.monotonic() - self._loaded_at >= self.reconcile_interval
+            )
+            if revision is not None and revision == self._revision and not overdue:
+                SHEETS_CACHE.inc('unchanged')
+                self._checked_at = time.monotonic()
+            else:
+                self._load_cache(revision)
+        except Exception:
+            # keep serving the cache we have; the next read retries
+            log.exception('Background refresh of the sheet cache failed')
+        finally:
+            with self._refresh_lock:
+                self._refreshing = False
+
+    def _maybe_reconcile(self):
+        # nothing blocks here: before the warm-up finished the (empty) store
+        # is served, afterwards a stale cache is served while it gets
+        # revalidated in the background (stale-while-revalidate)
+        if not self._ready.is_set():
+            SHEETS_CACHE.inc('miss')
+            self.start_warm_up()
+            return
+        if self.shared is not None:
+            self._follow_shared()
+        if time.monotonic() - self._checked_at < self.cache_ttl:
+            SHEETS_CACHE.inc('hit')
+            return
+        SHEETS_CACHE.inc('stale')
+        with self._refresh_lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        Thread(target=self._refresh, name='sheet-cache-refresh', daemon=True).start()
+
+    def _last_data_row(self):
+        # highest sheet row that still holds a book (cleared rows don't count,
+        # the API appends straight after the last non-empty row)
+        for book in self.store.newest_first():
+            if book.row is not None:
+                return book.row
+        return 1
+
+    def _normalize_book(self, data, row=None):
+        # convert types and provide defaults
+        return Book.parse(data, row)
 
     def fetch_all_books(self):
-        if not self.cache:
-            self._load_cache()
-        return self.cache
+        self._maybe_reconcile()
+        return self.store.all()
+
+    def get_book(self, book_id):
+        self._maybe_reconcile()
+        return self.store.get(book_id)
+
+    def append_book(self, book_dict, wait=True):
+        """Add a book and return its id (or, with ``wait=False``, a future
+        resolving to the id once the row reached the sheet)."""
+        self.wait_ready()
+        with self._write_lock:
+            future = self._append_locked(book_dict)
+        return self._settle(future, wait)
+
+    def append_books(self, book_dicts):
+        """Add several books with a single append call; returns their ids."""
+        self.wait_ready()
+        with self._write_lock:
+            futures = [self._append_locked(b) for b in book_dicts]
+        return [self._settle(f, True) for f in futures]
 
-    # helper to convert a dict to a SimpleNamespace for template consumption
-    def book_obj(self, d):
-        return SimpleNamespace(**d)
+    def _settle(self, future, wait):
+        if self.shared is None:
+            return future.result() if wait else future
+        # the user's next request may go to any worker, and the others only
+        # see a write once it's published, so wait either way
+        result = future.result()
+        # the flush publishes before it lets go of the lock
+        with self._write_lock:
+            pass
+        return result if wait else resolved(result)
 
-    def append_book(self, book_dict):
+    def _append_locked(self, book_dict):
         # assign a new numeric id sequence if not provided
-        ids = [b['id'] for b in self.cache if b.get('id') is not None]
-        next_id = max(ids, default=0) + 1
-        book_dict['id'] = next_id
-        # ensure fields are strings for the sheet
-        values = [book_dict.get(f, '') for f in self.header]
-        body = {'values': [values]}
-        self.service.spreadsheets().values().append(
+        if book_dict.get('id') is None:
+            book_dict['id'] = self._next_id
+            if self.shared is not None:
+                # another worker may be handing out the same number
+                book_dict['id'] = self.shared.allocate_id(book_dict['id'])
+        # the row isn't known until the append comes back; the write queue
+        # fills it in
+        book = self._normalize_book(book_dict)
+        if book.id is not None:
+            self._next_id = max(self._next_id, book.id + 1)
+        self.store = self.store.evolve(put=[book])
+        self._writes += 1
+        return self._queue.append(book.id, book.values(self.header))
+
+    def update_book(self, book_id, updates, wait=True):
+        self.wait_ready()
+        with self._write_lock:
+            current = self.store.get(book_id)
+            if not current:
+                return False if wait else resolved(False)
+            book = current.replace(**updates)
+            self.store = self.store.evolve(put=[book])
+            self._writes += 1
+            future = self._queue.update(book_id, book.row, book.values(self.header))
+        return self._settle(future, wait)
+
+    def delete_book(self, book_id, wait=True):
+        self.wait_ready()
+        with self._write_lock:
+            book = self.store.get(book_id)
+            if not book:
+                return False if wait else resolved(False)
+            self.store = self.store.evolve(remove=[book_id])
+            self._writes += 1
+            future = self._queue.clear(book_id, book.row)
+        return self._settle(future, wait)
+
+    def _flush(self, appends, updates, clears):
+        # send one batch from the write queue.  The API calls are made
+        # without the write lock, so writers carry on filling the next batch;
+        # it's only taken to record what came back (and to publish it)
+        values_api = self.service.spreadsheets().values()
+        conflict = False
+        failed = None
+        if updates or clears:
+            try:
+                updates, clears, conflict = self._retarget(values_api, updates, clears)
+            except Exception as e:
+                failed = e
+        stages = []
+        if appends:
+            stages.append((lambda: self._flush_appends(values_api, appends, clears), appends))
+        if updates:
+            stages.append((lambda: self._flush_updates(values_api, updates), updates))
+        if clears:
+            stages.append((lambda: self._flush_clears(values_api, clears), clears))
+        sent, unsent = [], []
+        for send, entries in stages:
+            if failed is None:
+                try:
+                    # each stage returns what to record once the lock is held
+                    sent.append(send())
+                    continue
+                except Exception as e:
+                    failed = e
+            unsent.extend(f for entry in entries.values() for f in entry[1])
+        revision = None
+        if sent and not conflict and failed is None:
+            # our own writes moved modifiedTime; remember where they left it
+            # so the next revalidation doesn't download them again (an edit
+            # made in the Sheets UI at the same moment waits for the
+            # reconcile interval)
+            revision = self._sheet_revision()
+        with self._write_lock:
+            for record in sent:
+                if record():
+                    conflict = True
+            if revision is not None and not conflict:
+                self._revision = revision
+            for future in unsent:
+                future.set_exception(failed)
+            if not (conflict or failed is not None or self._reload_due):
+                self._schedule_snapshot()
+        if failed is not None:
+            # routes don't wait for the outcome, so make sure it's seen
+            log.error('Writing to the sheet failed; reloading it', exc_info=failed)
+        if conflict or failed is not None or self._reload_due:
+            # either the sheet moved under us or our optimistic cache holds
+            # writes that never happened; the sheet is the source of truth
+            self._load_cache(force=True)
+        else:
+            self._maybe_compact()
+
+    def _locate(self, values_api, rows=None):
+        # book id -> sheet row, read from the id column (column A) across
+        # ``rows``, or the whole tab
+        first, last = (min(rows), max(rows)) if rows else (2, '')
+        result = self.transport.execute(values_api.batchGet(
             spreadsheetId=self.spreadsheet_id,
-            range='Sheet1!A:Z',
-            valueInputOption='USER_ENTERED',
-            body=body,
-        ).execute()
-        self._load_cache()
-        return book_dict['id']
-
-    def update_book(self, book_id, updates):
-        book = next((b for b in self.cache if b.get('id') == book_id), None)
-        if not book:
-            return False
-        # apply updates in cache copy
-        book.update(updates)
-        row = book['_row']
-        values = [book.get(f, '') for f in self.header]
-        body = {'values': [values]}
-        self.service.spreadsheets().values().update(
+            ranges=[f'{self.tab}!A{first}:A{last}'],
+            valueRenderOption='UNFORMATTED_VALUE',
+        ))
+        column = (result.get('valueRanges') or [{}])[0].get('values', [])
+        return {_cell_id(cells): row for row, cells in enumerate(column, start=first)}
+
+    def _retarget(self, values_api, updates, clears):
+        """Make sure the rows about to be rewritten or cleared still hold the
+        books we think they do.  Rows inserted, deleted or sorted in the
+        Sheets UI move books around; those writes are sent to where each book
+        is now, and writes for books no longer in the sheet resolve to False.
+        Returns the updates and clears to send and whether anything moved."""
+        expected = {row: entry[0][0] for row, entry in updates.items()}
+        expected.update((row, entry[0]) for row, entry in clears.items())
+        found = self._locate(values_api, list(expected))
+        if all(found.get(book_id) == row for row, book_id in expected.items()):
+            return updates, clears, False
+        log.warning('Rows moved in the sheet since it was loaded; locating books by id')
+        found = self._locate(values_api)
+        moved = []
+        for queued in (updates, clears):
+            targeted = {}
+            for row, entry in queued.items():
+                book_id = entry[0] if queued is clears else entry[0][0]
+                new_row = found.get(book_id)
+                if new_row is None:
+                    for future in entry[1]:
+                        future.set_result(False)
+                else:
+                    targeted[new_row] = entry
+            moved.append(targeted)
+        return moved[0], moved[1], True
+
+    def _flush_appends(self, values_api, appends, clears):
+        # appends go first, straight after the last row that holds data
+        # (rows queued for clearing still count at this point)
+        expected_row = max([self._last_data_row()] + list(clears)) + 1
+        # a retried append could add the rows twice, so only retry when the
+        # API promises it didn't run it (429)
+        result = self.transport.execute(values_api.append(
             spreadsheetId=self.spreadsheet_id,
-            range=f'Sheet1!A{row}:Z{row}',
+            range=f'{self.tab}!A:Z',
             valueInputOption='USER_ENTERED',
-            body=body,
-        ).execute()
-        self._load_cache()
-        return True
+            body={'values': [entry[0] for entry in appends.values()]},
+        ), write=True, idempotent=False)
+        start = _row_from_range(result.get('updates', {}).get('updatedRange'))
 
-    def delete_book(self, book_id):
-        book = next((b for b in self.cache if b.get('id') == book_id), None)
-        if not book:
-            return False
-        row = book['_row']
-        self.service.spreadsheets().values().clear(
+        def record():
+            placed = []
+            for offset, book_id in enumerate(appends):
+                book = self.store.get(book_id)
+                if book is not None and start is not None:
+                    placed.append(book.replace(row=start + offset))
+            self.store = self.store.evolve(put=placed)
+            for offset, (book_id, (values, futures)) in enumerate(appends.items()):
+                sending = self._queue._sending.pop(book_id, None)
+                if sending is not None:
+                    sending.set_result(None if start is None else start + offset)
+                for future in futures:
+                    future.set_result(book_id)
+            # someone else appended (or removed) rows since our last load, so
+            # our row numbers can't be trusted any more
+            return start != expected_row
+        return record
+
+    def _flush_updates(self, values_api, updates):
+        data = [
+            {'range': f'{self.tab}!A{row}:Z{row}', 'values': [entry[0]]}
+            for row, entry in updates.items()
+        ]
+        self.transport.execute(values_api.batchUpdate(
             spreadsheetId=self.spreadsheet_id,
-            range=f'Sheet1!A{row}:Z{row}'
-        ).execute()
-        self._load_cache()
-        return True
+            body={'valueInputOption': 'USER_ENTERED', 'data': data},
+        ), write=True)
+
+        def record():
+            for entry in updates.values():
+                for future in entry[1]:
+                    future.set_result(True)
+        return record
+
+    def _flush_clears(self, values_api, clears):
+        self.transport.execute(values_api.batchClear(
+            spreadsheetId=self.spreadsheet_id,
+            body={'ranges': [f'{self.tab}!A{row}:Z{row}' for row in clears]},
+        ), write=True)
+        self._persist_next_id()
+
+        def record():
+            self._blank_rows += len(clears)
+            for _, futures in clears.values():
+                for future in futures:
+                    future.set_result(True)
+        return record
 
     # convenience filtering
-    def books_for_user(self, user_id):
-        if not self.cache:
-            self._load_cache()
-        return [b for b in self.cache if b.get('user_id') == user_id]
+    def books_for_user(self, user_id, status=None):
+        self._maybe_reconcile()
+        return self.store.for_user(user_id, status)
+
+    def favourites_for_user(self, user_id):
+        self._maybe_reconcile()
+        return self.store.favourites(user_id)
+
+    def books_page(self, user_id, after=None, limit=None):
+        self._maybe_reconcile()
+        return self.store.page(user_id, after, limit)
+
+    def search_books(self, user_id, query, limit=20):
+        self._maybe_reconcile()
+        return self.store.search(user_id, query, limit)
+
+    def data_version(self):
+        """Number that goes up whenever any book changes (in this process,
+        see ``epoch``; in shared-cache mode across all workers)."""
+        self._maybe_reconcile()
+        if self.shared is not None:
+            return self._shared_seen
+        return self.store.version
+
+    def dashboard_for_user(self, user_id):
+        self._maybe_reconcile()
+        return self.store.dashboard(user_id)
+
+
+def release_partitions(exc=None):
+    """Give back the partition clients this request was handed (registered
+    as a ``teardown_request`` handler, which runs after streamed responses
+    finish), evicting any that were only kept for it."""
+    leased = g.pop('sheet_partitions', None)
+    if not leased:
+        return
+    with GoogleSheetClient._lock:
+        for client in leased:
+            client._leases -= 1
+        instance = GoogleSheetClient._instance
+        if instance is not None:
+            instance._evict_partitions()
+            SHEET_PARTITIONS.set(len(instance._partitions))
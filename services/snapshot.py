@@ -0,0 +1,49 @@
+import json
+import os
+import tempfile
+
+# bump whenever the line layout below changes so old files get ignored
+SNAPSHOT_FORMAT = 1
+
+
+def write_snapshot(path, header, records, **meta):
+    """Atomically write ``records`` to a JSON-lines snapshot at ``path``.
+
+    ``records`` are ``(row, values)`` pairs with values in ``header`` order.
+    The first line holds metadata (format, header and whatever is passed in
+    ``meta``), every following line one record as ``[row, value, ...]``,
+    which keeps the file compact and quick to parse.
+    """
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix='.snapshot-', dir=directory)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(json.dumps(dict(meta, format=SNAPSHOT_FORMAT, header=header)) + '\n')
+            for row, values in records:
+                f.write(json.dumps([row] + list(values)) + '\n')
+        # readers either see the old file or the complete new one
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def read_snapshot(path, header):
+    """Return ``(meta, records)`` from a snapshot, or ``(None, [])`` when the
+    file is missing, unreadable or was written for a different header/format."""
+    try:
+        with open(path, encoding='utf-8') as f:
+            meta = json.loads(f.readline())
+            if meta.get('format') != SNAPSHOT_FORMAT or meta.get('header') != header:
+                return None, []
+            records = []
+            for line in f:
+                row, *values = json.loads(line)
+                records.append((row, values))
+    except (OSError, ValueError):
+        return None, []
+    return meta, records
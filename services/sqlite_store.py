@@ -0,0 +1,461 @@
+import json
+import logging
+import os
+import sqlite3
+import time
+import uuid
+from contextlib import contextmanager
+from threading import Event, Lock, Thread, local
+
+from flask import current_app
+
+from models import Book
+from services.dashboard import STATUSES, Dashboard
+from services.search import MIN_FUZZY, MIN_PREFIX, one_edit_away, tokenize
+from services.shared import file_lock
+from services.sheets import FIELDS, GoogleSheetClient
+from services.storage import resolved
+from services.store import sort_key
+
+log = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS books (
+    id INTEGER PRIMARY KEY,
+    title TEXT NOT NULL DEFAULT '',
+    author TEXT NOT NULL DEFAULT '',
+    status TEXT NOT NULL DEFAULT '',
+    current_page INTEGER NOT NULL DEFAULT 0,
+    total_pages INTEGER NOT NULL DEFAULT 0,
+    is_favourite INTEGER NOT NULL DEFAULT 0,
+    user_id INTEGER NOT NULL DEFAULT 0,
+    cover_image TEXT NOT NULL DEFAULT '',
+    created_at TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS books_user_status ON books (user_id, status);
+CREATE INDEX IF NOT EXISTS books_user_favourite ON books (user_id, is_favourite);
+CREATE INDEX IF NOT EXISTS books_user_sorted ON books (user_id, status, title, id);
+
+-- local changes not yet pushed to the sheet, replayed in seq order
+CREATE TABLE IF NOT EXISTS outbox (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    op TEXT NOT NULL,
+    book_id INTEGER NOT NULL,
+    payload TEXT NOT NULL DEFAULT '{}',
+    attempts INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+
+-- full-text index over title and author, kept in step by the triggers
+CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5(
+    title, author, content='books', content_rowid='id',
+    tokenize='unicode61 remove_diacritics 2'
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS books_fts_vocab USING fts5vocab(books_fts, 'row');
+CREATE TRIGGER IF NOT EXISTS books_fts_insert AFTER INSERT ON books BEGIN
+    INSERT INTO books_fts (rowid, title, author) VALUES (new.id, new.title, new.author);
+END;
+CREATE TRIGGER IF NOT EXISTS books_fts_delete AFTER DELETE ON books BEGIN
+    INSERT INTO books_fts (books_fts, rowid, title, author) VALUES ('delete', old.id, old.title, old.author);
+END;
+CREATE TRIGGER IF NOT EXISTS books_fts_update AFTER UPDATE OF title, author ON books BEGIN
+    INSERT INTO books_fts (books_fts, rowid, title, author) VALUES ('delete', old.id, old.title, old.author);
+    INSERT INTO books_fts (rowid, title, author) VALUES (new.id, new.title, new.author);
+END;
+"""
+
+_COLUMNS = ', '.join(FIELDS)
+
+
+def _row_to_book(row):
+    return Book.parse(dict(zip(FIELDS, row)))
+
+
+def _book_values(book):
+    values = book.values(FIELDS)
+    values[FIELDS.index('is_favourite')] = 1 if book.is_favourite else 0
+    return values
+
+
+class SQLiteBookStore:
+    """Book storage backed by a local SQLite file, mirrored to the sheet.
+
+    Reads and writes only touch SQLite, so request latency doesn't depend on
+    the Sheets API.  Every write also records an entry in the ``outbox``
+    table inside the same transaction; a background thread replays the outbox
+    against the sheet in order and removes entries once the sheet accepted
+    them, so nothing is lost if the process stops mid-sync.  When the outbox
+    is empty the thread pulls the sheet back in, which keeps edits made in the
+    Sheets UI flowing into the local copy.
+    """
+
+    _instance = None
+    _lock = Lock()
+
+    def __init__(self):
+        self.app = current_app._get_current_object()
+        self.path = current_app.config.get('SQLITE_PATH') or os.path.join(
+            current_app.instance_path, 'books.db'
+        )
+        self.pull_interval = current_app.config.get('SQLITE_PULL_INTERVAL', 60)
+        self._local = local()
+        self._sync_lock = Lock()
+        # user_id -> (data version, Dashboard)
+        self._dashboards = {}
+        self._conn().executescript(_SCHEMA)
+        # identifies this database file in ETags; the data version below is
+        # only meaningful together with it
+        self._conn().execute(
+            "INSERT OR IGNORE INTO meta (key, value) VALUES ('epoch', ?)", (uuid.uuid4().hex[:8],)
+        )
+        self.epoch = self._meta('epoch')
+        if not self._meta('fts'):
+            # databases created before the search index existed
+            with self._transaction() as conn:
+                conn.execute("INSERT INTO books_fts (books_fts) VALUES ('rebuild')")
+                self._set_meta('fts', '1')
+        if not self._meta('bootstrapped'):
+            # first start against this database: copy the sheet in once (this
+            # waits for the sheet to load; if it fails nothing is marked done
+            # and the next get_instance() tries again)
+            self._pull()
+            self._set_meta('bootstrapped', '1')
+        self._wake = Event()
+        # push anything a previous process left in the outbox straight away
+        self._wake.set()
+        self._last_pull = time.monotonic()
+        self._closed = False
+        # cuts a retry back-off short when the store is closed
+        self._stop = Event()
+        self._thread = Thread(target=self._sync_loop, name='sheet-sync', daemon=True)
+        self._thread.start()
+
+    @classmethod
+    def get_instance(cls, user_id=None):
+        # one database for everybody; queries go through the user_id indexes
+        with cls._lock:
+            if cls._instance is None:
+                cls._instance = SQLiteBookStore()
+            return cls._instance
+
+    def close(self):
+        """Stop the background sync thread and wait for a sync it is in the
+        middle of to finish (pending changes stay in the outbox)."""
+        self._closed = True
+        self._stop.set()
+        self._wake.set()
+        self._thread.join()
+
+    # connection handling: one connection per thread, autocommit mode with
+    # explicit transactions for writes
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            # INSERT OR REPLACE only fires the delete trigger with this on
+            conn.execute('PRAGMA recursive_triggers=ON')
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def _meta(self, key):
+        row = self._conn().execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key, value):
+        self._conn().execute(
+            'INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, value)
+        )
+
+    def _bump_version(self, conn):
+        # data version shared by every process using the file; readers compare
+        # it against what their cached dashboards were built from
+        conn.execute(
+            "INSERT INTO meta (key, value) VALUES ('version', 1) "
+            'ON CONFLICT (key) DO UPDATE SET value = value + 1'
+        )
+
+    def _query(self, where='', params=(), order='id', limit=None):
+        sql = f'SELECT {_COLUMNS} FROM books {where} ORDER BY {order}'
+        if limit is not None:
+            sql += f' LIMIT {int(limit)}'
+        rows = self._conn().execute(sql, params).fetchall()
+        return [_row_to_book(r) for r in rows]
+
+    # reads
+    def is_ready(self):
+        return True
+
+    def wait_ready(self, timeout=None):
+        # the database is there from the start
+        pass
+
+    def get_book(self, book_id):
+        books = self._query('WHERE id = ?', (book_id,))
+        return books[0] if books else None
+
+    def books_for_user(self, user_id, status=None):
+        if status is None:
+            return self._query('WHERE user_id = ?', (user_id,))
+        return self._query('WHERE user_id = ? AND status = ?', (user_id, status))
+
+    def favourites_for_user(self, user_id):
+        return self._query('WHERE user_id = ? AND is_favourite = 1', (user_id,))
+
+    def books_page(self, user_id, after=None, limit=None):
+        # keyset pagination straight off the (user_id, status, title, id) index
+        where, params = 'WHERE user_id = ?', [user_id]
+        if after:
+            where += ' AND (status, title, id) > (?, ?, ?)'
+            params.extend(after)
+        books = self._query(
+            where, params, order='status, title, id',
+            limit=None if limit is None else limit + 1,
+        )
+        (total,) = self._conn().execute(
+            'SELECT COUNT(*) FROM books WHERE user_id = ?', (user_id,)
+        ).fetchone()
+        if limit is None or len(books) <= limit:
+            return books, None, total
+        books = books[:limit]
+        return books, sort_key(books[-1]), total
+
+    def fetch_all_books(self):
+        return self._query()
+
+    def search_books(self, user_id, query, limit=20):
+        terms = tokenize(query)
+        if not terms:
+            return []
+        conn = self._conn()
+        match = []
+        for term in terms:
+            # same rules as services.search: short words must match whole,
+            # longer ones as a prefix or, failing that, with one typo
+            if len(term) < MIN_PREFIX:
+                match.append(f'"{term}"')
+                continue
+            match.append(f'"{term}"*')
+            if len(term) >= MIN_FUZZY:
+                hit = conn.execute(
+                    'SELECT 1 FROM books_fts_vocab WHERE term >= ? AND term < ? LIMIT 1',
+                    (term, term + '\U0010ffff'),
+                ).fetchone()
+                if hit is None:
+                    edits = sorted(one_edit_away(term))
+                    rows = conn.execute(
+                        f'SELECT term FROM books_fts_vocab WHERE term IN ({", ".join("?" * len(edits))})',
+                        edits,
+                    ).fetchall()
+                    if rows:
+                        match[-1] = '(' + ' OR '.join(f'"{r[0]}"' for r in rows) + ')'
+        columns = ', '.join(f'books.{f}' for f in FIELDS)
+        rows = conn.execute(
+            f'SELECT {columns} FROM books_fts JOIN books ON books.id = books_fts.rowid '
+            'WHERE books_fts MATCH ? AND books.user_id = ? ORDER BY rank LIMIT ?',
+            (' AND '.join(match), user_id, limit),
+        ).fetchall()
+        return [_row_to_book(r) for r in rows]
+
+    def data_version(self):
+        return int(self._meta('version') or 0)
+
+    def dashboard_for_user(self, user_id):
+        version = self.data_version()
+        cached = self._dashboards.get(user_id)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        dashboard = Dashboard(
+            self.books_for_user(user_id, 'Reading'),
+            self.books_for_user(user_id, 'Planned'),
+            self._conn().execute(
+                'SELECT COUNT(*) FROM books WHERE user_id = ? AND status = ?',
+                (user_id, 'Completed'),
+            ).fetchone()[0],
+            self.favourites_for_user(user_id),
+            self._query(
+                f'WHERE user_id = ? AND (status IS NULL OR status NOT IN ({", ".join("?" * len(STATUSES))}))',
+                (user_id, *STATUSES),
+            ),
+        )
+        self._dashboards[user_id] = (version, dashboard)
+        return dashboard
+
+    # writes
+    def _enqueue(self, conn, op, book_id, payload):
+        conn.execute(
+            'INSERT INTO outbox (op, book_id, payload) VALUES (?, ?, ?)',
+            (op, book_id, json.dumps(payload)),
+        )
+        self._bump_version(conn)
+
+    def _insert(self, conn, book_dict):
+        if book_dict.get('id') is None:
+            (book_dict['id'],) = conn.execute(
+                'SELECT COALESCE(MAX(id), 0) + 1 FROM books'
+            ).fetchone()
+        book = Book.parse(book_dict)
+        conn.execute(
+            f'INSERT INTO books ({_COLUMNS}) VALUES ({", ".join("?" * len(FIELDS))})',
+            _book_values(book),
+        )
+        self._enqueue(conn, 'append', book.id, book.as_dict())
+        return book.id
+
+    # writes only touch the local file, so there is nothing to wait for;
+    # ``wait=False`` just gets the result as a finished future
+    def append_book(self, book_dict, wait=True):
+        book_id = self.append_books([book_dict])[0]
+        return book_id if wait else resolved(book_id)
+
+    def append_books(self, book_dicts):
+        with self._transaction() as conn:
+            ids = [self._insert(conn, b) for b in book_dicts]
+        self._wake.set()
+        return ids
+
+    def update_book(self, book_id, updates, wait=True):
+        result = self._update(book_id, updates)
+        return result if wait else resolved(result)
+
+    def _update(self, book_id, updates):
+        updates = {k: v for k, v in updates.items() if k in FIELDS and k != 'id'}
+        with self._transaction() as conn:
+            current = conn.execute(f'SELECT {_COLUMNS} FROM books WHERE id = ?', (book_id,)).fetchone()
+            if current is None:
+                return False
+            book = _row_to_book(current).replace(**updates)
+            conn.execute(
+                f'UPDATE books SET {", ".join(f"{f} = ?" for f in FIELDS)} WHERE id = ?',
+                _book_values(book) + [book_id],
+            )
+            self._enqueue(conn, 'update', book_id, updates)
+        self._wake.set()
+        return True
+
+    def delete_book(self, book_id, wait=True):
+        result = self._delete(book_id)
+        return result if wait else resolved(result)
+
+    def _delete(self, book_id):
+        with self._transaction() as conn:
+            if conn.execute('DELETE FROM books WHERE id = ?', (book_id,)).rowcount == 0:
+                return False
+            self._enqueue(conn, 'delete', book_id, {})
+        self._wake.set()
+        return True
+
+    # syncing with the sheet
+    def _sync_loop(self):
+        backoff = 1
+        with self.app.app_context():
+            while not self._closed:
+                self._wake.wait(self.pull_interval)
+                self._wake.clear()
+                if self._closed:
+                    return
+                try:
+                    self.sync(pull=time.monotonic() - self._last_pull >= self.pull_interval)
+                    backoff = 1
+                except Exception:
+                    log.exception('Syncing books with the sheet failed; retrying in %ss', backoff)
+                    self._stop.wait(backoff)
+                    backoff = min(backoff * 2, 300)
+                    self._wake.set()
+
+    def sync(self, pull=True):
+        """Push the outbox to the sheet and optionally pull sheet edits back."""
+        # every worker process runs a sync thread; only one may replay the
+        # outbox at a time or entries would be sent twice
+        with self._sync_lock, file_lock(self.path + '.sync', blocking=False) as locked:
+            if not locked:
+                return
+            self._push()
+            if pull:
+                self._pull()
+                self._last_pull = time.monotonic()
+
+    def _push(self, batch_size=500):
+        # hand a whole slice of the outbox to the sheet client at once so its
+        # write queue can coalesce it into a few API calls, then wait for the
+        # acknowledgements in order
+        sheet = GoogleSheetClient.get_instance()
+        # "already in the sheet?" means nothing against a cache still loading
+        sheet.wait_ready()
+        conn = self._conn()
+        while True:
+            entries = conn.execute(
+                'SELECT seq, op, book_id, payload FROM outbox ORDER BY seq LIMIT ?',
+                (batch_size,),
+            ).fetchall()
+            if not entries:
+                return
+            submitted = []
+            for seq, op, book_id, payload in entries:
+                payload = json.loads(payload)
+                if op == 'append':
+                    # the append may already have reached the sheet if we
+                    # stopped before removing the entry; don't add it twice
+                    if sheet.get_book(book_id) is not None:
+                        future = sheet.update_book(book_id, payload, wait=False)
+                    else:
+                        future = sheet.append_book(payload, wait=False)
+                elif op == 'update':
+                    future = sheet.update_book(book_id, payload, wait=False)
+                else:
+                    future = sheet.delete_book(book_id, wait=False)
+                submitted.append((seq, op, book_id, future))
+            for seq, op, book_id, future in submitted:
+                try:
+                    result = future.result()
+                except Exception:
+                    conn.execute('UPDATE outbox SET attempts = attempts + 1 WHERE seq = ?', (seq,))
+                    raise
+                if op == 'update' and result is False:
+                    log.warning('Book %s no longer in the sheet; dropping update', book_id)
+                conn.execute('DELETE FROM outbox WHERE seq = ?', (seq,))
+
+    def _pull(self):
+        # mirror the sheet into SQLite, leaving alone any book that still has
+        # local changes waiting in the outbox
+        sheet = GoogleSheetClient.get_instance()
+        # before the first load the cache is empty, which would read as every
+        # book having been deleted from the sheet
+        sheet.wait_ready()
+        sheet_books = {b.id: b for b in sheet.fetch_all_books() if b.id is not None}
+        with self._transaction() as conn:
+            pending = {r[0] for r in conn.execute('SELECT DISTINCT book_id FROM outbox')}
+            local_books = {
+                r[0]: r for r in conn.execute(f'SELECT {_COLUMNS} FROM books')
+            }
+            changed = False
+            for book_id, book in sheet_books.items():
+                values = tuple(_book_values(book))
+                if book_id in pending or local_books.get(book_id) == values:
+                    continue
+                conn.execute(
+                    f'INSERT OR REPLACE INTO books ({_COLUMNS}) VALUES ({", ".join("?" * len(FIELDS))})',
+                    values,
+                )
+                changed = True
+            for book_id in local_books.keys() - sheet_books.keys() - pending:
+                conn.execute('DELETE FROM books WHERE id = ?', (book_id,))
+                changed = True
+            if changed:
+                self._bump_version(conn)
@@ -0,0 +1,129 @@
+import logging
+import os
+from concurrent.futures import Future
+from importlib import import_module
+from threading import Thread
+from typing import Protocol
+
+from flask import current_app, has_request_context
+from flask_login import current_user
+
+log = logging.getLogger(__name__)
+
+# STORAGE_BACKEND value -> "module:Class"; every class provides get_instance()
+BACKENDS = {
+    'sheets': 'services.sheets:GoogleSheetClient',
+    'sqlite': 'services.sqlite_store:SQLiteBookStore',
+}
+
+
+class BookStorage(Protocol):
+    """What the routes need from a book store.
+
+    Books come back as immutable ``models.Book`` records; writes accept plain
+    dicts with the fields in ``Book.FIELDS``.  Lists come back in insertion
+    order.  ``dashboard_for_user`` returns a ``services.dashboard.Dashboard``
+    that is only rebuilt after the user's books changed.  ``books_page``
+    pages through a user's books in ``services.store.sort_key`` order and
+    returns ``(books, next_key, total)``.  ``search_books`` matches every
+    word of the query against titles and authors (as a prefix, or with one
+    typo when nothing starts with it), best matches first.
+
+    ``append_book`` and ``append_books`` fill in the ``id`` of each dict
+    they are given, so callers know it without waiting for the write.
+
+    Writes show up in reads as soon as they return.  With ``wait=False`` they
+    don't block until the change has been stored durably (for the sheet
+    client: acknowledged by the API) and return a
+    ``concurrent.futures.Future`` of the result instead, already done when
+    there is nothing to wait for (see ``resolved``).  Asyncio code can
+    ``await asyncio.wrap_future(...)`` it.
+
+    ``is_ready()`` says whether the books have been loaded (reads return
+    nothing before that); ``wait_ready()`` blocks until they have.
+
+    ``data_version()`` goes up whenever any book changes; together with
+    ``epoch`` (which changes when the version counter starts over) it
+    identifies the state of the data, e.g. for ETags.
+    """
+
+    epoch: str
+
+    def is_ready(self): ...
+
+    def wait_ready(self): ...
+
+    def get_book(self, book_id): ...
+
+    def books_for_user(self, user_id, status=None): ...
+
+    def favourites_for_user(self, user_id): ...
+
+    def books_page(self, user_id, after=None, limit=None): ...
+
+    def search_books(self, user_id, query, limit=20): ...
+
+    def dashboard_for_user(self, user_id): ...
+
+    def fetch_all_books(self): ...
+
+    def data_version(self): ...
+
+    def append_book(self, book_dict, wait=True): ...
+
+    def append_books(self, book_dicts): ...
+
+    def update_book(self, book_id, updates, wait=True): ...
+
+    def delete_book(self, book_id, wait=True): ...
+
+
+def resolved(value):
+    """A ``Future`` that is already done with ``value``, for ``wait=False``
+    writes that have nothing left to wait for."""
+    future = Future()
+    future.set_result(value)
+    return future
+
+
+def get_storage() -> BookStorage:
+    """Return the storage backend selected by ``STORAGE_BACKEND`` (for the
+    sheet backend: the client of the logged-in user's partition)."""
+    name = current_app.config.get('STORAGE_BACKEND', 'sheets')
+    try:
+        target = BACKENDS[name]
+    except KeyError:
+        raise RuntimeError(f'Unknown STORAGE_BACKEND {name!r}; expected one of {sorted(BACKENDS)}')
+    module_name, class_name = target.split(':')
+    return getattr(import_module(module_name), class_name).get_instance(_current_user_id())
+
+
+def _current_user_id():
+    # backends may partition books by user; outside a logged-in request the
+    # default partition is used
+    if has_request_context() and current_user.is_authenticated:
+        return current_user.id
+    return None
+
+
+# processes that already started a warm-up (the master with --preload and
+# each forked worker have their own pid)
+_warmed_up = set()
+
+
+def warm_up_storage(app):
+    """Create the storage backend in a background thread so the first request
+    after a cold start doesn't pay for it.  Safe to call repeatedly."""
+    pid = os.getpid()
+    if pid in _warmed_up:
+        return
+    _warmed_up.add(pid)
+
+    def run():
+        with app.app_context():
+            try:
+                get_storage()
+            except Exception:
+                log.exception('Starting the storage backend failed')
+
+    Thread(target=run, name='storage-warm-up', daemon=True).start()
@@ -0,0 +1,231 @@
+import sys
+from bisect import bisect_left, bisect_right, insort
+
+from services.dashboard import STATUSES, Dashboard
+from services.search import SearchIndex, book_tokens
+
+
+def _by_row(book):
+    # books still waiting for the sheet to assign their row sort last
+    row = book.row
+    return sys.maxsize if row is None else row
+
+
+def sort_key(book):
+    """Position of a book in the all-books listing; also used as the
+    pagination cursor."""
+    return book.status, book.title, book.id
+
+
+class BookStore:
+    """Immutable, versioned index of the books loaded from the sheet.
+
+    Books are kept in a primary index keyed on ``id`` plus secondary indexes
+    for the lookups the routes make: all books of a user, a user's books with
+    a given status and a user's favourites.  Every index maps ``id -> book``
+    so queries cost time proportional to the size of the result.
+
+    A store is never modified once built.  Writers call ``evolve`` to get a
+    new store with the next ``version`` (only the index buckets they touch are
+    copied, the rest is shared) and publish it by assigning one attribute, so
+    readers can use whatever store they grabbed without any locking.  The
+    ``Book`` records are immutable as well and shared between versions.
+
+    The only things filled in after construction are per-user memos: the
+    ``Dashboard`` and the user's ``sort_key`` order used by ``page``.
+    ``evolve`` carries both over for users it didn't touch and patches the
+    sort order of those it did, so a write costs its author one rebuilt
+    dashboard and no re-sort.
+
+    Titles and authors are also kept in a ``SearchIndex``, copied on write the
+    same way.
+
+    Rows without an id (e.g. cleared rows) can't be addressed by the app and
+    are left out.
+    """
+
+    def __init__(self, books=(), version=0):
+        self.version = version
+        self._by_id = {}
+        self._by_user = {}
+        self._by_user_status = {}
+        self._favourites = {}
+        self._search = SearchIndex()
+        self._dashboards = {}
+        self._sorted = {}
+        # (old, new) pairs of the books an evolve changed, None otherwise
+        self._changes = None
+        # buckets this store created itself and may still change while it is
+        # being built; anything else is shared with an older version
+        self._owned = set()
+        for book in books:
+            self._put(book)
+        self._owned = None
+        self._search.freeze()
+
+    def evolve(self, put=(), remove=()):
+        """Return the next version of the store with ``remove`` (ids) dropped
+        and ``put`` (books) inserted or replaced."""
+        new = BookStore.__new__(BookStore)
+        new.version = self.version + 1
+        new._by_id = dict(self._by_id)
+        new._by_user = dict(self._by_user)
+        new._by_user_status = dict(self._by_user_status)
+        new._favourites = dict(self._favourites)
+        new._search = self._search.copy()
+        new._owned = set()
+        new._changes = []
+        for book_id in remove:
+            new._remove(book_id)
+        for book in put:
+            new._put(book)
+        touched = {b.user_id for change in new._changes for b in change if b is not None}
+        # readers may be filling in the memos of this store right now, so work
+        # from copies (taking one is atomic)
+        new._dashboards = {
+            user_id: dashboard for user_id, dashboard in dict(self._dashboards).items()
+            if user_id not in touched
+        }
+        new._sorted = {}
+        for user_id, keys in dict(self._sorted).items():
+            if user_id in touched:
+                keys = list(keys)
+                for old, book in new._changes:
+                    if old is not None and old.user_id == user_id:
+                        del keys[bisect_left(keys, sort_key(old))]
+                    if book is not None and book.user_id == user_id:
+                        insort(keys, sort_key(book))
+            new._sorted[user_id] = keys
+        new._owned = new._changes = None
+        new._search.freeze()
+        return new
+
+    def __len__(self):
+        return len(self._by_id)
+
+    def __contains__(self, book_id):
+        return book_id in self._by_id
+
+    @staticmethod
+    def _keys(book):
+        return book.user_id, (book.user_id, book.status), book.is_favourite
+
+    def _indexes(self, book):
+        user_key, status_key, favourite = self._keys(book)
+        yield 'user', self._by_user, user_key
+        yield 'status', self._by_user_status, status_key
+        if favourite:
+            yield 'favourite', self._favourites, user_key
+
+    def _writable(self, name, index, key):
+        # copy-on-write: clone a shared bucket before the first change
+        bucket = index.get(key)
+        if (name, key) not in self._owned:
+            bucket = index[key] = dict(bucket) if bucket else {}
+            self._owned.add((name, key))
+        return bucket
+
+    def _unindex(self, book):
+        book_id = book.id
+        for name, index, key in self._indexes(book):
+            if key in index:
+                bucket = self._writable(name, index, key)
+                bucket.pop(book_id, None)
+                if not bucket:
+                    del index[key]
+                    self._owned.discard((name, key))
+
+    def _put(self, book):
+        book_id = book.id
+        if book_id is None:
+            return
+        old = self._by_id.get(book_id)
+        if self._changes is not None:
+            self._changes.append((old, book))
+        if old is not None and self._keys(old) != self._keys(book):
+            self._unindex(old)
+        tokens = book_tokens(book)
+        old_tokens = book_tokens(old) if old is not None else set()
+        if tokens != old_tokens:
+            self._search.remove(book_id, old_tokens - tokens)
+            self._search.add(book_id, tokens - old_tokens)
+        # assigning to an existing key keeps its position, so every index
+        # stays in the order books were added (i.e. sheet row order)
+        self._by_id[book_id] = book
+        for name, index, key in self._indexes(book):
+            self._writable(name, index, key)[book_id] = book
+
+    def _remove(self, book_id):
+        book = self._by_id.pop(book_id, None)
+        if book is not None:
+            if self._changes is not None:
+                self._changes.append((book, None))
+            self._unindex(book)
+            self._search.remove(book_id, book_tokens(book))
+
+    def get(self, book_id):
+        return self._by_id.get(book_id)
+
+    def ids(self):
+        return self._by_id.keys()
+
+    def newest_first(self):
+        """Books from the bottom of the sheet upwards (most recent first)."""
+        return reversed(self._by_id.values())
+
+    # queries; results come back in sheet row order like the sheet itself
+    @staticmethod
+    def _ordered(bucket):
+        if not bucket:
+            return []
+        # buckets are almost always already in row order, which makes this sort
+        # linear; it only does real work after a book moved between buckets.
+        return sorted(bucket.values(), key=_by_row)
+
+    def all(self):
+        return list(self._by_id.values())
+
+    def for_user(self, user_id, status=None):
+        if status is None:
+            return self._ordered(self._by_user.get(user_id))
+        return self._ordered(self._by_user_status.get((user_id, status)))
+
+    def favourites(self, user_id):
+        return self._ordered(self._favourites.get(user_id))
+
+    def page(self, user_id, after=None, limit=None):
+        """A user's books in ``sort_key`` order, starting after the key
+        ``after`` and at most ``limit`` of them.  Returns ``(books, next, total)``
+        where ``next`` is the key to continue from (None on the last page)."""
+        keys = self._sorted.get(user_id)
+        if keys is None:
+            keys = self._sorted[user_id] = sorted(
+                sort_key(b) for b in self._by_user.get(user_id, {}).values()
+            )
+        start = bisect_right(keys, tuple(after)) if after else 0
+        end = len(keys) if limit is None else start + limit
+        books = [self._by_id[key[2]] for key in keys[start:end]]
+        return books, keys[end - 1] if end < len(keys) else None, len(keys)
+
+    def search(self, user_id, query, limit=20):
+        """A user's books matching ``query``, best matches first."""
+        hits = []
+        for book_id, score in self._search.search(query).items():
+            book = self._by_id.get(book_id)
+            if book is not None and book.user_id == user_id:
+                hits.append((-score, book.title.casefold(), book_id, book))
+        hits.sort()
+        return [hit[-1] for hit in hits[:limit]]
+
+    def dashboard(self, user_id):
+        dashboard = self._dashboards.get(user_id)
+        if dashboard is None:
+            # racing readers may both build it; they get equal results
+            dashboard = self._dashboards[user_id] = Dashboard(
+                self.for_user(user_id, 'Reading'),
+                self.for_user(user_id, 'Planned'),
+                len(self._by_user_status.get((user_id, 'Completed'), ())),
+                self.favourites(user_id),
+                [b for b in self.for_user(user_id) if b.status not in STATUSES],
+            )
+        return dashboard
@@ -0,0 +1,157 @@
+"""Bulk export and import of a user's books as CSV or JSON Lines.
+
+Both directions stream: exports are produced a line at a time and imports
+are read a record at a time and written in chunks, so neither holds the
+whole file in memory.
+"""
+import csv
+import io
+import json
+import logging
+
+from models import Book
+from services.activity import timestamp
+from services.dashboard import STATUSES
+
+log = logging.getLogger(__name__)
+
+# columns of an export, and what an import understands (ids and owners are
+# assigned on the way in)
+EXPORT_FIELDS = [f for f in Book.FIELDS if f != 'user_id']
+
+FORMATS = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+}
+
+# books per append call; one Sheets request each
+DEFAULT_CHUNK = 500
+# per-row problems reported back, at most
+MAX_ERRORS = 100
+
+
+def export_lines(books, fmt):
+    """Yield ``books`` as lines of CSV (with a header) or JSON Lines."""
+    if fmt == 'jsonl':
+        for book in books:
+            yield json.dumps({f: getattr(book, f) for f in EXPORT_FIELDS}, ensure_ascii=False) + '\n'
+        return
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def line(values):
+        writer.writerow(values)
+        text = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return text
+
+    yield line(EXPORT_FIELDS)
+    for book in books:
+        yield line(book.values(EXPORT_FIELDS))
+
+
+def read_records(stream, fmt):
+    """Yield ``(line number, dict)`` from a binary ``stream`` of CSV or JSON
+    Lines.  Lines that don't parse come back as ``(line number, None)``."""
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', errors='replace', newline='')
+    if fmt == 'jsonl':
+        for number, line in enumerate(text, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                record = None
+            yield number, record if isinstance(record, dict) else None
+        return
+    reader = csv.DictReader(text)
+    for record in reader:
+        # the header is line 1
+        yield reader.line_num, {(k or '').strip().lower(): v for k, v in record.items()}
+
+
+def normalize(record, user_id):
+    """Turn an imported record into book data for ``user_id``, parsed like
+    sheet rows are.  Raises ``ValueError`` for records that can't be kept."""
+    book = Book.parse({f: record.get(f) for f in EXPORT_FIELDS})
+    title = book.title.strip()
+    if not title:
+        raise ValueError('missing title')
+    status = next((s for s in STATUSES if s.lower() == book.status.strip().lower()), None)
+    if status is None:
+        if book.status.strip():
+            raise ValueError(f'unknown status {book.status!r}')
+        status = 'Planned'
+    total_pages = max(book.total_pages, 0)
+    current_page = max(book.current_page, 0)
+    if total_pages:
+        current_page = min(current_page, total_pages)
+    return dict(
+        book.as_dict(),
+        id=None,
+        title=title,
+        author=book.author.strip(),
+        status=status,
+        current_page=current_page,
+        total_pages=total_pages,
+        user_id=user_id,
+        created_at=book.created_at.strip() or timestamp(),
+    )
+
+
+def _key(book):
+    return book['title'].casefold(), book['author'].casefold()
+
+
+def import_books(storage, user_id, records, chunk_size=DEFAULT_CHUNK):
+    """Add ``records`` (from ``read_records``) to ``user_id``'s books,
+    skipping any whose title and author they already have (or that came
+    earlier in the file), ``chunk_size`` books per ``append_books`` call.
+
+    Yields a progress dict of counts after every chunk; the last one has
+    ``done`` set and lists the rejected lines under ``errors``.  Should
+    writing a chunk fail, the import stops there and the last dict says why
+    under ``error`` (``imported`` counts the books written before that)."""
+    seen = {(b.title.casefold(), b.author.casefold()) for b in storage.books_for_user(user_id)}
+    progress = {'read': 0, 'imported': 0, 'duplicates': 0, 'invalid': 0}
+    errors = []
+    chunk = []
+
+    def flush():
+        # False when the chunk couldn't be written
+        try:
+            storage.append_books(chunk)
+        except Exception as e:
+            log.exception('Importing books for user %s failed', user_id)
+            progress['error'] = f'Writing the books failed: {e}'
+            return False
+        progress['imported'] += len(chunk)
+        chunk.clear()
+        return True
+
+    for number, record in records:
+        progress['read'] += 1
+        try:
+            if record is None:
+                raise ValueError('not a valid record')
+            book = normalize(record, user_id)
+        except ValueError as e:
+            progress['invalid'] += 1
+            if len(errors) < MAX_ERRORS:
+                errors.append({'line': number, 'error': str(e)})
+            continue
+        key = _key(book)
+        if key in seen:
+            progress['duplicates'] += 1
+            continue
+        seen.add(key)
+        chunk.append(book)
+        if len(chunk) >= chunk_size:
+            if not flush():
+                break
+            yield dict(progress)
+    else:
+        if chunk:
+            flush()
+    yield dict(progress, errors=errors, done=True)
@@ -0,0 +1,149 @@
+import logging
+import random
+import socket
+import time
+from contextlib import contextmanager
+from queue import LifoQueue
+from threading import Lock
+
+import httplib2
+from google_auth_httplib2 import AuthorizedHttp
+from googleapiclient.errors import HttpError
+
+from services.metrics import SHEETS_CALLS, SHEETS_DURATION, SHEETS_RETRIES, add_timing
+
+log = logging.getLogger(__name__)
+
+# statuses worth another attempt; 429 means the request never ran, the 5xx
+# ones may or may not have been applied
+RETRY_QUOTA = {429}
+RETRY_SERVER = {500, 502, 503, 504}
+
+
+class TokenBucket:
+    """Thread-safe token bucket allowing ``per_minute`` calls a minute with
+    short bursts of up to ``burst``."""
+
+    def __init__(self, per_minute, burst=None):
+        self.rate = per_minute / 60.0
+        self.capacity = burst or max(1, per_minute // 10)
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = Lock()
+
+    def acquire(self, deadline=None):
+        """Take a token, sleeping until one is available.  Raises
+        ``TimeoutError`` if that would run past ``deadline`` (monotonic)."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            if deadline is not None and now + wait > deadline:
+                raise TimeoutError('Sheets API quota exhausted until past the request deadline')
+            time.sleep(wait)
+
+
+class HttpPool:
+    """Pool of authorized httplib2 connections.
+
+    ``httplib2.Http`` isn't thread-safe, so every request leases one for its
+    duration.  Connections are kept alive between requests; the most
+    recently used one is handed out first so idle ones don't go stale.
+    """
+
+    def __init__(self, credentials, size, timeout):
+        self.credentials = credentials
+        self.timeout = timeout
+        self._idle = LifoQueue()
+        for _ in range(size):
+            self._idle.put(None)
+
+    def _connect(self):
+        return AuthorizedHttp(self.credentials, http=httplib2.Http(timeout=self.timeout))
+
+    @contextmanager
+    def lease(self):
+        http = self._idle.get()
+        try:
+            if http is None:
+                http = self._connect()
+            yield http
+        except (socket.error, httplib2.HttpLib2Error):
+            # don't put a connection in an unknown state back
+            http = None
+            raise
+        finally:
+            self._idle.put(http)
+
+
+class SheetsTransport:
+    """Executes googleapiclient requests within the API quotas.
+
+    Reads and writes draw from separate token buckets sized to the per-minute
+    quotas.  Retryable failures (429, 5xx, dropped connections) are retried
+    with full-jitter exponential backoff, honouring ``Retry-After``, until the
+    request's deadline; a request that isn't idempotent (an append) is only
+    retried on 429, which guarantees it didn't run.  With ``credentials``
+    every call gets its own pooled connection; without (e.g. a stub service
+    in tests) the request's own ``http`` is used.
+    """
+
+    def __init__(self, credentials=None, read_per_minute=60, write_per_minute=60,
+                 deadline=30, max_backoff=16, pool_size=4, timeout=20):
+        self.reads = TokenBucket(read_per_minute)
+        self.writes = TokenBucket(write_per_minute)
+        self.deadline = deadline
+        self.max_backoff = max_backoff
+        self.pool = HttpPool(credentials, pool_size, timeout) if credentials else None
+
+    def execute(self, request, write=False, idempotent=True, bucket=True):
+        # e.g. 'sheets.spreadsheets.values.get'
+        method = getattr(request, 'methodId', None) or 'unknown'
+        start = time.perf_counter()
+        outcome = 'error'
+        try:
+            result = self._execute(request, method, write, idempotent, bucket)
+            outcome = 'ok'
+            return result
+        finally:
+            elapsed = time.perf_counter() - start
+            SHEETS_CALLS.inc(method, outcome)
+            SHEETS_DURATION.observe(elapsed, method)
+            add_timing('sheets', elapsed)
+
+    def _execute(self, request, method, write, idempotent, bucket):
+        deadline = time.monotonic() + self.deadline
+        attempt = 0
+        while True:
+            if bucket:
+                (self.writes if write else self.reads).acquire(deadline)
+            try:
+                if self.pool is None:
+                    return request.execute()
+                with self.pool.lease() as http:
+                    return request.execute(http=http)
+            except HttpError as e:
+                status = e.resp.status
+                if status not in RETRY_QUOTA and (not idempotent or status not in RETRY_SERVER):
+                    raise
+                retry_after = e.resp.get('retry-after')
+                error = e
+            except (socket.error, httplib2.HttpLib2Error) as e:
+                if not idempotent:
+                    raise
+                retry_after = None
+                error = e
+            delay = random.uniform(0, min(self.max_backoff, 2 ** attempt))
+            if retry_after and retry_after.isdigit():
+                delay = max(delay, int(retry_after))
+            if time.monotonic() + delay > deadline:
+                raise error
+            attempt += 1
+            SHEETS_RETRIES.inc(method)
+            log.warning('Sheets API call failed (%s); retry %s in %.1fs', error, attempt, delay)
+            time.sleep(delay)
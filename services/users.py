@@ -0,0 +1,187 @@
+import hmac
+import logging
+import time
+from threading import Lock
+
+from flask import current_app
+from googleapiclient.errors import HttpError
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from models import User
+from services.sheets import FIELDS, GoogleSheetClient, tab_for_user
+
+log = logging.getLogger(__name__)
+
+USERS_TAB = 'Users'
+USER_FIELDS = ['id', 'username', 'password_hash', 'created_at']
+
+# the account from AUTH_USERNAME / AUTH_PASSWORD
+CONFIGURED_USER_ID = 1
+
+# shortest time between re-reads of the users tab prompted by an unknown
+# username or id (e.g. registered through another worker)
+RELOAD_INTERVAL = 5
+
+MIN_PASSWORD = 8
+_USERNAME_CHARS = set('abcdefghijklmnopqrstuvwxyz0123456789._-')
+
+
+class UserDirectory:
+    """Accounts: the one configured through ``AUTH_USERNAME`` /
+    ``AUTH_PASSWORD`` (id 1, whose books stay on the original tab) plus those
+    registered since, kept in the spreadsheet's ``Users`` tab with
+    salted password hashes.
+
+    The tab is small and read into memory on first use; lookups of an unknown
+    name or id re-read it (at most every ``RELOAD_INTERVAL`` seconds) so
+    accounts created by another worker are found.  ``create`` also adds the
+    new user's books tab.
+    """
+
+    _instance = None
+    _lock = Lock()
+
+    def __init__(self, service=None, transport=None):
+        self.spreadsheet_id = current_app.config.get('GOOGLE_SHEET_ID')
+        self.service = service
+        self.transport = transport
+        self._write_lock = Lock()
+        self._by_id = None
+        self._by_name = {}
+        self._tab_exists = False
+        self._loaded_at = 0.0
+
+    @classmethod
+    def get_instance(cls):
+        with cls._lock:
+            if cls._instance is None:
+                cls._instance = UserDirectory()
+            return cls._instance
+
+    def _connect(self):
+        # borrow the sheet client's API objects (and quota) when first needed,
+        # so the configured account works without touching the sheet
+        if self.service is None:
+            sheet = GoogleSheetClient.get_instance()
+            self.service, self.transport = sheet.service, sheet.transport
+
+    def _load(self):
+        self._connect()
+        try:
+            result = self.transport.execute(
+                self.service.spreadsheets().values().get(
+                    spreadsheetId=self.spreadsheet_id, range=f'{USERS_TAB}!A2:D')
+            )
+        except HttpError as e:
+            if e.resp.status != 400:
+                raise
+            # no users tab yet ("Unable to parse range")
+            result = {}
+            self._tab_exists = False
+        else:
+            self._tab_exists = True
+        by_id, by_name = {}, {}
+        for row in result.get('values', []):
+            row = row + [''] * (len(USER_FIELDS) - len(row))
+            try:
+                user_id = int(row[0])
+            except ValueError:
+                continue
+            by_id[user_id] = (row[1], row[2])
+            by_name[row[1].lower()] = user_id
+        self._by_id, self._by_name = by_id, by_name
+        self._loaded_at = time.monotonic()
+
+    def _ensure_loaded(self, reload=False):
+        if self._by_id is None or (reload and time.monotonic() - self._loaded_at >= RELOAD_INTERVAL):
+            self._load()
+
+    def get(self, user_id):
+        """The ``User`` with ``user_id``, or None."""
+        if user_id == CONFIGURED_USER_ID:
+            return User(CONFIGURED_USER_ID, current_app.config['AUTH_USERNAME'])
+        self._ensure_loaded()
+        if user_id not in self._by_id:
+            self._ensure_loaded(reload=True)
+        account = self._by_id.get(user_id)
+        return User(user_id, account[0]) if account else None
+
+    def authenticate(self, username, password):
+        """The ``User`` these credentials belong to, or None."""
+        username = (username or '').strip()
+        password = password or ''
+        config = current_app.config
+        if username == config['AUTH_USERNAME']:
+            if hmac.compare_digest(password.encode(), config['AUTH_PASSWORD'].encode()):
+                return User(CONFIGURED_USER_ID, username)
+            return None
+        self._ensure_loaded()
+        if username.lower() not in self._by_name:
+            self._ensure_loaded(reload=True)
+        user_id = self._by_name.get(username.lower())
+        if user_id is None:
+            return None
+        name, password_hash = self._by_id[user_id]
+        if not check_password_hash(password_hash, password):
+            return None
+        return User(user_id, name)
+
+    def create(self, username, password):
+        """Register a new account and return its ``User``.  Raises
+        ``ValueError`` with a message for the user when the name is taken or
+        the credentials aren't acceptable."""
+        username = (username or '').strip()
+        if not username or len(username) > 64 or not set(username.lower()) <= _USERNAME_CHARS:
+            raise ValueError('Usernames are up to 64 letters, digits, dots, dashes or underscores.')
+        if len(password or '') < MIN_PASSWORD:
+            raise ValueError(f'Passwords need at least {MIN_PASSWORD} characters.')
+        if current_app.config.get('STORAGE_BACKEND') == 'sqlite':
+            # the SQLite store mirrors the default tab only, so a new user's
+            # books would never reach their own tab
+            raise ValueError('Accounts can only be added with the sheets storage backend.')
+        with self._write_lock:
+            # start from the current tab so names and ids stay unique
+            self._load()
+            if username.lower() in self._by_name or username == current_app.config['AUTH_USERNAME']:
+                raise ValueError('That username is taken.')
+            user_id = max(self._by_id, default=CONFIGURED_USER_ID) + 1
+            self._add_tabs(user_id)
+            row = [user_id, username, generate_password_hash(password),
+                   time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())]
+            # a retried append could register the account twice
+            self.transport.execute(self.service.spreadsheets().values().append(
+                spreadsheetId=self.spreadsheet_id,
+                range=f'{USERS_TAB}!A:D',
+                valueInputOption='RAW',
+                body={'values': [row]},
+            ), write=True, idempotent=False)
+            self._by_id[user_id] = (username, row[2])
+            self._by_name[username.lower()] = user_id
+        log.info('Registered user %s (%s)', user_id, username)
+        return User(user_id, username)
+
+    def _add_tabs(self, user_id):
+        # the user's books tab, and the users tab itself the first time round,
+        # each with its header row.  A books tab may be left over from a
+        # registration whose Users row never got written; with no account
+        # pointing at it, it is free to reuse.
+        tabs = {tab_for_user(user_id): FIELDS}
+        if not self._tab_exists:
+            tabs[USERS_TAB] = USER_FIELDS
+        result = self.transport.execute(self.service.spreadsheets().get(
+            spreadsheetId=self.spreadsheet_id, fields='sheets.properties.title',
+        ))
+        existing = {sheet['properties']['title'] for sheet in result.get('sheets', [])}
+        missing = [tab for tab in tabs if tab not in existing]
+        if missing:
+            self.transport.execute(self.service.spreadsheets().batchUpdate(
+                spreadsheetId=self.spreadsheet_id,
+                body={'requests': [{'addSheet': {'properties': {'title': tab}}} for tab in missing]},
+            ), write=True)
+        self.transport.execute(self.service.spreadsheets().values().batchUpdate(
+            spreadsheetId=self.spreadsheet_id,
+            body={'valueInputOption': 'RAW', 'data': [
+                {'range': f'{tab}!A1', 'values': [header]} for tab, header in tabs.items()
+            ]},
+        ), write=True)
+        self._tab_exists = True
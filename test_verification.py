@@ -6,45 +6,302 @@ os.environ.setdefault('AUTH_USERNAME', 'testuser')
 os.environ.setdefault('AUTH_PASSWORD', 'password')
 os.environ.setdefault('GOOGLE_SHEET_ID', 'fake-sheet')
 os.environ.setdefault('GOOGLE_CREDS_JSON', '{}')
+os.environ.setdefault('STORAGE_WARM_UP', '0')
+os.environ.setdefault('SHEETS_SNAPSHOT_PATH', '')
+
+import re
 
 from app import create_app
+from models import Book
+from services.dashboard import STATUSES, Dashboard
 
 # simple in-memory fake sheet client used during tests
 class FakeSheetClient:
+    epoch = 'fake'
+
     def __init__(self):
         self._books = []
+        self._version = 0
+
+    def is_ready(self):
+        return True
+
+    def wait_ready(self):
+        return
+
+    def partition(self, user_id):
+        # books carry their user_id, so one list serves every account
+        return self
+
+    def books_for_user(self, user_id, status=None):
+        return [b for b in self._books if b.user_id == user_id
+                and (status is None or b.status == status)]
 
-    def books_for_user(self, user_id):
-        return [b for b in self._books if b.get('user_id') == user_id]
+    def favourites_for_user(self, user_id):
+        return [b for b in self.books_for_user(user_id) if b.is_favourite]
 
     def fetch_all_books(self):
         return list(self._books)
 
-    def append_book(self, book_data):
-        book_data = book_data.copy()
+    def data_version(self):
+        return self._version
+
+    def search_books(self, user_id, query, limit=20):
+        words = query.lower().split()
+        return [b for b in self.books_for_user(user_id)
+                if all(w in f'{b.title} {b.author}'.lower() for w in words)][:limit]
+
+    def books_page(self, user_id, after=None, limit=None):
+        from services.store import sort_key
+        books = sorted(self.books_for_user(user_id), key=sort_key)
+        if after:
+            books = [b for b in books if sort_key(b) > tuple(after)]
+        if limit is None or len(books) <= limit:
+            return books, None, len(self.books_for_user(user_id))
+        return books[:limit], sort_key(books[limit - 1]), len(self.books_for_user(user_id))
+
+    def dashboard_for_user(self, user_id):
+        return Dashboard(
+            self.books_for_user(user_id, 'Reading'),
+            self.books_for_user(user_id, 'Planned'),
+            len(self.books_for_user(user_id, 'Completed')),
+            self.favourites_for_user(user_id),
+            [b for b in self.books_for_user(user_id) if b.status not in STATUSES],
+        )
+
+    def get_book(self, book_id):
+        return next((b for b in self._books if b.id == book_id), None)
+
+    def append_book(self, book_data, wait=True):
         book_data['id'] = len(self._books) + 1
-        self._books.append(book_data)
-        return book_data['id']
+        book = Book.parse(book_data)
+        self._books.append(book)
+        self._version += 1
+        return self._result(book.id, wait)
 
-    def update_book(self, book_id, updates):
-        for b in self._books:
-            if b.get('id') == book_id:
-                b.update(updates)
-                return True
-        return False
+    @staticmethod
+    def _result(value, wait):
+        # like the real backends, wait=False hands back a finished future
+        from services.storage import resolved
+        return value if wait else resolved(value)
 
-    def delete_book(self, book_id):
+    def append_books(self, books):
+        return [self.append_book(b) for b in books]
+
+    def update_book(self, book_id, updates, wait=True):
+        for i, b in enumerate(self._books):
+            if b.id == book_id:
+                self._books[i] = b.replace(**updates)
+                self._version += 1
+                return self._result(True, wait)
+        return self._result(False, wait)
+
+    def delete_book(self, book_id, wait=True):
         for i, b in enumerate(self._books):
-            if b.get('id') == book_id:
+            if b.id == book_id:
                 self._books.pop(i)
-                return True
-        return False
+                self._version += 1
+                return self._result(True, wait)
+        return self._result(False, wait)
+
+
+class _FakeRequest:
+    def __init__(self, fn):
+        self._fn = fn
+
+    def execute(self):
+        return self._fn()
+
+
+class FakeSheetsService:
+    """Tiny stand-in for the googleapiclient Sheets resource.  Rows are kept
+    per tab as lists of strings just like the real API returns them;
+    ``rows`` is the default tab."""
+
+    def __init__(self, header, rows=()):
+        self.tabs = {'Sheet1': [list(header)] + [list(r) for r in rows]}
+        self.calls = []
+        self.metadata = {}   # metadataId -> developer metadata
+
+    @property
+    def rows(self):
+        return self.tabs['Sheet1']
+
+    # resource chain: service.spreadsheets().values().<method>(...)
+    def spreadsheets(self):
+        return self
+
+    def values(self):
+        return self
+
+    def developerMetadata(self):
+        return self
+
+    def _tab(self, a1_range):
+        rows = self.tabs.get(a1_range.split('!')[0])
+        if rows is None:
+            import httplib2
+            from googleapiclient.errors import HttpError
+            raise HttpError(httplib2.Response({'status': 400}), b'Unable to parse range')
+        return rows
+
+    def search(self, spreadsheetId, body):
+        self.calls.append(('get', 'developerMetadata'))
+        key = body['dataFilters'][0]['developerMetadataLookup']['metadataKey']
+        return _FakeRequest(lambda: {'matchedDeveloperMetadata': [
+            {'developerMetadata': dict(m)} for m in self.metadata.values() if m['metadataKey'] == key
+        ]})
+
+    def _spreadsheet_batch_update(self, requests):
+        replies = []
+        for request in requests:
+            if 'deleteDimension' in request:
+                span = request['deleteDimension']['range']
+                rows = list(self.tabs.values())[span['sheetId']]
+                del rows[span['startIndex']:span['endIndex']]
+                replies.append({})
+            elif 'addSheet' in request:
+                title = request['addSheet']['properties']['title']
+                if title in self.tabs:
+                    import httplib2
+                    from googleapiclient.errors import HttpError
+                    raise HttpError(httplib2.Response({'status': 400}), b'already exists')
+                self.tabs[title] = []
+                replies.append({})
+            elif 'createDeveloperMetadata' in request:
+                meta = dict(request['createDeveloperMetadata']['developerMetadata'],
+                            metadataId=len(self.metadata) + 1)
+                self.metadata[meta['metadataId']] = meta
+                replies.append({'createDeveloperMetadata': {'developerMetadata': meta}})
+            else:
+                update = request['updateDeveloperMetadata']
+                meta_id = update['dataFilters'][0]['developerMetadataLookup']['metadataId']
+                self.metadata[meta_id]['metadataValue'] = update['developerMetadata']['metadataValue']
+                replies.append({})
+        return {'replies': replies}
+
+    @staticmethod
+    def _rows_of(a1_range):
+        match = re.search(r'!(?:[A-Z]+)?(\d+)?(?::[A-Z]+(\d+)?)?$', a1_range)
+        start = int(match.group(1)) if match and match.group(1) else 1
+        end = int(match.group(2)) if match and match.group(2) else None
+        return start, end
+
+    def _write_row(self, a1_range, values):
+        rows = self._tab(a1_range)
+        start, _ = self._rows_of(a1_range)
+        while len(rows) < start:
+            rows.append([])
+        rows[start - 1] = [str(v) for v in values]
+        return {'updatedRange': f'{a1_range.split("!")[0]}!A{start}:J{start}'}
+
+    def get(self, spreadsheetId, range=None, fields=None):
+        if range is None:
+            # spreadsheets().get(): the tabs
+            return _FakeRequest(lambda: {'sheets': [
+                {'properties': {'sheetId': i, 'title': title, 'gridProperties': {'rowCount': len(rows)}}}
+                for i, (title, rows) in enumerate(self.tabs.items())
+            ]})
+        self.calls.append(('get', range))
+        return _FakeRequest(lambda: {'values': self._values(range)})
+
+    def _values(self, a1_range):
+        start, end = self._rows_of(a1_range)
+        if a1_range.endswith('1:1'):
+            start, end = 1, 1
+        rows = self._tab(a1_range)[start - 1:end]
+        while rows and not any(rows[-1]):
+            rows = rows[:-1]
+        return [list(r) for r in rows]
+
+    @staticmethod
+    def _typed(value):
+        # what UNFORMATTED_VALUE gives for cells the API wrote USER_ENTERED
+        if value.upper() in ('TRUE', 'FALSE'):
+            return value.upper() == 'TRUE'
+        return int(value) if value.lstrip('-').isdigit() else value
+
+    def batchGet(self, spreadsheetId, ranges, valueRenderOption=None, dateTimeRenderOption=None):
+        self.calls.extend(('batchGet', r) for r in ranges)
+
+        def run():
+            value_ranges = []
+            for a1_range in ranges:
+                values = self._values(a1_range)
+                if valueRenderOption == 'UNFORMATTED_VALUE':
+                    values = [[self._typed(v) for v in row] for row in values]
+                value_ranges.append({'range': a1_range, 'values': values})
+            return {'valueRanges': value_ranges}
+        return _FakeRequest(run)
+
+    def append(self, spreadsheetId, range, valueInputOption, body):
+        self.calls.append(('append', range))
+
+        def run():
+            rows = self._tab(range)
+            last = len(rows)
+            while last > 1 and not any(rows[last - 1]):
+                last -= 1
+            del rows[last:]
+            start = last + 1
+            for values in body['values']:
+                rows.append([str(v) for v in values])
+            return {'updates': {'updatedRange': f'{range.split("!")[0]}!A{start}:J{len(rows)}'}}
+        return _FakeRequest(run)
+
+    def update(self, spreadsheetId, range, valueInputOption, body):
+        self.calls.append(('update', range))
+        return _FakeRequest(lambda: self._write_row(range, body['values'][0]))
+
+    def batchUpdate(self, spreadsheetId, body):
+        if 'requests' in body:
+            self.calls.append(('spreadsheetBatchUpdate', len(body['requests'])))
+            return _FakeRequest(lambda: self._spreadsheet_batch_update(body['requests']))
+        self.calls.append(('batchUpdate', len(body['data'])))
+        return _FakeRequest(lambda: {'responses': [
+            self._write_row(item['range'], item['values'][0]) for item in body['data']
+        ]})
+
+    def batchClear(self, spreadsheetId, body):
+        self.calls.append(('batchClear', len(body['ranges'])))
+
+        def run():
+            for a1_range in body['ranges']:
+                start, _ = self._rows_of(a1_range)
+                self._tab(a1_range)[start - 1] = []
+            return {'clearedRanges': list(body['ranges'])}
+        return _FakeRequest(run)
+
+    def clear(self, spreadsheetId, range):
+        self.calls.append(('clear', range))
+        start, _ = self._rows_of(range)
+
+        def run():
+            self._tab(range)[start - 1] = []
+            return {'clearedRange': f'Sheet1!A{start}:Z{start}'}
+        return _FakeRequest(run)
+
+
+class FakeDrive:
+    """Answers the ``files().get(fields='modifiedTime')`` change probe."""
+
+    def __init__(self):
+        self.modified_time = '2024-01-01T00:00:00Z'
+
+    def files(self):
+        return self
+
+    def get(self, fileId, fields):
+        return _FakeRequest(lambda: {'modifiedTime': self.modified_time})
 
 
 def patch_sheets(app):
     # replace the real client singleton with fake
-    from services import sheets
+    from services import sheets, users
+    from services.transport import SheetsTransport
     sheets.GoogleSheetClient._instance = FakeSheetClient()
+    users.UserDirectory._instance = users.UserDirectory(
+        FakeSheetsService(['id', 'username', 'password_hash', 'created_at']), SheetsTransport())
 
 
 class TestBookTracker(unittest.TestCase):
@@ -52,6 +309,10 @@ class TestBookTracker(unittest.TestCase):
         self.app = create_app()
         self.app.config['TESTING'] = True
         self.app.config['WTF_CSRF_ENABLED'] = False
+        import tempfile
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.app.config['ACTIVITY_DB_PATH'] = os.path.join(self.tmp.name, 'activity.db')
         self.client = self.app.test_client()
 
         with self.app.app_context():
@@ -75,6 +336,134 @@ class TestBookTracker(unittest.TestCase):
         self.assertEqual(resp.status_code, 200)
         self.assertIn(b'invalid', resp.data.lower())
 
+    def test_registered_users_get_their_own_tab(self):
+        from services import users
+        directory = users.UserDirectory._instance
+        self.app.config['REGISTRATION_OPEN'] = True
+        resp = self.client.post('/register', data=dict(username='alice', password='short'),
+                                follow_redirects=True)
+        self.assertIn(b'at least 8', resp.data)
+        resp = self.client.post('/register', data=dict(username='alice', password='correct horse'))
+        self.assertEqual(resp.status_code, 302)
+
+        tabs = directory.service.tabs
+        self.assertEqual(tabs['Users'][0], users.USER_FIELDS)
+        self.assertEqual(tabs['books_2'][0][0], 'id')
+        self.assertEqual(tabs['Users'][1][:2], ['2', 'alice'])
+        self.assertNotIn('correct horse', tabs['Users'][1][2])
+
+        with self.app.app_context():
+            self.assertEqual(directory.authenticate('Alice', 'correct horse').id, 2)
+            self.assertIsNone(directory.authenticate('alice', 'wrong password'))
+            with self.assertRaises(ValueError):
+                directory.create('alice', 'another password')
+        self.client.get('/logout')
+        self.assertIn(b'read', self.login('alice', 'correct horse').data.lower())
+
+        with self.app.app_context():
+            # a tab left behind by a registration whose Users row failed
+            tabs['books_3'] = [['id']]
+            self.assertEqual(directory.create('bob', 'correct horse').id, 3)
+            self.assertEqual(tabs['books_3'][0][1], 'title')
+
+            self.app.config['STORAGE_BACKEND'] = 'sqlite'
+            with self.assertRaisesRegex(ValueError, 'sheets storage backend'):
+                directory.create('carol', 'correct horse')
+
+    def test_export_and_import_stream_books(self):
+        import io
+        import json
+        from services import sheets
+        sheets.GoogleSheetClient._instance.append_book(
+            {'title': 'Dune', 'author': 'Frank Herbert', 'status': 'Reading', 'user_id': 1})
+        self.login('testuser', 'password')
+        resp = self.client.get('/export?format=csv')
+        self.assertIn('attachment', resp.headers['Content-Disposition'])
+        lines = resp.data.decode().splitlines()
+        self.assertEqual(lines[0].split(',')[:3], ['id', 'title', 'author'])
+        self.assertIn('Dune,Frank Herbert,Reading', lines[1])
+
+        self.app.config['IMPORT_CHUNK_SIZE'] = 1
+        body = lines[0] + '\n' + '\n'.join([
+            ',DUNE,frank herbert,Reading,0,0,FALSE,,',       # already there
+            ',Emma,Jane Austen,completed,400,300,TRUE,,',   # normalised
+            ',,Nobody,Planned,0,0,FALSE,,',                 # no title
+            ',Ubik,Philip K. Dick,,,,,,',
+            ',Ubik,Philip K. Dick,,,,,,',                   # twice in the file
+        ]) + '\n'
+        resp = self.client.post('/import', data=body, content_type='text/csv')
+        progress = [json.loads(line) for line in resp.data.decode().splitlines()]
+        self.assertEqual([p['imported'] for p in progress], [1, 2, 2])
+        self.assertEqual(progress[-1]['imported'], 2)
+        self.assertEqual(progress[-1]['duplicates'], 2)
+        self.assertEqual(progress[-1]['errors'], [{'line': 4, 'error': 'missing title'}])
+        books = {b.title: b for b in sheets.GoogleSheetClient._instance.books_for_user(1)}
+        self.assertEqual(books['Emma'].status, 'Completed')
+        self.assertEqual(books['Emma'].current_page, 300)
+        self.assertTrue(books['Emma'].is_favourite)
+        self.assertEqual(books['Ubik'].status, 'Planned')
+
+        jsonl = b'{"title": "Solaris", "author": "Stanislaw Lem"}\nnot json\n'
+        resp = self.client.post('/import', data={'file': (io.BytesIO(jsonl), 'books.jsonl')})
+        progress = json.loads(resp.data.decode().splitlines()[-1])
+        self.assertEqual((progress['imported'], progress['invalid']), (1, 1))
+        self.assertIn(b'"title": "Solaris"', self.client.get('/export?format=jsonl').data)
+
+        # a failed write ends the stream with a final line, not a cut-off body
+        fake = sheets.GoogleSheetClient._instance
+        append_books, calls = fake.append_books, []
+
+        def failing_append_books(books):
+            calls.append(len(books))
+            if len(calls) > 1:
+                raise RuntimeError('quota exceeded')
+            return append_books(books)
+        fake.append_books = failing_append_books
+        body = lines[0] + '\n,Kindred,Octavia Butler,,,,,,\n,Beloved,Toni Morrison,,,,,,\n'
+        resp = self.client.post('/import', data=body, content_type='text/csv')
+        progress = [json.loads(line) for line in resp.data.decode().splitlines()]
+        self.assertTrue(progress[-1]['done'])
+        self.assertEqual(progress[-1]['imported'], 1)
+        self.assertIn('quota exceeded', progress[-1]['error'])
+
+    def test_progress_is_logged_and_rolled_up(self):
+        from datetime import date
+        from services import sheets
+        from services.activity import get_activity_log
+        self.login('testuser', 'password')
+        self.client.post('/add_book', data=dict(title='Dune', status='Reading', total_pages=400))
+        book = sheets.GoogleSheetClient._instance.books_for_user(1)[0]
+        self.assertRegex(book.created_at, r'^\d{4}-\d\d-\d\dT')
+        for page in (50, 30, 120):
+            self.client.post(f'/book/{book.id}/update', data=dict(action='update_progress', current_page=page))
+        self.client.post(f'/book/{book.id}/update', data=dict(action='change_status', status='Completed'))
+        self.client.post(f'/book/{book.id}/update', data=dict(action='toggle_favourite'))
+
+        with self.app.app_context():
+            activity = get_activity_log()
+            stats = activity.stats(1)
+            events = list(activity._conn().execute('SELECT kind, book_id FROM events ORDER BY id'))
+        self.assertEqual([kind for kind, _ in events], ['added', 'progress', 'progress', 'progress', 'status', 'favourite'])
+        self.assertEqual({book_id for _, book_id in events}, {book.id})
+        # going back to page 30 doesn't count, going on to 120 adds 90
+        self.assertEqual(stats['totals']['pages'], 140)
+        self.assertEqual(stats['daily'][-1], (date.fromisoformat(book.created_at[:10]), 140))
+        self.assertEqual((stats['totals']['completed'], stats['completion_rate']), (1, 100))
+        self.assertEqual(stats['current_streak'], 1)
+        self.assertIn(b'140', self.client.get('/stats').data)
+
+    def test_streaks_come_from_daily_rollups(self):
+        from datetime import date
+        from services.activity import ActivityLog
+        activity = ActivityLog(os.path.join(self.tmp.name, 'streaks.db'))
+        rows = [(1, 'day', d, 10, 1, 0, 0, 0) for d in
+                ('2026-10-01', '2026-10-02', '2026-10-03', '2026-10-10', '2026-10-11')]
+        activity._conn().executemany('INSERT INTO rollups VALUES (?, ?, ?, ?, ?, ?, ?, ?)', rows)
+        stats = activity.stats(1, days=7, today=date(2026, 10, 12))
+        self.assertEqual((stats['current_streak'], stats['longest_streak']), (2, 3))
+        self.assertEqual(stats['pages_per_day'], 20 / 7)
+        self.assertEqual(activity.stats(1, today=date(2026, 10, 13))['current_streak'], 0)
+
     def test_add_book_logged_in(self):
         # Login first
         self.login('testuser', 'password')
@@ -90,5 +479,725 @@ class TestBookTracker(unittest.TestCase):
         self.assertEqual(resp.status_code, 200)
 
 
+    def test_writes_still_on_their_way_say_so_and_failures_show_up_later(self):
+        from concurrent.futures import Future
+        from services import sheets
+        fake = sheets.GoogleSheetClient._instance
+        self.login('testuser', 'password')
+        resp = self.client.post('/add_book', data=dict(title='Dune', status='Planned'),
+                                follow_redirects=True)
+        self.assertIn(b'Book added to tracking system', resp.data)
+
+        pending = Future()
+        fake.update_book = lambda book_id, updates, wait=True: pending
+        resp = self.client.post('/book/1/edit', data=dict(title='Dune', status='Reading'),
+                                follow_redirects=True)
+        self.assertIn(b'saving them to the sheet', resp.data)
+
+        pending.set_exception(RuntimeError('quota exceeded'))
+        resp = self.client.get('/')
+        self.assertIn(b'Saving &#34;Dune&#34; to the sheet failed', resp.data)
+        self.assertNotIn(b'to the sheet failed', self.client.get('/').data)
+
+    def test_dashboard_groups_books_by_status(self):
+        from services import sheets
+        fake = sheets.GoogleSheetClient._instance
+        for title, status in [('Dune', 'Planned'), ('Emma', 'Reading'), ('Ubik', 'Completed')]:
+            fake.append_book({'title': title, 'author': 'A', 'status': status, 'user_id': 1,
+                              'current_page': 0, 'total_pages': 100, 'is_favourite': False,
+                              'cover_image': '', 'created_at': ''})
+        self.login('testuser', 'password')
+        resp = self.client.get('/')
+        self.assertIn(b'Emma', resp.data)
+        self.assertIn(b'Dune', resp.data)
+        self.assertNotIn(b'Ubik', resp.data)
+
+        resp = self.client.get('/book/2')
+        self.assertIn(b'Emma', resp.data)
+
+
+    def test_loading_page_while_storage_warms_up(self):
+        from services import sheets
+        sheets.GoogleSheetClient._instance.is_ready = lambda: False
+        self.login('testuser', 'password')
+        resp = self.client.get('/')
+        self.assertEqual(resp.status_code, 503)
+        self.assertEqual(resp.headers['Retry-After'], '2')
+
+    def test_unchanged_pages_answer_304(self):
+        self.login('testuser', 'password')
+        resp = self.client.get('/all_books')
+        etag = resp.headers['ETag']
+        resp = self.client.get('/all_books', headers={'If-None-Match': etag})
+        self.assertEqual(resp.status_code, 304)
+
+        # a write changes the data version and so the ETag; the redirect
+        # target shows a flash message and stays out of the cache
+        resp = self.client.post('/add_book', data=dict(title='Solaris', status='Planned'),
+                                follow_redirects=True)
+        self.assertNotIn('ETag', resp.headers)
+        resp = self.client.get('/all_books', headers={'If-None-Match': etag})
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn(b'Solaris', resp.data)
+        self.assertNotEqual(resp.headers['ETag'], etag)
+
+        # so does a new asset build: the cached page would link to old files
+        import tempfile
+        from assets.build import build
+        etag = resp.headers['ETag']
+        self.app.config['ASSETS_DIR'] = dist = tempfile.mkdtemp()
+        build(dist)
+        resp = self.client.get('/all_books', headers={'If-None-Match': etag})
+        self.assertEqual(resp.status_code, 200)
+        self.assertNotEqual(resp.headers['ETag'], etag)
+
+    def test_search_page_and_fragment(self):
+        from services import sheets
+        sheets.GoogleSheetClient._instance.append_book(
+            {'title': 'Dune', 'author': 'Frank Herbert', 'status': 'Reading', 'user_id': 1})
+        self.login('testuser', 'password')
+        resp = self.client.get('/search?q=herbert')
+        self.assertIn(b'search-query', resp.data)
+        self.assertIn(b'Dune', resp.data)
+        resp = self.client.get('/search?q=austen&partial=1')
+        self.assertIn(b'NO_MATCHES', resp.data)
+        self.assertNotIn(b'<html', resp.data)
+
+    def test_all_books_pages_with_a_cursor(self):
+        from services import sheets
+        fake = sheets.GoogleSheetClient._instance
+        for title in ['Ubik', 'Dune', 'Emma']:
+            fake.append_book({'title': title, 'status': 'Planned', 'user_id': 1})
+        self.app.config['ALL_BOOKS_PAGE_SIZE'] = 2
+        self.login('testuser', 'password')
+        resp = self.client.get('/all_books')
+        self.assertIn(b'TOTAL: 3', resp.data)
+        self.assertIn(b'Dune', resp.data)
+        self.assertNotIn(b'Ubik', resp.data)
+        next_url = re.search(rb'href="(/all_books\?after=[^"]+)"', resp.data).group(1)
+        resp = self.client.get(next_url.decode())
+        self.assertIn(b'Ubik', resp.data)
+        self.assertNotIn(b'Dune', resp.data)
+
+        self.app.config['ALL_BOOKS_PAGE_SIZE'] = 0
+        resp = self.client.get('/all_books?after=garbage')
+        self.assertTrue(resp.is_streamed)
+        self.assertIn(b'Dune', resp.data)
+        self.assertIn(b'Ubik', resp.data)
+
+    def test_metrics_and_server_timing(self):
+        self.app.config['SERVER_TIMING'] = True
+        self.login('testuser', 'password')
+        resp = self.client.get('/favourites')
+        self.assertRegex(resp.headers['Server-Timing'], r'render;dur=[\d.]+, app;dur=[\d.]+')
+        # without a token configured there is no /metrics at all
+        self.assertEqual(self.client.get('/metrics').status_code, 404)
+        self.app.config['METRICS_TOKEN'] = 'secret'
+        self.assertEqual(self.client.get('/metrics').status_code, 401)
+        auth = {'Authorization': 'Bearer secret'}
+        resp = self.client.get('/metrics', headers=auth)
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn(b'books_http_requests_total{endpoint="main.favourites",method="GET",status="200"}',
+                      resp.data)
+        self.assertIn(b'books_template_render_seconds_bucket{template="favourites.html",le="+Inf"}',
+                      resp.data)
+
+        self.assertEqual(self.client.get('/metrics/profile?seconds=0', headers=auth).status_code, 404)
+        self.app.config['PROFILER_ENABLED'] = True
+        # being logged in is not enough to profile the process
+        self.assertEqual(self.client.get('/metrics/profile?seconds=0.05').status_code, 401)
+        resp = self.client.get('/metrics/profile?seconds=0.05', headers=auth)
+        self.assertEqual(resp.status_code, 200)
+
+    def test_covers_are_served_from_the_cache(self):
+        import tempfile
+        from services import sheets
+        from services.covers import CoverCache
+        sheets.GoogleSheetClient._instance.append_book(
+            {'title': 'Dune', 'status': 'Reading', 'user_id': 1,
+             'cover_image': 'https://covers.example/dune.jpg'})
+        cache = CoverCache(tempfile.mkdtemp(), 1024, 512)
+        # _fetch (and so Pillow) is stubbed out
+        cache.enabled = True
+        fetched = []
+        cache._fetch = lambda url: fetched.append(url) or (b'jpeg', '.jpg')
+        self.app.extensions['cover_cache'] = cache
+        self.login('testuser', 'password')
+        cover = re.search(rb'src="(/cover/1\?v=\w+)"', self.client.get('/').data).group(1)
+        # the first view is sent to the original while the cover is fetched
+        resp = self.client.get(cover.decode())
+        self.assertEqual(resp.headers['Location'], 'https://covers.example/dune.jpg')
+        self.assertIsNotNone(cache.fetch('https://covers.example/dune.jpg'))
+        for _ in range(2):
+            resp = self.client.get(cover.decode())
+            self.assertEqual(resp.data, b'jpeg')
+            self.assertIn('immutable', resp.headers['Cache-Control'])
+            resp.close()
+        self.assertEqual(fetched, ['https://covers.example/dune.jpg'])
+
+        # least recently used covers go once the cache is over budget
+        cache._store('other', b'x' * 1024, '.jpg')
+        self.assertEqual(list(cache._entries), ['other'])
+
+        cache._fetch = lambda url: (_ for _ in ()).throw(ValueError('down'))
+        cache._entries.clear()
+        self.assertIsNone(cache.fetch('https://covers.example/dune.jpg'))
+        resp = self.client.get(cover.decode())
+        self.assertEqual(resp.status_code, 302)
+        self.assertEqual(resp.headers['Location'], 'https://covers.example/dune.jpg')
+
+        # without Pillow nothing is fetched at all
+        cache.enabled = False
+        cache._failed.clear()
+        self.assertIsNone(cache.get('https://covers.example/other.jpg'))
+        self.assertEqual(cache._queued, set())
+
+    def test_stylesheet_is_built_from_the_templates(self):
+        import gzip
+        import tempfile
+        from assets import tailwind
+        from assets.build import BuildError, build
+        self.assertIn(':hover', tailwind.compile_class('hover:-translate-y-1')[2])
+        self.assertIn('rgb(255 255 255 / 0.1)', tailwind.compile_class('bg-white/10')[2])
+        self.assertIsNone(tailwind.compile_class('not-a-utility'))
+
+        dist = tempfile.mkdtemp()
+        manifest = build(dist)
+        self.assertRegex(manifest['app.css'], r'^app\.[0-9a-f]{12}\.css$')
+
+        self.assertIn(b'cdn.tailwindcss.com', self.client.get('/login').data)
+        self.app.config['ASSETS_DIR'] = dist
+        page = self.client.get('/login').data
+        self.assertNotIn(b'cdn.tailwindcss.com', page)
+        self.assertIn(f'/assets/{manifest["app.css"]}'.encode(), page)
+        # no vendored fonts in this tree, so they still come from Google
+        self.assertIn(b'fonts.googleapis.com', page)
+
+        resp = self.client.get(f'/assets/{manifest["app.css"]}', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+        self.assertIn('immutable', resp.headers['Cache-Control'])
+        self.assertIn(b'.tracking-tighter{', gzip.decompress(resp.get_data()))
+        resp.close()
+        self.assertEqual(self.client.get('/assets/manifest.json').status_code, 404)
+
+        # a class the compiler doesn't know fails the build
+        templates = tempfile.mkdtemp()
+        with open(os.path.join(templates, 'page.html'), 'w') as f:
+            f.write('<div class="flex not-a-utility"></div>')
+        with self.assertRaisesRegex(BuildError, 'not-a-utility'):
+            build(tempfile.mkdtemp(), templates=templates)
+
+
+class TestGoogleSheetClientCache(unittest.TestCase):
+    def setUp(self):
+        from services.sheets import FIELDS, GoogleSheetClient
+        self.app = create_app()
+        # the fakes answer instantly; don't let the read quota slow tests down
+        self.app.config['SHEETS_READ_QUOTA'] = 600
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        self.service = FakeSheetsService(FIELDS, [
+            ['1', 'Dune', 'Frank Herbert', 'Reading', '10', '400', 'FALSE', '1', '', ''],
+            ['2', 'Emma', 'Jane Austen', 'Planned', '0', '300', 'TRUE', '1', '', ''],
+        ])
+        self.drive = FakeDrive()
+        self.sheet = GoogleSheetClient(service=self.service, drive=self.drive)
+        self.sheet.warm_up()
+
+    def tearDown(self):
+        self.ctx.pop()
+
+    def full_reads(self):
+        return [c for c in self.service.calls if c == ('batchGet', 'Sheet1!A2:J')]
+
+    def test_writes_patch_cache_without_reloading(self):
+        new_id = self.sheet.append_book({'title': 'Ubik', 'user_id': 1, 'status': 'Planned'})
+        self.assertEqual(new_id, 3)
+        self.sheet.update_book(1, {'current_page': 50})
+        self.sheet.delete_book(2)
+        self.assertEqual(len(self.full_reads()), 1)
+
+        books = {b.id: b for b in self.sheet.books_for_user(1)}
+        self.assertEqual(sorted(books), [1, 3])
+        self.assertEqual(books[3].row, 4)
+        self.assertEqual(books[1].current_page, 50)
+
+    def test_unexpected_append_row_triggers_reload(self):
+        # a row added through the Sheets UI shifts where our append lands
+        self.service.rows.append(['9', 'Solaris', 'Stanislaw Lem', 'Planned', '0', '200', 'FALSE', '1', '', ''])
+        self.sheet.append_book({'title': 'Ubik', 'user_id': 1})
+        self.assertEqual(len(self.full_reads()), 2)
+        self.assertIn(9, [b.id for b in self.sheet.fetch_all_books()])
+
+    def test_writes_follow_rows_moved_in_the_sheet(self):
+        # a row inserted above ours in the Sheets UI moves every book down
+        self.service.rows.insert(1, ['9', 'Solaris', 'Stanislaw Lem', 'Planned', '0', '200', 'FALSE', '1', '', ''])
+        self.assertTrue(self.sheet.update_book(2, {'current_page': 5}))
+        self.assertEqual([r[:2] for r in self.service.rows[1:]], [['9', 'Solaris'], ['1', 'Dune'], ['2', 'Emma']])
+        self.assertEqual(self.service.rows[3][4], '5')
+        self.assertEqual(self.sheet.get_book(2).row, 4)
+
+        # a book deleted in the Sheets UI isn't written back over another
+        del self.service.rows[2]
+        self.assertFalse(self.sheet.update_book(1, {'current_page': 7}))
+        self.assertEqual([r[:2] for r in self.service.rows[1:]], [['9', 'Solaris'], ['2', 'Emma']])
+        self.assertEqual(self.service.rows[2][4], '5')
+
+    def test_refresh_skips_download_when_sheet_unchanged(self):
+        self.sheet._refresh()
+        self.assertEqual(len(self.full_reads()), 1)
+
+        # an edit made in the Sheets UI bumps modifiedTime
+        self.service.rows[1][1] = 'Dune Messiah'
+        self.drive.modified_time = '2024-01-02T00:00:00Z'
+        self.sheet._refresh()
+        self.assertEqual(len(self.full_reads()), 2)
+        self.assertEqual(self.sheet.get_book(1).title, 'Dune Messiah')
+
+    def test_own_writes_dont_trigger_a_download(self):
+        batch_update = self.service.batchUpdate
+
+        def bumping_batch_update(**kwargs):
+            # like Drive, any edit moves modifiedTime
+            self.drive.modified_time = '2024-01-03T00:00:00Z'
+            return batch_update(**kwargs)
+        self.service.batchUpdate = bumping_batch_update
+        self.sheet.update_book(1, {'current_page': 20})
+        self.sheet._refresh()
+        self.assertEqual(len(self.full_reads()), 1)
+
+    def test_write_queue_coalesces_a_burst(self):
+        # holding the write lock keeps the flusher out until everything is queued
+        with self.sheet._write_lock:
+            futures = [
+                self.sheet.append_book({'title': 'Ubik', 'user_id': 1}, wait=False),
+                self.sheet.append_book({'title': 'Solaris', 'user_id': 1}, wait=False),
+                self.sheet.update_book(1, {'current_page': 20}, wait=False),
+                self.sheet.update_book(1, {'current_page': 30}, wait=False),
+                self.sheet.update_book(3, {'status': 'Reading'}, wait=False),
+                self.sheet.delete_book(2, wait=False),
+            ]
+        self.assertEqual([f.result(timeout=5) for f in futures], [3, 4, True, True, True, True])
+        writes = [c for c in self.service.calls if c[0] not in ('get', 'batchGet')]
+        self.assertEqual(writes, [('append', 'Sheet1!A:Z'), ('batchUpdate', 1), ('batchClear', 1)])
+        self.assertEqual(self.service.rows[1][4], '30')
+        self.assertEqual(self.service.rows[3][3], 'Reading')
+        self.assertEqual(self.sheet.get_book(4).row, 5)
+
+    def test_writes_return_while_a_slow_flush_is_sending(self):
+        import time
+        from threading import Event
+        append, sending, release = self.service.append, Event(), Event()
+
+        def slow_append(**kwargs):
+            request = append(**kwargs)
+            run = request._fn
+            request._fn = lambda: sending.set() or release.wait(5) and run()
+            return request
+        self.service.append = slow_append
+        first = self.sheet.append_book({'title': 'Ubik', 'user_id': 1}, wait=False)
+        self.assertTrue(sending.wait(5))
+
+        began = time.monotonic()
+        second = self.sheet.append_book({'title': 'Solaris', 'user_id': 1}, wait=False)
+        # Ubik's append is on its way: these follow it once its row is known
+        update = self.sheet.update_book(3, {'current_page': 7}, wait=False)
+        delete = self.sheet.delete_book(3, wait=False)
+        edit = self.sheet.update_book(1, {'current_page': 50}, wait=False)
+        self.assertLess(time.monotonic() - began, 0.5)
+        self.assertFalse(first.done())
+
+        release.set()
+        self.assertEqual(first.result(timeout=5), 3)
+        self.assertEqual([f.result(timeout=5) for f in (second, update, delete, edit)],
+                         [4, True, True, True])
+        self.assertEqual(self.service.rows[3], [])
+        self.assertEqual(self.service.rows[4][1], 'Solaris')
+        self.assertEqual(self.service.rows[1][4], '50')
+        self.assertIsNone(self.sheet.get_book(3))
+        self.assertEqual(self.sheet.get_book(4).row, 5)
+
+    def test_seeding_a_cold_client_skips_books_already_there(self):
+        import contextlib
+        import io
+        import time
+        from seed_data import seed_data
+        from services.sheets import GoogleSheetClient
+        self.service.rows[1][1] = '1984'
+        batch_get = self.service.batchGet
+
+        def slow_batch_get(*args, **kwargs):
+            request = batch_get(*args, **kwargs)
+            return _FakeRequest(lambda: time.sleep(0.3) or request.execute())
+        self.service.batchGet = slow_batch_get
+        GoogleSheetClient._instance = GoogleSheetClient(service=self.service, drive=self.drive)
+        GoogleSheetClient._instance.start_warm_up()
+        self.addCleanup(setattr, GoogleSheetClient, '_instance', None)
+        with contextlib.redirect_stdout(io.StringIO()):
+            seed_data()
+        titles = [row[1] for row in self.service.rows[1:]]
+        self.assertEqual(titles.count('1984'), 1)
+        self.assertEqual(len(titles), 11)
+
+    def test_snapshot_makes_restart_ready_without_download(self):
+        import tempfile
+        from services.sheets import GoogleSheetClient
+        with tempfile.TemporaryDirectory() as tmp:
+            self.sheet.snapshot_path = os.path.join(tmp, 'snapshot.jsonl')
+            self.sheet._save_snapshot()
+
+            self.app.config['SHEETS_SNAPSHOT_PATH'] = self.sheet.snapshot_path
+            restarted = GoogleSheetClient(service=self.service, drive=self.drive)
+            self.assertTrue(restarted._restore_snapshot())
+            self.assertEqual(restarted.get_book(2).title, 'Emma')
+            self.assertEqual(restarted.get_book(2).row, 3)
+
+            # the sheet didn't change, so reconciling skips the download
+            restarted.warm_up()
+            self.assertEqual(len(self.full_reads()), 1)
+
+    def test_shared_dir_keeps_workers_in_step(self):
+        import tempfile
+        from services.sheets import GoogleSheetClient
+        with tempfile.TemporaryDirectory() as tmp:
+            self.app.config['SHEETS_SHARED_DIR'] = tmp
+            first = GoogleSheetClient(service=self.service, drive=self.drive)
+            first.warm_up()
+            second = GoogleSheetClient(service=self.service, drive=self.drive)
+            second.warm_up()
+            self.assertEqual(first.epoch, second.epoch)
+
+            first.update_book(1, {'current_page': 99}, wait=False)
+            self.assertEqual(second.get_book(1).current_page, 99)
+            self.assertEqual(second.data_version(), first.data_version())
+            # ids are handed out across workers, not per process
+            self.assertEqual(first.append_book({'title': 'Ubik', 'user_id': 1}), 3)
+            self.assertEqual(second.shared.allocate_id(3), 4)
+
+    def test_partitions_keep_to_their_own_tab(self):
+        from services.sheets import FIELDS
+        self.service.tabs['books_2'] = [list(FIELDS)]
+        other = self.sheet.partition(2)
+        self.assertIs(self.sheet.partition(2), other)
+        self.assertIs(other.transport, self.sheet.transport)
+        other.warm_up()
+        self.assertEqual(other.append_book({'title': 'Ubik', 'user_id': 2}), 1)
+        self.assertEqual(self.service.tabs['books_2'][1][1], 'Ubik')
+        self.assertEqual(len(self.service.rows), 3)
+        self.assertEqual([b.title for b in other.books_for_user(2)], ['Ubik'])
+
+    def test_partitions_in_use_by_a_request_are_not_evicted(self):
+        from services.sheets import FIELDS, GoogleSheetClient
+        for user_id in (2, 3):
+            self.service.tabs[f'books_{user_id}'] = [list(FIELDS)]
+        self.sheet.max_partitions = 1
+        GoogleSheetClient._instance = self.sheet
+        self.addCleanup(setattr, GoogleSheetClient, '_instance', None)
+        with self.app.test_request_context('/'):
+            other = GoogleSheetClient.get_instance(2)
+            other.warm_up()
+            other.append_book({'title': 'Ubik', 'user_id': 2})
+            self.sheet.partition(3).warm_up()
+            # the request still holds user 2's client: it stays and keeps its books
+            self.assertIn(2, self.sheet._partitions)
+            self.assertEqual([b.title for b in other.books_for_user(2)], ['Ubik'])
+            self.assertTrue(other.update_book(1, {'current_page': 5}))
+        # released when the request tears down, then evicted as the excess
+        self.assertEqual(other._leases, 0)
+        self.assertEqual(list(self.sheet._partitions), [3])
+        self.assertEqual(self.service.tabs['books_2'][1][4], '5')
+
+    def test_compaction_removes_blank_rows_and_keeps_ids_unique(self):
+        self.service.rows[2:2] = [[], ['7', 'Ubik', 'Philip K. Dick', 'Planned', '0', '0', 'FALSE', '1', '', ''], []]
+        self.sheet.compact_threshold = 0
+        self.sheet._load_cache(force=True)
+        self.assertEqual(self.sheet.get_book(2).row, 6)
+
+        # deleting the newest book must not free its id
+        self.sheet.delete_book(7)
+        self.assertEqual(self.service.metadata[1]['metadataValue'], '8')
+        self.assertEqual(self.sheet.compact(), 3)
+        self.assertEqual([r[0] for r in self.service.rows[1:]], ['1', '2'])
+        self.assertEqual([(b.id, b.row) for b in self.sheet.fetch_all_books()], [(1, 2), (2, 3)])
+
+        # a fresh process gets the counter from the sheet
+        from services.sheets import GoogleSheetClient
+        restarted = GoogleSheetClient(service=self.service, drive=self.drive)
+        restarted.warm_up()
+        self.assertEqual(restarted.append_book({'title': 'Solaris', 'user_id': 1}), 8)
+        self.assertEqual(restarted.get_book(8).row, 4)
+
+    def test_large_tabs_load_in_typed_chunks(self):
+        from services.sheets import GoogleSheetClient
+        self.service.rows.append(['3', 'Ubik', 'Philip K. Dick', 'Planned', '0', '250', 'TRUE', '1', '', ''])
+        self.app.config['SHEETS_LOAD_CHUNK_ROWS'] = 2
+        # a cold start plans the chunks from the tab's size
+        client = GoogleSheetClient(service=self.service, drive=self.drive)
+        self.service.calls.clear()
+        client.warm_up()
+        chunks = [c[1] for c in self.service.calls if c[0] == 'batchGet']
+        self.assertEqual(chunks, ['Sheet1!A2:J3', 'Sheet1!A4:J'])
+        self.assertEqual([(b.id, b.row) for b in client.fetch_all_books()], [(1, 2), (2, 3), (3, 4)])
+        ubik = client.get_book(3)
+        self.assertEqual((ubik.total_pages, ubik.is_favourite), (250, True))
+
+        # reloads from the rows the cache knows of; the open-ended last
+        # chunk still picks up rows added in the meantime
+        self.service.rows.append(['4', 'Solaris', 'Stanislaw Lem', 'Planned', '0', '0', 'FALSE', '1', '', ''])
+        self.service.calls.clear()
+        client._load_cache(force=True)
+        chunks = [c[1] for c in self.service.calls if c[0] == 'batchGet']
+        self.assertEqual(chunks, ['Sheet1!A2:J3', 'Sheet1!A4:J'])
+        self.assertEqual(client.get_book(4).row, 5)
+
+    def test_indexes_follow_updates(self):
+        self.sheet.update_book(2, {'status': 'Reading', 'is_favourite': False})
+        self.assertEqual([b.id for b in self.sheet.books_for_user(1, 'Reading')], [1, 2])
+        self.assertEqual(self.sheet.books_for_user(1, 'Planned'), [])
+        self.assertEqual(self.sheet.favourites_for_user(1), [])
+        self.sheet.delete_book(1)
+        self.assertIsNone(self.sheet.get_book(1))
+        self.assertEqual([b.id for b in self.sheet.books_for_user(1)], [2])
+
+
+class TestFakeSheetsServer(unittest.TestCase):
+    def test_client_round_trips_through_http(self):
+        from bench.fake_sheets import FakeSheetsServer, connect, generate_rows
+        app = create_app()
+        with FakeSheetsServer(generate_rows(50)) as server, app.app_context():
+            client = connect(server)
+            client.warm_up()
+            self.assertEqual(len(client.fetch_all_books()), 50)
+            self.assertEqual(client.append_book({'title': 'Ubik', 'user_id': 1}), 51)
+            client.update_book(3, {'current_page': 7})
+            client.delete_book(4)
+        self.assertEqual(server.sheet.rows[51][1], 'Ubik')
+        self.assertEqual(server.sheet.rows[3][4], '7')
+        self.assertEqual(server.sheet.rows[4], [])
+        self.assertEqual(server.calls['values.append'], 1)
+
+
+class TestSheetsTransport(unittest.TestCase):
+    def failing(self, *statuses):
+        import httplib2
+        from googleapiclient.errors import HttpError
+        attempts = []
+
+        def run():
+            attempts.append(1)
+            if len(attempts) <= len(statuses):
+                raise HttpError(httplib2.Response({'status': statuses[len(attempts) - 1]}), b'')
+            return {'ok': True}
+        return _FakeRequest(run), attempts
+
+    def test_retries_quota_and_server_errors(self):
+        from services.transport import SheetsTransport
+        transport = SheetsTransport(max_backoff=0.01)
+        request, attempts = self.failing(429, 503)
+        self.assertEqual(transport.execute(request), {'ok': True})
+        self.assertEqual(len(attempts), 3)
+
+    def test_appends_are_not_retried_after_server_errors(self):
+        from googleapiclient.errors import HttpError
+        from services.transport import SheetsTransport
+        transport = SheetsTransport(max_backoff=0.01)
+        request, attempts = self.failing(503)
+        with self.assertRaises(HttpError):
+            transport.execute(request, write=True, idempotent=False)
+        self.assertEqual(len(attempts), 1)
+
+    def test_token_bucket_gives_up_at_the_deadline(self):
+        import time
+        from services.transport import TokenBucket
+        bucket = TokenBucket(60, burst=1)
+        bucket.acquire()
+        with self.assertRaises(TimeoutError):
+            bucket.acquire(deadline=time.monotonic() + 0.1)
+
+
+class TestBook(unittest.TestCase):
+    def test_parse_normalises_sheet_values(self):
+        book = Book.parse({'id': '3', 'title': 'Dune', 'current_page': '50',
+                           'total_pages': '400', 'is_favourite': 'TRUE'}, row=4)
+        self.assertEqual((book.id, book.current_page, book.row), (3, 50, 4))
+        self.assertTrue(book.is_favourite)
+        self.assertEqual(book.progress, 12)
+        self.assertEqual(book.replace(current_page='400').progress, 100)
+        with self.assertRaises(AttributeError):
+            book.title = 'Emma'
+
+
+class TestBookStore(unittest.TestCase):
+    def test_evolve_leaves_published_version_untouched(self):
+        from services.store import BookStore
+        dune = Book(id=1, user_id=1, status='Reading', is_favourite=True, row=2)
+        emma = Book(id=2, user_id=1, status='Planned', row=3)
+        old = BookStore([dune, emma])
+        new = old.evolve(put=[emma.replace(status='Reading')], remove=[1])
+
+        self.assertEqual(new.version, old.version + 1)
+        self.assertEqual([b.id for b in old.for_user(1, 'Reading')], [1])
+        self.assertEqual([b.id for b in old.favourites(1)], [1])
+        self.assertEqual([b.id for b in new.for_user(1, 'Reading')], [2])
+        self.assertEqual(new.favourites(1), [])
+        self.assertEqual(new.for_user(1, 'Planned'), [])
+        self.assertEqual(old.get(2).status, 'Planned')
+
+    def test_dashboards_survive_writes_by_other_users(self):
+        from services.store import BookStore
+        dune = Book(id=1, user_id=1, status='Reading', row=2)
+        emma = Book(id=2, user_id=1, status='Planned', row=3)
+        ubik = Book(id=3, user_id=2, status='Reading', row=4)
+        store = BookStore([dune, emma, ubik])
+        first, other = store.dashboard(1), store.dashboard(2)
+        self.assertEqual((first.hero_book, first.queue_books), (dune, (emma,)))
+        self.assertIs(store.dashboard(1), first)
+
+        store = store.evolve(put=[emma.replace(status='Completed')])
+        self.assertIs(store.dashboard(2), other)
+        self.assertEqual(store.dashboard(1).completed_count, 1)
+        self.assertEqual(store.dashboard(1).queue_books, ())
+
+    def test_dashboard_queues_other_statuses_last(self):
+        from services.store import BookStore
+        paused = Book(id=1, user_id=1, status='Paused', row=2)
+        blank = Book(id=2, user_id=1, status='', row=3)
+        dune = Book(id=3, user_id=1, status='Reading', row=4)
+        emma = Book(id=4, user_id=1, status='Reading', row=5)
+        ubik = Book(id=5, user_id=1, status='Planned', row=6)
+        dashboard = BookStore([paused, blank, dune, emma, ubik]).dashboard(1)
+        self.assertEqual(dashboard.hero_book, dune)
+        self.assertEqual(dashboard.queue_books, (emma, ubik, paused, blank))
+
+    def test_search_matches_prefixes_and_typos(self):
+        from services.store import BookStore
+        store = BookStore([
+            Book(id=1, user_id=1, title='Dune Messiah', author='Frank Herbert', row=2),
+            Book(id=2, user_id=1, title='Emma', author='Jane Austen', row=3),
+            Book(id=3, user_id=2, title='Dune', author='Frank Herbert', row=4),
+        ])
+        self.assertEqual([b.id for b in store.search(1, 'dun herb')], [1])
+        self.assertEqual([b.id for b in store.search(1, 'austin')], [2])
+        self.assertEqual(store.search(1, 'solaris'), [])
+
+        store = store.evolve(put=[store.get(2).replace(title='Persuasion')])
+        self.assertEqual(store.search(1, 'emma'), [])
+        self.assertEqual([b.id for b in store.search(1, 'persua')], [2])
+
+    def test_page_keeps_the_sort_order_across_writes(self):
+        from services.store import BookStore
+        store = BookStore([
+            Book(id=1, user_id=1, status='Reading', title='Ubik', row=2),
+            Book(id=2, user_id=1, status='Planned', title='Emma', row=3),
+            Book(id=3, user_id=1, status='Planned', title='Dune', row=4),
+        ])
+        books, after, total = store.page(1, limit=2)
+        self.assertEqual(([b.id for b in books], total), ([3, 2], 3))
+        self.assertEqual([b.id for b in store.page(1, after)[0]], [1])
+
+        store = store.evolve(put=[Book(id=4, user_id=1, status='Planned', title='Solaris', row=5)],
+                             remove=[3])
+        self.assertEqual([b.id for b in store.page(1)[0]], [2, 4, 1])
+
+
+class TestSQLiteBookStore(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+        from services.sheets import FIELDS, GoogleSheetClient
+        from services.sqlite_store import SQLiteBookStore
+        self.tmp = tempfile.TemporaryDirectory()
+        self.app = create_app()
+        self.app.config['SQLITE_PATH'] = os.path.join(self.tmp.name, 'books.db')
+        # the fakes answer instantly; don't let the read quota slow tests down
+        self.app.config['SHEETS_READ_QUOTA'] = 600
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        self.service = FakeSheetsService(FIELDS, [
+            ['1', 'Dune', 'Frank Herbert', 'Reading', '10', '400', 'FALSE', '1', '', ''],
+        ])
+        GoogleSheetClient._instance = GoogleSheetClient(service=self.service, drive=FakeDrive())
+        GoogleSheetClient._instance.warm_up()
+        self.store = SQLiteBookStore()
+
+    def tearDown(self):
+        from services.sheets import GoogleSheetClient
+        self.store.close()
+        GoogleSheetClient._instance = None
+        self.ctx.pop()
+        self.tmp.cleanup()
+
+    def test_writes_are_local_then_pushed_through_outbox(self):
+        self.assertEqual(self.store.get_book(1).title, 'Dune')
+        calls = len(self.service.calls)
+        new_id = self.store.append_book({'title': 'Ubik', 'user_id': 1, 'status': 'Planned'})
+        self.store.update_book(1, {'is_favourite': True})
+        self.assertEqual([b.id for b in self.store.favourites_for_user(1)], [1])
+
+        self.store.sync(pull=False)
+        self.assertGreater(len(self.service.calls), calls)
+        self.assertEqual(self.service.rows[2][:2], [str(new_id), 'Ubik'])
+        self.assertEqual(self.service.rows[1][6], 'True')
+        self.assertEqual(self.store._conn().execute('SELECT COUNT(*) FROM outbox').fetchone()[0], 0)
+
+    def test_search_uses_the_fts_index(self):
+        self.store.append_book({'title': 'Solitude', 'author': 'Gabriel García Márquez', 'user_id': 1})
+        self.assertEqual([b.title for b in self.store.search_books(1, 'marquez')], ['Solitude'])
+        self.assertEqual([b.title for b in self.store.search_books(1, 'sol')], ['Solitude'])
+        self.assertEqual([b.title for b in self.store.search_books(1, 'dnue')], ['Dune'])
+        self.store.update_book(1, {'title': 'Children of Dune'})
+        self.assertEqual([b.title for b in self.store.search_books(1, 'children')], ['Children of Dune'])
+        self.assertEqual(self.store.search_books(2, 'dune'), [])
+
+    def test_dashboard_is_rebuilt_after_a_write(self):
+        dashboard = self.store.dashboard_for_user(1)
+        self.assertEqual(dashboard.hero_book.title, 'Dune')
+        self.assertIs(self.store.dashboard_for_user(1), dashboard)
+        self.store.update_book(1, {'status': 'Completed'})
+        self.assertIsNone(self.store.dashboard_for_user(1).hero_book)
+        self.assertEqual(self.store.dashboard_for_user(1).completed_count, 1)
+        # books with other or no status stay in the queue
+        self.store.update_book(1, {'status': 'Paused'})
+        blank = self.store.append_book({'title': 'Ubik', 'user_id': 1, 'status': ''})
+        self.assertEqual([b.id for b in self.store.dashboard_for_user(1).queue_books], [1, blank])
+
+    def test_outbox_drains_with_a_shared_cache(self):
+        from services.sheets import GoogleSheetClient
+        self.app.config['SHEETS_SHARED_DIR'] = os.path.join(self.tmp.name, 'shared')
+        GoogleSheetClient._instance = GoogleSheetClient(service=self.service, drive=FakeDrive())
+        GoogleSheetClient._instance.warm_up()
+        self.assertTrue(self.store.update_book(1, {'current_page': 42}, wait=False).result())
+        new_id = self.store.append_book({'title': 'Ubik', 'user_id': 1}, wait=False).result()
+        self.assertFalse(self.store.delete_book(99, wait=False).result())
+
+        self.store.sync(pull=False)
+        self.assertEqual(self.store._conn().execute('SELECT COUNT(*) FROM outbox').fetchone()[0], 0)
+        self.assertEqual(self.service.rows[1][4], '42')
+        self.assertEqual(self.service.rows[2][:2], [str(new_id), 'Ubik'])
+
+    def test_bootstrap_waits_for_a_sheet_still_loading(self):
+        import time
+        from services.sheets import GoogleSheetClient
+        from services.sqlite_store import SQLiteBookStore
+        batch_get = self.service.batchGet
+
+        def slow_batch_get(*args, **kwargs):
+            request = batch_get(*args, **kwargs)
+            return _FakeRequest(lambda: time.sleep(0.3) or request.execute())
+        self.service.batchGet = slow_batch_get
+        # not warmed up: the store starts while the sheet is still loading
+        GoogleSheetClient._instance = GoogleSheetClient(service=self.service, drive=FakeDrive())
+        GoogleSheetClient._instance.start_warm_up()
+        self.app.config['SQLITE_PATH'] = os.path.join(self.tmp.name, 'cold.db')
+        store = SQLiteBookStore()
+        try:
+            self.assertEqual([b.title for b in store.fetch_all_books()], ['Dune'])
+            self.assertEqual(store.append_book({'title': 'Ubik', 'user_id': 1}), 2)
+            store.sync()
+        finally:
+            store.close()
+        self.assertEqual([r[:2] for r in self.service.rows[1:]], [['1', 'Dune'], ['2', 'Ubik']])
+        self.assertEqual([b.title for b in store.fetch_all_books()], ['Dune', 'Ubik'])
+
+
 if __name__ == '__main__':
     unittest.main()